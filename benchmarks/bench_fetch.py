@@ -0,0 +1,219 @@
+"""
+End-to-end benchmark of the OpenStack provider against a local stand-in
+
+Runs fetch, format and publish of a site whose Keystone, Nova, Glance and
+GOCDB are served by benchmarks/fake_cloud.py, and reports the wall time,
+API calls and peak RSS of every phase. Results can be stored as a baseline
+and later runs checked against it: API calls must not grow, time and
+memory must stay within the tolerance.
+
+    python benchmarks/bench_fetch.py [--scenario large] [--latency 0.005]
+    python benchmarks/bench_fetch.py --save-baseline
+    python benchmarks/bench_fetch.py --check
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import fake_cloud
+import yaml
+
+from cloud_info_provider import core
+from cloud_info_provider.formatters.glue import GLUE21Json
+from cloud_info_provider.providers.openstack import OpenStackProvider
+from cloud_info_provider.publishers.file import FilePublisher
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+SCENARIOS = {
+    "small": {"vos": 5, "flavors": 200, "images": 2000, "servers": 1000},
+    "large": {"vos": 50, "flavors": 2000, "images": 20000, "servers": 10000},
+}
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_site_config(path, cloud):
+    site_config = {
+        "gocdb": "SITE-BENCH",
+        "endpoint": cloud.auth_url,
+        "vos": [
+            {"name": f"vo{i}.example.org", "auth": {"project_id": project}}
+            for i, project in enumerate(cloud.catalogue.projects)
+        ],
+    }
+    with open(path, "w") as f:
+        yaml.safe_dump(site_config, f)
+
+
+def get_opts(cloud, workdir, args):
+    site_config = os.path.join(workdir, "site.yaml")
+    write_site_config(site_config, cloud)
+    parser = core.get_parser(
+        {"openstack": OpenStackProvider}, ["glue21json"], {"file": FilePublisher}
+    )
+    return parser.parse_args(
+        [
+            "--os-auth-url",
+            cloud.auth_url,
+            "--os-auth-type",
+            "password",
+            "--os-username",
+            "bench",
+            "--os-password",
+            "secret",
+            "--os-user-domain-name",
+            "Default",
+            "--os-project-domain-name",
+            "Default",
+            "--gocdb-url",
+            cloud.gocdb_url,
+            "--share-workers",
+            str(args.share_workers),
+            "--publisher",
+            "file",
+            "--output-file",
+            os.path.join(workdir, "cloud-info.json"),
+            site_config,
+        ]
+    )
+
+
+def measure(cloud, func):
+    cloud.reset_calls()
+    start = time.perf_counter()
+    result = func()
+    wall = time.perf_counter() - start
+    calls = cloud.reset_calls()
+    return result, {
+        "wall": round(wall, 3),
+        "calls": dict(sorted(calls.items())),
+        "peak_rss_mib": round(peak_rss_mib(), 1),
+    }
+
+
+def run(args):
+    catalogue = fake_cloud.Catalogue(**SCENARIOS[args.scenario])
+    results = {}
+    with fake_cloud.FakeCloud(
+        catalogue,
+        latency=args.latency,
+        max_limit=args.max_limit,
+        microversion=args.nova_microversion,
+    ) as cloud:
+        with tempfile.TemporaryDirectory() as workdir:
+            opts = get_opts(cloud, workdir, args)
+            provider = core.get_site_providers(OpenStackProvider, opts)[0]
+            formatter = GLUE21Json()
+            publisher = FilePublisher(opts)
+            glue, results["fetch"] = measure(cloud, provider.fetch)
+            _, results["format"] = measure(cloud, lambda: formatter.format(opts, glue))
+            _, results["publish"] = measure(
+                cloud, lambda: publisher.publish_glue(formatter, opts, glue)
+            )
+    results["objects"] = {name: len(objs) for name, objs in glue.items()}
+    return results
+
+
+def scenario_key(args):
+    return (
+        f"{args.scenario}-latency{args.latency}-workers{args.share_workers}"
+        f"-limit{args.max_limit}-nova{args.nova_microversion}"
+    )
+
+
+def report(results):
+    for phase in ("fetch", "format", "publish"):
+        r = results[phase]
+        print(
+            f"{phase:8} {r['wall']:8.3f}s  {sum(r['calls'].values()):6} calls  "
+            f"peak RSS {r['peak_rss_mib']:.1f} MiB"
+        )
+        for call, count in r["calls"].items():
+            print(f"    {count:6}  {call}")
+    print("objects: " + ", ".join(f"{k}={v}" for k, v in results["objects"].items()))
+
+
+def check(results, baseline, tolerance):
+    """Returns the regressions of results compared to the baseline"""
+    regressions = []
+    if results["objects"] != baseline["objects"]:
+        regressions.append(
+            f"objects: {results['objects']} instead of {baseline['objects']}"
+        )
+    for phase in ("fetch", "format", "publish"):
+        r, b = results[phase], baseline[phase]
+        for call, count in r["calls"].items():
+            if count > b["calls"].get(call, 0):
+                regressions.append(
+                    f"{phase}: {count} calls to {call}, "
+                    f"baseline {b['calls'].get(call, 0)}"
+                )
+        for metric in ("wall", "peak_rss_mib"):
+            if r[metric] > b[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{phase}: {metric} {r[metric]}, baseline {b[metric]}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenario", choices=SCENARIOS, default="small")
+    parser.add_argument(
+        "--latency", type=float, default=0.005, help="Seconds added per request."
+    )
+    parser.add_argument(
+        "--max-limit", type=int, default=1000, help="Nova maximum page size."
+    )
+    parser.add_argument(
+        "--nova-microversion",
+        default="2.96",
+        help="Nova maximum microversion, before 2.61 extra specs are not listed.",
+    )
+    parser.add_argument("--share-workers", type=int, default=1)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="Allowed increase of time and memory over the baseline.",
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    report(results)
+
+    try:
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+    key = scenario_key(args)
+    if args.save_baseline:
+        baselines[key] = results
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline saved as {key}")
+    elif args.check:
+        if key not in baselines:
+            sys.exit(f"No baseline for {key}")
+        regressions = check(results, baselines[key], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark of the GLUE 2.1 JSON serialization of a large catalogue
+
+Compares the per-class serializers of the formatter with dumping every
+object by reflection, as the formatter used to do.
+
+    python benchmarks/bench_formatter.py [--objects 50000]
+"""
+
+import argparse
+import time
+
+from cloud_info_provider import glue
+from cloud_info_provider.formatters import glue as glue_formatter
+
+
+def build_catalogue(n):
+    """Builds n Glue objects, mostly images and instance types"""
+    objs = []
+    for i in range(n):
+        if i % 2:
+            o = glue.CloudComputingImage(
+                id=f"image-{i}",
+                name=f"Image {i}",
+                marketplace_url=f"https://appdb.example.org/images/{i}",
+                osPlatform="amd64",
+                osName="Ubuntu",
+                osVersion="24.04",
+                other_info={"base_mpuri": f"https://appdb.example.org/{i}"},
+            )
+        elif i % 10:
+            o = glue.CloudComputingInstanceType(
+                id=f"flavor-{i}", name=f"m{i}", cpu=i % 64, ram=i % 256, disk=20
+            )
+        else:
+            o = glue.Share(id=f"share-{i}", project_id=f"project-{i}", total_vm=i)
+        o.add_association("Share", "share-0")
+        o.add_association("CloudComputingEndpoint", "endpoint")
+        objs.append(o)
+    return objs
+
+
+def timeit(dump, objs, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for o in objs:
+            dump(o)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--objects", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    objs = build_catalogue(args.objects)
+    formatter = glue_formatter.GLUE21Json()
+    for o in objs:
+        assert formatter.dump_glue_object(o) == glue_formatter.reflection_dump(o)
+
+    reflection = timeit(glue_formatter.reflection_dump, objs, args.repeat)
+    compiled = timeit(formatter.dump_glue_object, objs, args.repeat)
+    print(f"objects:     {args.objects}")
+    print(f"reflection:  {reflection:.3f}s")
+    print(f"serializers: {compiled:.3f}s")
+    print(f"speedup:     {reflection / compiled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
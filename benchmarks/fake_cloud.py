@@ -0,0 +1,411 @@
+"""
+In-process stand-in for the Keystone, Nova, Glance and GOCDB APIs
+
+Serves a synthetic catalogue over HTTP with a configurable latency per
+request, and counts the requests received by API call.
+"""
+
+import bisect
+import collections
+import datetime
+import http.server
+import json
+import re
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlencode, urlparse
+
+TOKEN_TTL = datetime.timedelta(hours=1)
+
+# Statuses of the synthetic servers, in proportion
+SERVER_STATUSES = ["ACTIVE"] * 16 + ["SHUTOFF"] * 3 + ["SUSPENDED"]
+
+GPU_SPECS = {
+    "Accelerator:Number": "2",
+    "Accelerator:Vendor": "NVIDIA",
+    "Accelerator:Model": "A100",
+}
+
+IMAGE_SCHEMA = {
+    "name": "image",
+    "properties": {
+        "id": {"type": "string"},
+        "name": {"type": ["null", "string"]},
+        "status": {"type": "string"},
+        "visibility": {"type": "string"},
+        "checksum": {"type": ["null", "string"]},
+        "file": {"type": "string"},
+    },
+    "additionalProperties": {"type": "string"},
+    "links": [],
+}
+
+
+class Catalogue:
+    """Synthetic OpenStack resources
+
+    Every VO has its own project. Images are public, servers are spread
+    over the projects and one of every ten flavors is private to one of
+    the projects.
+    """
+
+    def __init__(self, vos=50, flavors=2000, images=20000, servers=10000):
+        self.projects = [f"project-{i:04d}" for i in range(vos)]
+        self.flavors = []
+        for i in range(flavors):
+            flavor = {
+                "id": f"flavor-{i:05d}",
+                "name": f"m{i}.large",
+                "vcpus": 1 + i % 64,
+                "ram": 512 * (1 + i % 256),
+                "disk": 20,
+                "os-flavor-access:is_public": bool(i % 10),
+                "links": [],
+            }
+            if not flavor["os-flavor-access:is_public"]:
+                flavor["project"] = self.projects[i % vos] if vos else None
+            self.flavors.append(flavor)
+        self.extra_specs = {
+            f["id"]: dict(GPU_SPECS) if i % 50 == 0 else {"hw:cpu_policy": "shared"}
+            for i, f in enumerate(self.flavors)
+        }
+        self.images = [
+            {
+                "id": str(uuid.UUID(int=i)),
+                "name": f"Image {i}",
+                "status": "active",
+                "visibility": "public",
+                "checksum": f"{i:032x}",
+                "file": f"/v2/images/{uuid.UUID(int=i)}/file",
+                "os_distro": "ubuntu",
+                "os_version": "24.04",
+                "architecture": "x86_64",
+                "vmcatcher_event_ad_mpuri": f"https://appdb.example.org/{i}",
+            }
+            for i in range(images)
+        ]
+        # images are encoded once, as they are listed by every project
+        self.encoded_images = [json.dumps(i) for i in self.images]
+        self.servers = collections.defaultdict(list)
+        for i in range(servers):
+            project = self.projects[i % vos]
+            self.servers[project].append(
+                {"id": f"server-{i:06d}", "status": SERVER_STATUSES[i % 20]}
+            )
+
+
+class FakeCloud:
+    """HTTP server for a Catalogue, to be used as a context manager
+
+    `latency` seconds are added to every request, `max_limit` is the
+    maximum number of resources returned by Nova in a single page and
+    `microversion` the maximum Nova microversion.
+    """
+
+    def __init__(
+        self,
+        catalogue,
+        latency=0,
+        max_limit=1000,
+        microversion="2.96",
+        gocdb_services=1000,
+    ):
+        self.catalogue = catalogue
+        self.latency = latency
+        self.max_limit = max_limit
+        self.microversion = microversion
+        self.gocdb_services = gocdb_services
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), self._handler_class()
+        )
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self.auth_url = f"{self.url}/identity/v3"
+        self.gocdb_url = f"{self.url}/gocdb/"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_calls(self):
+        with self._lock:
+            calls = self.calls
+            self.calls = collections.Counter()
+        return calls
+
+    def _handler_class(self):
+        cloud = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                cloud.handle(self, "GET")
+
+            def do_POST(self):
+                cloud.handle(self, "POST")
+
+        return Handler
+
+    # API calls by method and path template, with the handler of each
+    ROUTES = [
+        ("POST", "/identity/v3/auth/tokens", "auth_tokens"),
+        ("GET", "/identity/v3/", "identity_version"),
+        ("GET", "/compute/v2.1/", "compute_version"),
+        ("GET", "/compute/v2.1/flavors/detail", "flavors"),
+        ("GET", "/compute/v2.1/flavors/{id}/os-extra_specs", "extra_specs"),
+        ("GET", "/compute/v2.1/os-quota-sets/{id}", "quotas"),
+        ("GET", "/compute/v2.1/servers", "servers"),
+        ("GET", "/image/v2/schemas/image", "image_schema"),
+        ("GET", "/image/v2/images", "images"),
+        ("GET", "/gocdb/", "gocdb"),
+    ]
+
+    ROUTE_PATTERNS = [
+        (
+            method,
+            re.compile(
+                re.escape(path.rstrip("/")).replace(r"\{id\}", "([^/]+)") + "/?"
+            ),
+            f"{method} {path}",
+            name,
+        )
+        for method, path, name in ROUTES
+    ]
+
+    def handle(self, request, method):
+        time.sleep(self.latency)
+        url = urlparse(request.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(request.headers.get("Content-Length") or 0)
+        body = json.loads(request.rfile.read(length)) if length else None
+        for route_method, pattern, call, name in self.ROUTE_PATTERNS:
+            match = pattern.fullmatch(url.path)
+            if route_method == method and match:
+                with self._lock:
+                    self.calls[call] += 1
+                project = self._tokens.get(request.headers.get("X-Auth-Token"))
+                status, headers, content = getattr(self, name)(
+                    request.headers, query, body, project, *match.groups()
+                )
+                break
+        else:
+            with self._lock:
+                self.calls[f"{method} (not found)"] += 1
+            status, headers, content = 404, {}, {"error": url.path}
+        if isinstance(content, (dict, list)):
+            content = json.dumps(content).encode()
+            headers.setdefault("Content-Type", "application/json")
+        request.send_response(status)
+        for k, v in headers.items():
+            request.send_header(k, v)
+        request.send_header("Content-Length", str(len(content)))
+        request.end_headers()
+        request.wfile.write(content)
+
+    # Keystone
+
+    def identity_version(self, request_headers, query, body, project):
+        return (
+            200,
+            {},
+            {
+                "version": {
+                    "id": "v3.14",
+                    "status": "stable",
+                    "updated": "2020-04-07T00:00:00Z",
+                    "links": [{"rel": "self", "href": f"{self.auth_url}/"}],
+                    "media-types": [
+                        {
+                            "base": "application/json",
+                            "type": "application/vnd.openstack.identity-v3+json",
+                        }
+                    ],
+                }
+            },
+        )
+
+    def auth_tokens(self, request_headers, query, body, project):
+        identity = body["auth"]["identity"]
+        if "token" in identity["methods"]:
+            if identity["token"]["id"] not in self._tokens:
+                return 401, {}, {"error": {"code": 401, "message": "Bad token"}}
+        scope = body["auth"].get("scope", {}).get("project", {})
+        project_id = scope.get("id") or (self.catalogue.projects or [None])[0]
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._tokens[token] = project_id
+        now = datetime.datetime.now(datetime.timezone.utc)
+        domain = {"id": "default", "name": "Default"}
+        endpoints = [
+            ("compute", f"{self.url}/compute/v2.1"),
+            ("image", f"{self.url}/image"),
+            ("identity", self.auth_url),
+        ]
+        return (
+            201,
+            {"X-Subject-Token": token},
+            {
+                "token": {
+                    "methods": identity["methods"],
+                    "issued_at": now.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                    "expires_at": (now + TOKEN_TTL).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                    "user": {"id": "bench", "name": "bench", "domain": domain},
+                    "project": {"id": project_id, "name": project_id, "domain": domain},
+                    "roles": [{"id": "member", "name": "member"}],
+                    "catalog": [
+                        {
+                            "type": service_type,
+                            "name": service_type,
+                            "id": service_type,
+                            "endpoints": [
+                                {
+                                    "id": f"{service_type}-public",
+                                    "interface": "public",
+                                    "region": "RegionOne",
+                                    "region_id": "RegionOne",
+                                    "url": url,
+                                }
+                            ],
+                        }
+                        for service_type, url in endpoints
+                    ],
+                }
+            },
+        )
+
+    # Nova
+
+    def compute_version(self, request_headers, query, body, project):
+        return (
+            200,
+            {},
+            {
+                "version": {
+                    "id": "v2.1",
+                    "status": "CURRENT",
+                    "version": self.microversion,
+                    "min_version": "2.1",
+                    "updated": "2013-07-23T11:33:21Z",
+                    "links": [{"rel": "self", "href": f"{self.url}/compute/v2.1/"}],
+                }
+            },
+        )
+
+    def _page(self, resources, query, key):
+        """Returns a page of resources as Nova does, with a link to the next"""
+        limit = min(int(query.get("limit", self.max_limit)), self.max_limit)
+        start = 0
+        if "marker" in query:
+            ids = [r["id"] for r in resources]
+            start = ids.index(query["marker"]) + 1
+        page = resources[start : start + limit]
+        content = {key: page}
+        if len(page) == limit:
+            next_query = dict(query, marker=page[-1]["id"], limit=limit)
+            content[f"{key}_links"] = [
+                {"rel": "next", "href": f"?{urlencode(next_query)}"}
+            ]
+        return content
+
+    def _microversion(self, request_headers):
+        """Returns the requested Nova microversion as a tuple"""
+        version = request_headers.get("X-OpenStack-Nova-API-Version") or "2.1"
+        if version == "latest":
+            version = self.microversion
+        return tuple(int(v) for v in version.split("."))
+
+    def flavors(self, request_headers, query, body, project):
+        inline_specs = self._microversion(request_headers) >= (2, 61)
+        flavors = []
+        for f in self.catalogue.flavors:
+            if f.get("project", project) == project:
+                flavor = {k: v for k, v in f.items() if k != "project"}
+                if inline_specs:
+                    flavor["extra_specs"] = self.catalogue.extra_specs[f["id"]]
+                flavors.append(flavor)
+        return 200, {}, self._page(flavors, query, "flavors")
+
+    def extra_specs(self, request_headers, query, body, project, flavor_id):
+        return 200, {}, {"extra_specs": self.catalogue.extra_specs[flavor_id]}
+
+    def quotas(self, request_headers, query, body, project, project_id):
+        return (
+            200,
+            {},
+            {
+                "quota_set": {
+                    "id": project_id,
+                    "instances": 100,
+                    "cores": 400,
+                    "ram": 1024000,
+                    "key_pairs": 100,
+                    "server_groups": 10,
+                    "server_group_members": 10,
+                }
+            },
+        )
+
+    def servers(self, request_headers, query, body, project):
+        servers = self.catalogue.servers.get(project, [])
+        if "status" in query:
+            servers = [s for s in servers if s["status"] == query["status"]]
+        content = self._page(servers, query, "servers")
+        content["servers"] = [
+            {"id": s["id"], "name": s["id"], "links": []} for s in content["servers"]
+        ]
+        return 200, {}, content
+
+    # Glance
+
+    def image_schema(self, request_headers, query, body, project):
+        return 200, {}, IMAGE_SCHEMA
+
+    def images(self, request_headers, query, body, project):
+        # every image is active, so the status filter is not checked and
+        # the marker is the index of the previous image
+        limit = int(query.get("limit", 25))
+        indexes = [
+            i
+            for i, image in enumerate(self.catalogue.images)
+            if query.get("visibility", image["visibility"]) == image["visibility"]
+            and query.get("owner", image.get("owner")) == image.get("owner")
+        ]
+        start = 0
+        if "marker" in query:
+            start = bisect.bisect_right(indexes, int(uuid.UUID(query["marker"])))
+        indexes = indexes[start : start + limit]
+        page = [self.catalogue.encoded_images[i] for i in indexes]
+        content = f'{{"images": [{", ".join(page)}]'
+        if len(page) == limit:
+            next_query = dict(query, marker=str(uuid.UUID(int=indexes[-1])))
+            content += f', "next": "/v2/images?{urlencode(next_query)}"'
+        return 200, {"Content-Type": "application/json"}, f"{content}}}".encode()
+
+    # GOCDB
+
+    def gocdb(self, request_headers, query, body, project):
+        services = []
+        for i in range(self.gocdb_services):
+            url = self.auth_url if i == self.gocdb_services // 2 else f"{self.url}/{i}"
+            services.append(
+                f'<SERVICE_ENDPOINT PRIMARY_KEY="{i}G0">'
+                f"<SITENAME>SITE-{i}</SITENAME><URL>{url}</URL>"
+                "<ENDPOINTS/></SERVICE_ENDPOINT>"
+            )
+        content = f"<results>{''.join(services)}</results>".encode()
+        return 200, {"Content-Type": "application/xml"}, content
@@ -1,47 +1,29 @@
 import argparse
+import concurrent.futures
+import importlib.metadata
 import logging
+import os
+import sys
+import time
 
 import cloud_info_provider
-from stevedore import driver, extension
+from cloud_info_provider import deadline, diff, http_stats, tracing
 
 
-def get_providers():
-    def _handle_exception(*args):
-        mgr, entry_point, exception = args
-        logging.getLogger("stevedore.extension").error(
-            (("Cannot load '%s': %s") % (entry_point, exception))
-        )
-
-    mgr = extension.ExtensionManager(
-        namespace="cip.providers",
-        on_load_failure_callback=_handle_exception,
-        propagate_map_exceptions=True,
-    )
-    return dict((x.name, x.plugin) for x in mgr)
-
-
-def get_formatters():
-    mgr = extension.ExtensionManager(
-        namespace="cip.formatters",
-    )
-    return [x.name for x in mgr]
+def get_plugins(namespace):
+    """Returns the entry points of the namespace by name, without loading them"""
+    return {ep.name: ep for ep in importlib.metadata.entry_points(group=namespace)}
 
 
-def get_publishers():
-    mgr = extension.ExtensionManager(
-        namespace="cip.publishers",
-    )
-    return dict((x.name, x.plugin) for x in mgr)
+def load_plugin(entry_point):
+    try:
+        return entry_point.load()
+    except Exception as e:
+        logging.getLogger(__name__).error("Cannot load '%s': %s", entry_point, e)
+        raise
 
 
-def get_parser(providers, formatters, publishers):
-    parser = argparse.ArgumentParser(
-        description="Cloud Information System provider",
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        fromfile_prefix_chars="@",
-        conflict_handler="resolve",
-    )
-
+def _add_plugin_arguments(parser, providers, formatters, publishers):
     parser.add_argument(
         "--version", action="version", version=f"{cloud_info_provider.__version__}"
     )
@@ -72,13 +54,208 @@ def get_parser(providers, formatters, publishers):
         help=("Selects where to publish output to. Allowed values: %(choices)s}"),
     )
 
+
+def get_pre_parser(providers, formatters, publishers):
+    """Returns the parser for selecting the plugins to load
+
+    Only the selected plugins are loaded and get to add their options to
+    the complete parser (see get_parser).
+    """
+    parser = argparse.ArgumentParser(add_help=False, fromfile_prefix_chars="@")
+    _add_plugin_arguments(parser, providers, formatters, publishers)
+    return parser
+
+
+def get_parser(providers, formatters, publishers):
+    """Returns the parser with the options of the loaded plugins
+
+    providers and publishers map the plugin names to their classes, or to
+    None for plugins not loaded.
+    """
+    parser = argparse.ArgumentParser(
+        description="Cloud Information System provider",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        fromfile_prefix_chars="@",
+        conflict_handler="resolve",
+    )
+
+    _add_plugin_arguments(parser, providers, formatters, publishers)
+
     parser.add_argument(
         "--timeout",
+        type=int,
         default=600,
         metavar="<seconds>",
         help="Set request timeout (in seconds).",
     )
 
+    parser.add_argument(
+        "--deadline",
+        type=int,
+        default=None,
+        metavar="<seconds>",
+        help=(
+            "Time limit for getting the information of a run. Requests are "
+            "limited to the time left and, once it is over, the information "
+            "obtained so far is published with the endpoint health state as "
+            "warning."
+        ),
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        metavar="<dir>",
+        default=None,
+        help=(
+            "Directory for keeping information between runs (e.g. GOCDB "
+            "services). If not set, nothing is cached."
+        ),
+    )
+
+    parser.add_argument(
+        "--gocdb-cache-ttl",
+        metavar="<seconds>",
+        type=int,
+        default=3600,
+        help=(
+            "Time to use the cached GOCDB information before checking "
+            "whether it changed."
+        ),
+    )
+
+    parser.add_argument(
+        "--ca-timeout",
+        metavar="<seconds>",
+        type=float,
+        default=10,
+        help=(
+            "Timeout for connecting and completing the TLS handshake with "
+            "the endpoint when getting its CA information."
+        ),
+    )
+
+    parser.add_argument(
+        "--ca-cache-ttl",
+        metavar="<seconds>",
+        type=int,
+        default=24 * 3600,
+        help="Time to use the cached CA information of the endpoint.",
+    )
+
+    parser.add_argument(
+        "--gocdb-url",
+        metavar="<url>",
+        default=None,
+        help="URL of the GOCDB public API. Defaults to the EGI GOCDB.",
+    )
+
+    parser.add_argument(
+        "--gocdb-stream",
+        action="store_true",
+        default=False,
+        help=(
+            "Parse the GOCDB output while downloading it, stopping as soon "
+            "as the service is found."
+        ),
+    )
+
+    parser.add_argument(
+        "--site-workers",
+        metavar="N",
+        type=int,
+        default=1,
+        help="Number of sites to get information from concurrently.",
+    )
+
+    parser.add_argument(
+        "--site-output",
+        choices=["separate", "combined"],
+        default=None,
+        help=(
+            "When several sites are given, publish one output per site or a "
+            "single output combining all of them. Publishers with a single "
+            "output (stdout, file) combine them by default, the others "
+            "publish one output per site."
+        ),
+    )
+
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=False,
+        help=(
+            "Keep running and publish the information every --interval "
+            "seconds, reusing sessions and cached information between runs."
+        ),
+    )
+
+    parser.add_argument(
+        "--interval",
+        metavar="<seconds>",
+        type=int,
+        default=600,
+        help="Time between runs in daemon mode.",
+    )
+
+    parser.add_argument(
+        "--full-refresh-interval",
+        metavar="<seconds>",
+        type=int,
+        default=6 * 3600,
+        help=(
+            "Time between full refreshes in daemon mode. Other runs only "
+            "get the information that changes often (e.g. running VMs)."
+        ),
+    )
+
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        default=False,
+        help=(
+            "Only publish the objects added, changed or removed since the "
+            "previous run, as recorded in --diff-state-file."
+        ),
+    )
+
+    parser.add_argument(
+        "--diff-state-file",
+        metavar="<file>",
+        default=None,
+        help=(
+            "File keeping the state of the published objects for --diff. "
+            "Defaults to diff-state.json in --cache-dir."
+        ),
+    )
+
+    parser.add_argument(
+        "--trace-file",
+        metavar="<file>",
+        default=None,
+        help="Write the duration of every phase of the run as JSON to this file.",
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        metavar="<file>",
+        default=None,
+        help=(
+            "Write the duration of every phase of the run to this file, in "
+            "the Prometheus text format (e.g. for the node exporter textfile "
+            "collector)."
+        ),
+    )
+
+    parser.add_argument(
+        "--http-stats",
+        action="store_true",
+        default=False,
+        help=(
+            "Print to stderr the number, size, latency and status of the "
+            "HTTP requests to every service at the end of each run."
+        ),
+    )
+
     parser.add_argument(
         "--insecure",
         action="store_true",
@@ -95,6 +272,16 @@ def get_parser(providers, formatters, publishers):
         help="Provide extra logging information",
     )
 
+    parser.add_argument(
+        "--strict-validation",
+        action="store_true",
+        default=False,
+        help=(
+            "Validate every object before publishing. Objects built from "
+            "the middleware APIs are not validated otherwise."
+        ),
+    )
+
     parser.add_argument(
         "--exit-on-share-errors",
         action="store_true",
@@ -103,6 +290,8 @@ def get_parser(providers, formatters, publishers):
     )
 
     for provider_name, provider in providers.items():
+        if provider is None:
+            continue
         # Do not pass an argument group to plugins that may create their own
         # argument groups (for example keystoneauth loading.session). Passing
         # the root parser avoids nested argument groups which argparse
@@ -110,37 +299,194 @@ def get_parser(providers, formatters, publishers):
         provider.populate_parser(parser)
 
     for publisher_name, publisher in publishers.items():
+        if publisher is None:
+            continue
         # Likewise, pass the root parser to publishers.
         publisher.populate_parser(parser)
 
     return parser
 
 
-def main():
-    providers = get_providers()
-    formatters = get_formatters()
-    publishers = get_publishers()
+def main(argv=None):
+    provider_eps = get_plugins("cip.providers")
+    formatter_eps = get_plugins("cip.formatters")
+    publisher_eps = get_plugins("cip.publishers")
 
-    opts = get_parser(providers, formatters, publishers).parse_args()
+    # load just the selected plugins, not every installed one
+    selected, _ = get_pre_parser(
+        provider_eps, formatter_eps, publisher_eps
+    ).parse_known_args(argv)
+    providers = dict.fromkeys(provider_eps)
+    providers[selected.middleware] = load_plugin(provider_eps[selected.middleware])
+    publishers = dict.fromkeys(publisher_eps)
+    publishers[selected.publisher] = load_plugin(publisher_eps[selected.publisher])
+    formatter_class = load_plugin(formatter_eps[selected.format])
 
-    formatter = driver.DriverManager(
-        namespace="cip.formatters",
-        name=opts.format,
-        invoke_on_load=True,
-    )
+    parser = get_parser(providers, list(formatter_eps), publishers)
+    opts = parser.parse_args(argv)
+    if opts.diff and not get_diff_state_file(opts):
+        parser.error("--diff needs --diff-state-file or --cache-dir")
+    if opts.http_stats:
+        http_stats.enable()
+    publisher_class = publishers[opts.publisher]
+    if opts.site_output is None:
+        opts.site_output = "combined" if publisher_class.single_output else "separate"
+    elif (
+        opts.site_output == "separate"
+        and publisher_class.single_output
+        and len(getattr(opts, "site_config", None) or []) > 1
+    ):
+        parser.error(
+            f"--site-output separate is not possible with the {opts.publisher} "
+            "publisher and several sites"
+        )
+
+    formatter = formatter_class()
+    publisher = publisher_class(opts)
+
+    site_providers = get_site_providers(providers[opts.middleware], opts)
+    try:
+        if opts.daemon:
+            run_daemon(opts, site_providers, formatter, publisher)
+        else:
+            run(opts, site_providers, formatter, publisher)
+    finally:
+        publisher.close()
+
+
+def get_site_providers(provider_class, opts):
+    """Returns a provider for each of the site configurations in opts
+
+    Every provider gets its own copy of the options and the state shared
+    by all the providers of the class.
+    """
+    shared = provider_class.shared_state(opts)
+    site_providers = []
+    for site_config in opts.site_config:
+        site_opts = argparse.Namespace(**vars(opts))
+        site_opts.site_config = site_config
+        site_providers.append(provider_class(site_opts, **shared))
+    return site_providers
+
+
+def get_diff_state_file(opts):
+    if opts.diff_state_file:
+        return opts.diff_state_file
+    if opts.cache_dir:
+        return os.path.join(opts.cache_dir, "diff-state.json")
+    return None
+
+
+def fetch_site(provider):
+    with tracing.span("fetch", site=provider.opts.site_config):
+        return provider.fetch()
+
+
+def fetch(opts, providers):
+    """Fetches the information of every provider
+
+    Up to opts.site_workers providers run concurrently. Returns the site
+    configuration and Glue objects of each provider, in the same order.
+    Failing providers are skipped unless all of them fail.
+    """
+    if len(providers) == 1:
+        return [(providers[0].opts.site_config, fetch_site(providers[0]))]
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, opts.site_workers)
+    ) as executor:
+        futures = [
+            executor.submit(tracing.propagate(fetch_site), provider)
+            for provider in providers
+        ]
+    results = []
+    errors = []
+    for provider, future in zip(providers, futures):
+        try:
+            results.append((provider.opts.site_config, future.result()))
+        except Exception as e:
+            logging.error(
+                "Unable to get the information of %s: %s", provider.opts.site_config, e
+            )
+            errors.append(e)
+    if not results:
+        raise errors[0]
+    return results
+
+
+def publish_diff(opts, state, output, glue, formatter, publisher):
+    """Publishes the changes of the output since the previous run
+
+    The state of the output is only updated once its changes are published.
+    """
+    document, output_state = formatter.diff(opts, glue, state.get(output, {}))
+    if document:
+        publisher.publish_document(formatter, opts, document)
+    else:
+        logging.info("No changes in the information of %s", output)
+    state[output] = output_state
+    diff.save_state(get_diff_state_file(opts), state)
+
+
+def write_profile(opts, root):
+    """Writes the trace of the run to the files requested in opts"""
+    try:
+        if opts.trace_file:
+            tracing.write_trace(opts.trace_file, root)
+        if opts.metrics_file:
+            tracing.write_metrics(opts.metrics_file, root)
+    except OSError as e:
+        logging.warning("Unable to write the run profile: %s", e)
+
+
+def run(opts, providers, formatter, publisher):
+    stats = http_stats.get_stats()
+    if stats is not None:
+        stats.reset()
+    try:
+        with tracing.trace("run") as root:
+            with deadline.start(opts.deadline):
+                results = fetch(opts, providers)
+            if opts.site_output == "combined" and len(results) > 1:
+                combined = {}
+                for _, glue in results:
+                    for obj_type, objs in glue.items():
+                        combined.setdefault(obj_type, []).extend(objs)
+                results = [("combined", combined)]
+            if opts.diff:
+                state = diff.load_state(get_diff_state_file(opts))
+                for output, glue in results:
+                    with tracing.span("publish"):
+                        publish_diff(opts, state, output, glue, formatter, publisher)
+            else:
+                for _, glue in results:
+                    with tracing.span("publish"):
+                        publisher.publish_glue(formatter, opts, glue)
+    finally:
+        write_profile(opts, root)
+        if stats is not None:
+            print(stats.summary(), file=sys.stderr)
 
-    publisher = driver.DriverManager(
-        namespace="cip.publishers",
-        name=opts.publisher,
-        invoke_on_load=True,
-        invoke_args=(opts,),
-    )
 
-    provider_class = providers.get(opts.middleware)
-    glue = provider_class(opts).fetch()
+def run_daemon(opts, providers, formatter, publisher):
+    """Publishes the information every opts.interval seconds
 
-    output = formatter.driver.format(opts, glue)
-    publisher.driver.publish(output)
+    The providers are kept between runs, so they can reuse their sessions
+    and caches. Everything is fetched again every opts.full_refresh_interval
+    seconds.
+    """
+    last_full = start = time.monotonic()
+    while True:
+        try:
+            run(opts, providers, formatter, publisher)
+        except Exception:
+            logging.exception("Unable to publish the cloud information")
+        time.sleep(max(0, opts.interval - (time.monotonic() - start)))
+        start = time.monotonic()
+        full = start - last_full >= opts.full_refresh_interval
+        if full:
+            last_full = start
+        for provider in providers:
+            provider.reset(full=full)
 
 
 if __name__ == "__main__":
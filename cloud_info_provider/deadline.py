@@ -0,0 +1,77 @@
+"""
+Time limit for getting the information of a run
+
+The deadline of the run is kept in a context variable, so functions run in
+other threads need to be wrapped with `tracing.propagate` to be limited by
+it. Calls to external services get the remaining time as their timeout.
+"""
+
+import contextlib
+import contextvars
+import time
+
+from cloud_info_provider.exceptions import DeadlineExceeded
+
+_current = contextvars.ContextVar("cloud_info_provider_deadline", default=None)
+
+
+class Deadline:
+    """Point in time after which no more calls are done"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+@contextlib.contextmanager
+def start(seconds):
+    """Limits the calls in the context to seconds in total
+
+    Yields the deadline, or None if seconds is None.
+    """
+    d = Deadline(seconds) if seconds is not None else None
+    token = _current.set(d)
+    try:
+        yield d
+    finally:
+        _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def expired():
+    """Whether the deadline of the current context is over"""
+    d = _current.get()
+    return d is not None and d.expired()
+
+
+def check():
+    """Raises DeadlineExceeded if the deadline is over"""
+    d = _current.get()
+    if d is not None and d.expired():
+        raise DeadlineExceeded(seconds=d.seconds)
+
+
+def timeout(timeout=None):
+    """Returns timeout limited to the time left until the deadline
+
+    timeout may be None, a number of seconds or a (connect, read) tuple as
+    used by requests. Raises DeadlineExceeded if there is no time left.
+    """
+    d = _current.get()
+    if d is None:
+        return timeout
+    remaining = d.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded(seconds=d.seconds)
+    if isinstance(timeout, tuple):
+        return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+    return remaining if timeout is None else min(timeout, remaining)
@@ -0,0 +1,103 @@
+"""
+Changes in the published information between runs
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from cloud_info_provider.utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Fields that change on every run without the information changing
+VOLATILE_FIELDS = ("CreationTime",)
+
+# Key of the document listing the objects no longer present
+REMOVED = "Removed"
+
+
+def object_hash(obj):
+    """Returns a hash of the dumped object ignoring the volatile fields"""
+    if isinstance(obj, dict):
+        obj = {k: v for k, v in obj.items() if k not in VOLATILE_FIELDS}
+    return hashlib.sha256(
+        json.dumps(obj, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def object_key(glue_obj):
+    """Returns the key of the object in the state
+
+    Objects like instance types are published once per share with the same
+    id, so objects with associations are also keyed by them.
+    """
+    associations = {k: sorted(v) for k, v in glue_obj.associations.items() if v}
+    if not associations:
+        return glue_obj.id
+    return json.dumps([glue_obj.id, associations], sort_keys=True)
+
+
+def _removed(name, key):
+    try:
+        value = json.loads(key)
+    except ValueError:
+        value = None
+    # ids without associations may also be valid JSON, e.g. "42"
+    if not isinstance(value, list):
+        return {"Type": name, "ID": key}
+    obj_id, associations = value
+    return {"Type": name, "ID": obj_id, "Associations": associations}
+
+
+def diff_document(glue, document, previous):
+    """Returns the changes of document since the previous state
+
+    document is the dumped version of the glue objects, with the same
+    structure. The state maps every Glue type to the hash of the objects
+    of that type by object_key. Returns a document with the same structure
+    that only contains the added and changed objects, plus the type, id
+    and associations of the removed ones under REMOVED, and the new state.
+    """
+    changes = {}
+    state = {}
+    for name, objs in document.items():
+        hashes = state[name] = {}
+        old = previous.get(name, {})
+        changed = []
+        for glue_obj, obj in zip(glue[name], objs):
+            key = object_key(glue_obj)
+            digest = hashes[key] = object_hash(obj)
+            if old.get(key) != digest:
+                changed.append(obj)
+        if changed:
+            changes[name] = changed
+    removed = [
+        _removed(name, key)
+        for name, old in previous.items()
+        for key in old
+        if key not in state.get(name, {})
+    ]
+    if removed:
+        changes[REMOVED] = removed
+    return changes, state
+
+
+def load_state(state_file):
+    """Loads the state of every output, empty if not available"""
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring diff state file %s: %s", state_file, e)
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def save_state(state_file, state):
+    """Atomically writes the state of every output into state_file"""
+    os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+    write_atomic(state_file, json.dumps(state).encode())
@@ -25,3 +25,11 @@ class CloudInfoException(Exception):
 
 class OpenStackProviderException(CloudInfoException):
     pass
+
+
+class StompPublisherException(CloudInfoException):
+    pass
+
+
+class DeadlineExceeded(CloudInfoException):
+    msg_fmt = "Run deadline of %(seconds)s seconds exceeded"
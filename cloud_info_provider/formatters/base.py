@@ -1,5 +1,7 @@
 import abc
 
+from cloud_info_provider import diff
+
 
 class BaseFormatter(object):
     """Base class for the formatters."""
@@ -8,3 +10,23 @@ class BaseFormatter(object):
 
     def format(self, opts, glue):
         raise NotImplementedError
+
+    def document(self, opts, glue):
+        """Returns the output as Python objects, ready to be encoded"""
+        raise NotImplementedError
+
+    def iter_encode(self, document):
+        """Yields the output for a document returned by document()"""
+        raise NotImplementedError
+
+    def iter_format(self, opts, glue):
+        """Yields the formatted output in chunks"""
+        yield self.format(opts, glue)
+
+    def diff(self, opts, glue, previous):
+        """Returns the changes in the document since the previous state
+
+        Returns a document with the added and changed objects, and the ones
+        removed under diff.REMOVED, and the state for the next diff.
+        """
+        return diff.diff_document(glue, self.document(opts, glue), previous)
@@ -1,192 +1,268 @@
 import json
+import typing
 from datetime import datetime
 
-from cloud_info_provider import glue
+from cloud_info_provider import glue, tracing
 from cloud_info_provider.formatters import base
 
+# Mapping of GLUE 2.1 JSON names to the fields of the Glue objects
+COMMON_FIELDS = {
+    "ID": "id",
+    "Validity": "validity",
+    "CreationTime": "creation_time",
+    "Name": "name",
+}
 
-class GLUE21Json(base.BaseFormatter):
-    def dump_glue_manager(self, mgr):
-        return self.dump_glue_fields(
-            mgr,
-            {
-                "ProductName": "product_name",
-                "ProductVersion": "product_version",
-                "HypervisorName": "hypervisor_name",
-                "HypervisorVersion": "hypervisor_version",
-                "TotalCPUs": "total_cpus",
-                "TotalRAM": "total_ram",
-                "InstanceMaxCPU": "instance_max_cpu",
-                "InstanceMinCPU": "instance_min_cpu",
-                "InstanceMaxRAM": "instance_max_ram",
-                "InstanceMinRAM": "instance_min_ram",
-                "NetworkVirtualizationType": "network_virtualization_type",
-                "CPUVirtualizationType": "cpu_virtualization_type",
-                "ManagerVirtualdiskFormat": "virtual_disk_format",
-                "ManagerFailover": "failover",
-                "ManagerLiveMigration": "live_migration",
-                "ManagerVMBackupRestore": "vm_backup_restore",
-            },
-        )
+SERVICE_FIELDS = {
+    "Type": "type",
+    "QualityLevel": "quality_level",
+    "StatusInfo": "status_info",
+    "ServiceAUP": "service_aup",
+    "Complexity": "complexity",
+    "Capability": "capability",
+    "TotalVM": "total_vm",
+    "RunningVM": "running_vm",
+    "SuspendedVM": "suspended_vm",
+    "HaltedVM": "halted_vm",
+}
 
-    def dump_glue_endpoint(self, ept):
-        return self.dump_glue_fields(
-            ept,
-            {
-                "Capability": "capability",
-                "QualityLevel": "quality_level",
-                "InterfaceName": "interface_name",
-                "InterfaceVersion": "interface_version",
-                "HealthState": "health_state",
-                "HealthStateInfo": "health_state_info",
-                "ServingState": "serving_state",
-                "Technology": "technology",
-                "Implementor": "implementor",
-                "ImplementationName": "implementation_name",
-                "ImplementationVersion": "implementation_version",
-                "DowntimeInfo": "downtime_info",
-                "Semantics": "semantics",
-                "Authentication": "authentication",
-                "IssuerCA": "issuer_ca",
-                "TrustedCA": "trusted_cas",
-                "URL": "url",
-            },
-        )
+MANAGER_FIELDS = {
+    "ProductName": "product_name",
+    "ProductVersion": "product_version",
+    "HypervisorName": "hypervisor_name",
+    "HypervisorVersion": "hypervisor_version",
+    "TotalCPUs": "total_cpus",
+    "TotalRAM": "total_ram",
+    "InstanceMaxCPU": "instance_max_cpu",
+    "InstanceMinCPU": "instance_min_cpu",
+    "InstanceMaxRAM": "instance_max_ram",
+    "InstanceMinRAM": "instance_min_ram",
+    "NetworkVirtualizationType": "network_virtualization_type",
+    "CPUVirtualizationType": "cpu_virtualization_type",
+    "ManagerVirtualdiskFormat": "virtual_disk_format",
+    "ManagerFailover": "failover",
+    "ManagerLiveMigration": "live_migration",
+    "ManagerVMBackupRestore": "vm_backup_restore",
+}
 
-    def dump_glue_image(self, img):
-        return self.dump_glue_fields(
-            img,
-            {
-                "MarketplaceURL": "marketplace_url",
-                "OSPlatform": "osPlatform",
-                "OSName": "osName",
-                "OSVersion": "osVersion",
-                "Description": "description",
-                "AccessInfo": "access_info",
-            },
-        )
+ENDPOINT_FIELDS = {
+    "Capability": "capability",
+    "QualityLevel": "quality_level",
+    "InterfaceName": "interface_name",
+    "InterfaceVersion": "interface_version",
+    "HealthState": "health_state",
+    "HealthStateInfo": "health_state_info",
+    "ServingState": "serving_state",
+    "Technology": "technology",
+    "Implementor": "implementor",
+    "ImplementationName": "implementation_name",
+    "ImplementationVersion": "implementation_version",
+    "DowntimeInfo": "downtime_info",
+    "Semantics": "semantics",
+    "Authentication": "authentication",
+    "IssuerCA": "issuer_ca",
+    "TrustedCA": "trusted_cas",
+    "URL": "url",
+}
 
-    def dump_glue_instance_type(self, itype):
-        return self.dump_glue_fields(
-            itype,
-            {
-                "Platform": "platform",
-                "CPU": "cpu",
-                "RAM": "ram",
-                "Disk": "disk",
-                "NetworkIn": "network_in",
-                "NetworkOut": "network_out",
-                "NetworkInfo": "network_info",
-            },
-        )
+IMAGE_FIELDS = {
+    "MarketplaceURL": "marketplace_url",
+    "OSPlatform": "osPlatform",
+    "OSName": "osName",
+    "OSVersion": "osVersion",
+    "Description": "description",
+    "AccessInfo": "access_info",
+}
 
-    def dump_glue_share(self, share):
-        return self.dump_glue_fields(
-            share,
-            {
-                "InstanceMaxCPU": "instance_max_cpu",
-                "InstanceMaxRAM": "instance_max_ram",
-                "SLA": "sla",
-                "TotalVM": "total_vm",
-                "RunningVM": "running_vm",
-                "SuspendedVM": "suspended_vm",
-                "HaltedVM": "halted_vm",
-                "MaxVM": "max_vm",
-                "NetworkInfo": "network_info",
-                "DefaultNetworkType": "default_network_type",
-                "PublicNetworkName": "public_network_name",
-                "ProjectID": "project_id",
-            },
-        )
+INSTANCE_TYPE_FIELDS = {
+    "Platform": "platform",
+    "CPU": "cpu",
+    "RAM": "ram",
+    "Disk": "disk",
+    "NetworkIn": "network_in",
+    "NetworkOut": "network_out",
+    "NetworkInfo": "network_info",
+}
 
-    def dump_glue_policy(self, policy):
-        return self.dump_glue_fields(
-            policy,
-            {
-                "Rule": "rule",
-                "Scheme": "scheme",
-            },
-        )
+SHARE_FIELDS = {
+    "InstanceMaxCPU": "instance_max_cpu",
+    "InstanceMaxRAM": "instance_max_ram",
+    "SLA": "sla",
+    "TotalVM": "total_vm",
+    "RunningVM": "running_vm",
+    "SuspendedVM": "suspended_vm",
+    "HaltedVM": "halted_vm",
+    "MaxVM": "max_vm",
+    "NetworkInfo": "network_info",
+    "DefaultNetworkType": "default_network_type",
+    "PublicNetworkName": "public_network_name",
+    "ProjectID": "project_id",
+}
 
-    def dump_glue_accelerator(self, acc):
-        return self.dump_glue_fields(
-            acc,
-            {
-                "Type": "type",
-                "Number": "number",
-                "Vendor": "vendor",
-                "Model": "model",
-                "Version": "version",
-                "ClockSpeed": "clock_speed",
-                "Memory": "memory",
-                "ComputeCapability": "compute_capability",
-                "VirtualizationType": "virtualization_type",
-            },
-        )
+POLICY_FIELDS = {
+    "Rule": "rule",
+    "Scheme": "scheme",
+}
 
-    def dump_glue_service(self, svc):
-        return self.dump_glue_fields(
-            svc,
-            {
-                "Type": "type",
-                "QualityLevel": "quality_level",
-                "StatusInfo": "status_info",
-                "ServiceAUP": "service_aup",
-                "Complexity": "complexity",
-                "Capability": "capability",
-                "TotalVM": "total_vm",
-                "RunningVM": "running_vm",
-                "SuspendedVM": "suspended_vm",
-                "HaltedVM": "halted_vm",
-            },
-        )
+ACCELERATOR_FIELDS = {
+    "Type": "type",
+    "Number": "number",
+    "Vendor": "vendor",
+    "Model": "model",
+    "Version": "version",
+    "ClockSpeed": "clock_speed",
+    "Memory": "memory",
+    "ComputeCapability": "compute_capability",
+    "VirtualizationType": "virtualization_type",
+}
+
+FIELD_MAPPINGS = {
+    glue.CloudComputingService: SERVICE_FIELDS,
+    glue.CloudComputingManager: MANAGER_FIELDS,
+    glue.CloudComputingEndpoint: ENDPOINT_FIELDS,
+    glue.CloudComputingImage: IMAGE_FIELDS,
+    glue.CloudComputingInstanceType: INSTANCE_TYPE_FIELDS,
+    glue.Share: SHARE_FIELDS,
+    glue.MappingPolicy: POLICY_FIELDS,
+    glue.AccessPolicy: POLICY_FIELDS,
+    glue.CloudComputingVirtualAccelerator: ACCELERATOR_FIELDS,
+}
 
-    def dump_glue_fields(self, obj, field_mapping):
+
+def _dump_value(v):
+    if isinstance(v, glue.BoolEnum):
+        return v.value
+    elif isinstance(v, datetime):
+        return v.isoformat()
+    return v
+
+
+def reflection_dump(obj):
+    """Dumps the object checking the type of every field
+
+    Reference implementation of the serializers built for every class,
+    which give the same output without checking the fields not needing
+    a conversion.
+    """
+
+    def dump_fields(mapping):
         o = {}
-        for name, field in field_mapping.items():
+        for name, field in mapping.items():
             v = getattr(obj, field, None)
             if v is not None:
-                if isinstance(v, glue.BoolEnum):
-                    o[name] = v.value
-                elif isinstance(v, datetime):
-                    o[name] = v.isoformat()
-                else:
-                    o[name] = v
+                o[name] = _dump_value(v)
         return o
 
+    o = dump_fields(COMMON_FIELDS)
+    if obj.other_info:
+        o["OtherInfo"] = obj.other_info
+    if obj.associations:
+        o["Associations"] = obj.associations
+    o.update(dump_fields(FIELD_MAPPINGS.get(obj.__class__, {})))
+    return o
+
+
+def _needs_conversion(cls, field):
+    """Checks whether the values of the field may need to be converted
+
+    Only fields typed as BoolEnum or datetime need it, fields unknown to
+    the class are always checked.
+    """
+    info = getattr(cls, "model_fields", {}).get(field)
+    if info is None:
+        return True
+    annotation = info.annotation
+    types = typing.get_args(annotation) or (annotation,)
+    return any(t in (glue.BoolEnum, datetime) for t in types)
+
+
+def _build_serializer(cls):
+    """Builds the function that dumps the objects of the Glue class
+
+    The source of the function is generated from the field mappings of the
+    class, with one statement per field, and compiled once. Only fields
+    that may hold a BoolEnum or datetime check the type of their value.
+    """
+    lines = ["def serialize(obj):", "    values = obj.__dict__", "    o = {}"]
+
+    def add_fields(mapping):
+        for name, field in mapping.items():
+            value = "_dump_value(v)" if _needs_conversion(cls, field) else "v"
+            lines.extend(
+                [
+                    f"    v = values.get({field!r})",
+                    "    if v is not None:",
+                    f"        o[{name!r}] = {value}",
+                ]
+            )
+
+    add_fields(COMMON_FIELDS)
+    lines.extend(
+        [
+            "    if obj.other_info:",
+            "        o['OtherInfo'] = obj.other_info",
+            "    if obj.associations:",
+            "        o['Associations'] = obj.associations",
+        ]
+    )
+    add_fields(FIELD_MAPPINGS.get(cls, {}))
+    lines.append("    return o")
+    namespace = {"_dump_value": _dump_value}
+    code = compile("\n".join(lines), f"<serializer {cls.__name__}>", "exec")
+    exec(code, namespace)  # nosec: the source only contains known field names
+    return namespace["serialize"]
+
+
+_SERIALIZERS = {}
+
+
+def get_serializer(cls):
+    """Returns the serializer for the Glue class, building it only once"""
+    serializer = _SERIALIZERS.get(cls)
+    if serializer is None:
+        serializer = _SERIALIZERS.setdefault(cls, _build_serializer(cls))
+    return serializer
+
+
+class GLUE21Json(base.BaseFormatter):
     def dump_glue_object(self, obj):
-        o = self.dump_glue_fields(
-            obj,
-            {
-                "ID": "id",
-                "Validity": "validity",
-                "CreationTime": "creation_time",
-                "Name": "name",
-            },
-        )
-        if obj.other_info:
-            o["OtherInfo"] = obj.other_info
-        if obj.associations:
-            o["Associations"] = obj.associations
-        obj_mapping = {
-            glue.CloudComputingService: self.dump_glue_service,
-            glue.CloudComputingManager: self.dump_glue_manager,
-            glue.CloudComputingEndpoint: self.dump_glue_endpoint,
-            glue.CloudComputingImage: self.dump_glue_image,
-            glue.CloudComputingInstanceType: self.dump_glue_instance_type,
-            glue.Share: self.dump_glue_share,
-            glue.MappingPolicy: self.dump_glue_policy,
-            glue.AccessPolicy: self.dump_glue_policy,
-            glue.CloudComputingVirtualAccelerator: self.dump_glue_accelerator,
+        return get_serializer(obj.__class__)(obj)
+
+    @tracing.traced
+    def document(self, opts, glue):
+        return {
+            name: [self.dump_glue_object(o) for o in glue_objects]
+            for name, glue_objects in glue.items()
         }
-        f = obj_mapping.get(obj.__class__, None)
-        if f:
-            o.update(f(obj))
-        return o
 
-    def format(self, opts, glue):
-        glue_output = {}
-        for name, glue_objects in glue.items():
-            glue_output[name] = [self.dump_glue_object(o) for o in glue_objects]
+    def iter_format(self, opts, glue):
+        """Yields the JSON document in chunks, one per Glue object
 
-        return json.dumps(glue_output, default=str)
+        Each object is serialized as soon as it is dumped, so the complete
+        document is never kept in memory. The output is the same as
+        json.dumps of the whole document.
+        """
+        return self._iter_json(
+            (name, map(self.dump_glue_object, glue_objects))
+            for name, glue_objects in glue.items()
+        )
+
+    def iter_encode(self, document):
+        """Yields the JSON for the document in chunks, as iter_format"""
+        return self._iter_json(document.items())
+
+    @staticmethod
+    def _iter_json(items):
+        yield "{"
+        for i, (name, objs) in enumerate(items):
+            yield f"{', ' if i else ''}{json.dumps(name)}: ["
+            for j, o in enumerate(objs):
+                if j:
+                    yield ", "
+                yield json.dumps(o, default=str)
+            yield "]"
+        yield "}"
+
+    @tracing.traced
+    def format(self, opts, glue):
+        return "".join(self.iter_format(opts, glue))
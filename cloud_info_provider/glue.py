@@ -2,11 +2,15 @@
 GlueSchema 2.1 Objects
 """
 
+import copy
 import datetime
+import sys
+import threading
+from collections.abc import Mapping
 from enum import Enum
 from typing import Literal, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class BoolEnum(Enum):
@@ -17,25 +21,109 @@ class BoolEnum(Enum):
     UNKNOWN = "UNKNOWN"
 
 
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
 class GlueBase(BaseModel):
     id: str
     name: Optional[str] = None
-    creation_time: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
+    creation_time: datetime.datetime = Field(default_factory=_now)
     # 12 hours validity
     validity: int = 3600 * 12
-    other_info: dict = {}
-    associations: dict = {}
+    other_info: dict = Field(default_factory=dict)
+    associations: dict = Field(default_factory=dict)
+
+    @classmethod
+    def trusted(cls, **kwargs):
+        """Builds the object without validating kwargs
+
+        Only for values that already have the types of the fields, like
+        those obtained from the OpenStack APIs, as no conversion is done.
+        Unknown arguments are ignored. See validate_fields.
+        """
+        defaults, factories, required, fields, private = _trusted_defaults(cls)
+        values = dict(defaults)
+        for name, factory in factories:
+            values[name] = factory()
+        if fields.issuperset(kwargs):
+            values.update(kwargs)
+        else:
+            values.update((k, v) for k, v in kwargs.items() if k in fields)
+        for name in required.difference(kwargs):
+            del values[name]
+        # same attributes as set by pydantic 2 validation, see test_trusted
+        obj = cls.__new__(cls)
+        object.__setattr__(obj, "__dict__", values)
+        object.__setattr__(obj, "__pydantic_fields_set__", set(kwargs) & fields)
+        object.__setattr__(obj, "__pydantic_extra__", None)
+        object.__setattr__(
+            obj, "__pydantic_private__", dict(private) if private else None
+        )
+        return obj
+
+    def validate_fields(self):
+        """Checks the values of the fields, raising ValidationError if wrong
+
+        Values are validated in strict mode, so they must have the type of
+        the field rather than something that could be converted to it.
+        """
+        self.__class__.model_validate(self.__dict__, strict=True)
 
     def add_association(self, name, value):
-        assoc = self.associations.get(name, [])
-        assoc.append(value)
-        self.associations[name] = assoc
+        name = sys.intern(name)
+        if isinstance(value, str):
+            value = sys.intern(value)
+        self.associations.setdefault(name, []).append(value)
+
+    def remove_associations(self, name):
+        self.associations.pop(name, None)
 
     def add_associated_object(self, obj):
         class_name = obj.__class__.__name__
         self.add_association(class_name, obj.id)
 
 
+_TRUSTED_DEFAULTS = {}
+
+
+def _trusted_defaults(cls):
+    """Returns the defaults of the fields of cls for GlueBase.trusted
+
+    Those are the immutable default values, with every field in order as
+    validated objects keep them, the factories for the mutable ones, the
+    names of the required and of all the fields and the defaults of the
+    private attributes.
+    """
+    if cls not in _TRUSTED_DEFAULTS:
+        defaults = {}
+        factories = []
+        required = set()
+        for name, field in cls.model_fields.items():
+            # placeholder keeping the order, replaced or removed
+            defaults[name] = None
+            if field.default_factory is not None:
+                factories.append((name, field.default_factory))
+            elif field.is_required():
+                required.add(name)
+            elif isinstance(field.default, (dict, list, set)):
+                factories.append((name, lambda d=field.default: copy.copy(d)))
+            else:
+                defaults[name] = field.default
+        private = {
+            name: attr.get_default()
+            for name, attr in cls.__private_attributes__.items()
+        }
+        _TRUSTED_DEFAULTS[cls] = (
+            defaults,
+            factories,
+            frozenset(required),
+            frozenset(cls.model_fields),
+            private,
+        )
+    return _TRUSTED_DEFAULTS[cls]
+
+
 class CloudComputingService(GlueBase):
     type: str = "org.cloud.iaas"
     quality_level: Literal["development", "pre-production", "production", "testing"] = (
@@ -160,3 +248,43 @@ class Share(GlueBase):
     network_info: Optional[str] = None
     default_network_type: Optional[str] = None
     public_network_name: Optional[str] = None
+
+
+class GlueStore(Mapping):
+    """Glue objects grouped by type name
+
+    The store is a read-only mapping of type names to the list of objects
+    of that type, in the order they were added. Every object is only added
+    once, so objects shared by several shares (e.g. images) can be added
+    by each of them.
+    """
+
+    def __init__(self, objs=()):
+        self._lock = threading.Lock()
+        self._objs = {}
+        self._members = set()
+        for o in objs:
+            self.add(o)
+
+    def __getitem__(self, obj_type):
+        return self._objs[obj_type]
+
+    def __iter__(self):
+        return iter(self._objs)
+
+    def __len__(self):
+        return len(self._objs)
+
+    def add(self, obj):
+        """Adds obj to the store, unless already there"""
+        obj_type = sys.intern(obj.__class__.__name__)
+        with self._lock:
+            if id(obj) not in self._members:
+                self._members.add(id(obj))
+                self._objs.setdefault(obj_type, []).append(obj)
+
+    def merge(self, other):
+        """Adds the objects of other store"""
+        for objs in other.values():
+            for o in objs:
+                self.add(o)
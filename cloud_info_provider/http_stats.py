@@ -0,0 +1,167 @@
+"""
+Accounting of the HTTP requests done during a run
+
+Requests are aggregated by service, method and URL template, where the
+path segments that identify resources are replaced by `{id}`. Accounting
+is disabled until `enable` is called.
+"""
+
+import bisect
+import re
+import threading
+from urllib.parse import urlparse
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+_VERSION_RE = re.compile(r"v\d+(\.\d+)?")
+_ID_RE = re.compile(r".*\d.*")
+
+
+def url_template(path):
+    """Returns the path with the segments containing digits as {id}
+
+    Version segments like v2.1 are kept as is.
+    """
+    return "/".join(
+        "{id}" if _ID_RE.fullmatch(s) and not _VERSION_RE.fullmatch(s) else s
+        for s in path.split("/")
+    )
+
+
+class RequestStats:
+    """Aggregated statistics of the requests to an URL template"""
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.total_time = 0
+        self.max_time = 0
+        self.statuses = {}
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def add(self, status, size, elapsed):
+        self.count += 1
+        self.bytes += size
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket with the q quantile"""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS, self.buckets):
+            seen += n
+            if seen >= rank:
+                return bound
+        return LATENCY_BUCKETS[-1]
+
+
+class HTTPStats:
+    """Statistics of the HTTP requests by service, method and URL template
+
+    Services are identified by the endpoints registered with
+    register_endpoint, unknown URLs are accounted by their host.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.requests = {}
+
+    def register_endpoint(self, service, url):
+        if url:
+            with self._lock:
+                self._endpoints[url.rstrip("/")] = service
+
+    def _service(self, url):
+        match = ""
+        for endpoint in self._endpoints:
+            if url.startswith(endpoint) and len(endpoint) > len(match):
+                match = endpoint
+        return self._endpoints[match] if match else urlparse(url).netloc
+
+    def record(self, method, url, status, size, elapsed, service=None):
+        with self._lock:
+            key = (
+                service or self._service(url),
+                method,
+                url_template(urlparse(url).path),
+            )
+            stats = self.requests.get(key)
+            if stats is None:
+                stats = self.requests[key] = RequestStats()
+            stats.add(status, size, elapsed)
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+
+    def summary(self):
+        """Returns a table with the statistics of every URL template"""
+        width = max([len("service")] + [len(k[0]) for k in self.requests])
+        lines = [
+            f"{'service':{width}} {'method':6} {'count':>6} {'bytes':>10} "
+            f"{'mean':>7} {'p95':>6} {'max':>7}  {'status':14} url"
+        ]
+        for (service, method, template), s in sorted(self.requests.items()):
+            statuses = ",".join(f"{k}:{v}" for k, v in sorted(s.statuses.items()))
+            lines.append(
+                f"{service:{width}} {method:6} {s.count:6} {s.bytes:10} "
+                f"{s.total_time / s.count:7.3f} {s.quantile(0.95):6} "
+                f"{s.max_time:7.3f}  {statuses:14} {template}"
+            )
+        total = sum(s.count for s in self.requests.values())
+        total_bytes = sum(s.bytes for s in self.requests.values())
+        lines.append(f"{total} requests, {total_bytes} bytes")
+        return "\n".join(lines)
+
+
+_stats = None
+
+
+def enable():
+    """Starts accounting the requests, returns the statistics"""
+    global _stats
+    if _stats is None:
+        _stats = HTTPStats()
+    return _stats
+
+
+def get_stats():
+    """Returns the statistics, None if accounting is not enabled"""
+    return _stats
+
+
+def register_endpoint(service, url):
+    if _stats is not None:
+        _stats.register_endpoint(service, url)
+
+
+def record_response(response, service=None, stream=False):
+    """Accounts a requests response
+
+    The size of streamed responses is only known from their headers.
+    """
+    if _stats is None:
+        return
+    size = response.headers.get("Content-Length")
+    if size is not None:
+        size = int(size)
+    elif not stream:
+        size = len(response.content)
+    _stats.record(
+        response.request.method,
+        response.url,
+        response.status_code,
+        size or 0,
+        response.elapsed.total_seconds(),
+        service=service,
+    )
+
+
+def response_hook(response, *args, **kwargs):
+    """requests response hook accounting every response"""
+    record_response(response, stream=kwargs.get("stream", False))
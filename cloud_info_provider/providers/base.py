@@ -1,8 +1,11 @@
+import concurrent.futures
 import logging
 
+import pydantic
+import requests
 import yaml
-from cloud_info_provider import glue
-from cloud_info_provider.exceptions import CloudInfoException
+from cloud_info_provider import deadline, glue, tracing
+from cloud_info_provider.exceptions import CloudInfoException, DeadlineExceeded
 from cloud_info_provider.providers import utils
 
 
@@ -25,31 +28,79 @@ class BaseProvider:
         self._load_site_config(opts.site_config)
         self._goc_info = {}
         self._ca_info = {}
-        self.objs = {}
+        # information that could not be obtained in the current run
+        self._missing_info = []
+        self.objs = glue.GlueStore()
+
+    def _fetch_ca_info(self, url):
+        """Returns the CA information of url, None if not available"""
+        with tracing.span("ca_info"):
+            try:
+                return utils.get_endpoint_ca_information(
+                    url,
+                    self.opts.insecure,
+                    timeout=deadline.timeout(self.opts.ca_timeout),
+                    cache_dir=self.opts.cache_dir,
+                    cache_ttl=self.opts.ca_cache_ttl,
+                )
+            except (DeadlineExceeded, requests.RequestException) as e:
+                logging.warning("Unable to get the CA information of %s: %s", url, e)
+                return None
 
     def _get_ca_info(self, url):
         if url not in self._ca_info:
-            ca_info = utils.get_endpoint_ca_information(url, self.opts.insecure)
+            self._ca_info[url] = self._fetch_ca_info(url)
+        ca_info = self._ca_info[url]
+        if isinstance(ca_info, concurrent.futures.Future):
+            ca_info = ca_info.result()
             self._ca_info[url] = ca_info
-        return self._ca_info[url]
+        if ca_info is None:
+            # not kept, so it is obtained again in the next run
+            del self._ca_info[url]
+            self._missing_info.append("CA")
+            return utils.unknown_ca_information()
+        return ca_info
 
     def _get_goc_info(self, url):
         if url not in self._goc_info:
             # pylint: disable=no-member
-            self._goc_info[url] = utils.find_in_gocdb(
-                url, self.goc_service_type, self.opts.insecure, self.opts.timeout
-            )
+            with tracing.span("goc_info"):
+                try:
+                    self._goc_info[url] = utils.find_in_gocdb(
+                        url,
+                        self.goc_service_type,
+                        self.opts.insecure,
+                        deadline.timeout(self.opts.timeout),
+                        cache_dir=self.opts.cache_dir,
+                        cache_ttl=self.opts.gocdb_cache_ttl,
+                        stream=self.opts.gocdb_stream,
+                        gocdb_url=self.opts.gocdb_url,
+                    )
+                except (DeadlineExceeded, requests.RequestException) as e:
+                    logging.warning("Unable to get the GOCDB information: %s", e)
+                    # not kept, so it is obtained again in the next run
+                    self._missing_info.append("GOCDB")
+                    return {}
         return self._goc_info[url]
 
+    def reset(self, full=False):
+        """Prepares the provider for fetching the information again
+
+        Information that is not expected to change often, like the GOCDB
+        or CA information, is only discarded with full.
+        """
+        self.objs = glue.GlueStore()
+        self._missing_info = []
+        if full:
+            self._goc_info = {}
+            self._ca_info = {}
+
     def add_glue(self, o):
-        class_name = o.__class__.__name__
-        objs = self.objs.get(class_name, [])
-        objs.append(o)
-        self.objs[class_name] = objs
+        self.objs.add(o)
 
     def get_first_obj(self, obj_type):
-        o = self.objs.get(obj_type, [None])
-        return o[0]
+        objs = self.objs.get(obj_type)
+        return objs[0] if objs else None
 
     def get_objs(self, obj_type):
         return self.objs.get(obj_type, [])
@@ -66,17 +117,52 @@ class BaseProvider:
     def endpoint(self):
         return self.get_first_obj("CloudComputingEndpoint")
 
+    @classmethod
+    def shared_state(cls, opts):
+        """Returns the keyword arguments shared by providers of several sites
+
+        Providers running in the same process get these when created, so
+        they can share connections and caches.
+        """
+        return {}
+
     def fetch(self):
-        self.build_service()
-        self.build_manager()
-        self.build_endpoint()
-        self.build_shares()
+        url = self.site_config["endpoint"]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            # get the CA info in the background while talking to GOCDB
+            if url not in self._ca_info:
+                self._ca_info[url] = executor.submit(
+                    tracing.propagate(self._fetch_ca_info), url
+                )
+            with tracing.span("build_service"):
+                self.build_service()
+            with tracing.span("build_manager"):
+                self.build_manager()
+            with tracing.span("build_endpoint"):
+                self.build_endpoint()
+        with tracing.span("build_shares"):
+            self.build_shares()
         share_count = len(self.objs.get("Share", []))
         svc = self.service
         if svc:
             svc.complexity = f"endpointType=1,share={share_count}"
+        if self.opts.strict_validation:
+            with tracing.span("validate"):
+                self.validate_objs()
+        tracing.count_objects(self.objs)
         return self.objs
 
+    def validate_objs(self):
+        """Validates every Glue object, some are built without validation"""
+        for objs in self.objs.values():
+            for o in objs:
+                try:
+                    o.validate_fields()
+                except pydantic.ValidationError as e:
+                    raise CloudInfoException(
+                        f"Invalid {o.__class__.__name__} {o.id}: {e}"
+                    )
+
     def get_service_id(self):
         return "service"
 
@@ -123,6 +209,11 @@ class BaseProvider:
             ),
         }
         ca_info = self._get_ca_info(self.site_config["endpoint"])
+        if self._missing_info:
+            ept_defaults["health_state"] = "warning"
+            ept_defaults["health_state_info"] = (
+                f"{' and '.join(self._missing_info)} information not available"
+            )
         if "issuer" in ca_info:
             ept_defaults["issuer_ca"] = ca_info["issuer"]
         if "trusted_cas" in ca_info:
@@ -145,5 +236,9 @@ class BaseProvider:
         """Populate the argparser 'parser' with the needed options."""
         parser.add_argument(
             "site_config",
-            help="YAML file with site configuration (as in fedcloud-catchall-ops)",
+            nargs="+",
+            help=(
+                "YAML file with site configuration (as in "
+                "fedcloud-catchall-ops). Several sites can be given."
+            ),
         )
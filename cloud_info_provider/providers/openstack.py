@@ -1,20 +1,37 @@
+import argparse
+import concurrent.futures
+import copy
+import itertools
 import json
 import logging
 import re
 import sys
 from urllib.parse import urljoin
 
-import glanceclient
 import keystoneclient.v3.client
-import novaclient.client
 import os_client_config
-from keystoneauth1 import loading
-from keystoneauth1.exceptions import http as http_exc
 from keystoneauth1.exceptions.base import ClientException as client_exc
 from novaclient.exceptions import Forbidden
 
-from .. import exceptions, glue
+from .. import deadline, exceptions, glue, tracing
 from . import base
+from .openstack_catalogue import FlavorCatalogue, ImageCatalogue
+from .openstack_session import SessionPool
+
+# Objects shared by every share of the provider
+SHARED_OBJ_TYPES = (
+    "CloudComputingService",
+    "CloudComputingManager",
+    "CloudComputingEndpoint",
+)
+
+
+def _image_filter(value):
+    """Parses KEY=VALUE image filters from the command line"""
+    k, sep, v = value.partition("=")
+    if not (k and sep):
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got '{value}'")
+    return k, v
 
 
 class OpenStackProvider(base.BaseProvider):
@@ -25,10 +42,10 @@ class OpenStackProvider(base.BaseProvider):
         super().setup_logging()
         # Remove info log messages from output
         external_logs = [
-            "stevedore.extension",
             "requests",
             "urllib3",
             "novaclient",
+            "glanceclient",
             "keystoneauth",
             "keystoneclient",
         ]
@@ -36,7 +53,7 @@ class OpenStackProvider(base.BaseProvider):
         for log in external_logs:
             logging.getLogger(log).setLevel(log_level)
 
-    def __init__(self, opts, **kwargs):
+    def __init__(self, opts, session_pool=None, **kwargs):
         super().__init__(opts, **kwargs)
         self.project_id = None
 
@@ -59,6 +76,27 @@ class OpenStackProvider(base.BaseProvider):
                 self.image_properties[property_id] = {"key": opts_k, "value": None}
         self.last_working_auth = None
         self.exit_on_share_errors = self.opts.exit_on_share_errors
+        self.share_workers = self.opts.share_workers
+        self.page_size = self.opts.page_size
+        self.image_filters = self.opts.image_filters
+        self.flavor_catalogue = FlavorCatalogue(self.opts.extra_specs_workers)
+        self.image_catalogue = ImageCatalogue()
+        self.session_pool = session_pool or SessionPool(opts.timeout)
+
+    @classmethod
+    def shared_state(cls, opts):
+        # the pool keeps sessions per identity, scope and region
+        return {"session_pool": SessionPool(opts.timeout)}
+
+    def reset(self, full=False):
+        super().reset(full)
+        if full:
+            self.flavor_catalogue = FlavorCatalogue(self.opts.extra_specs_workers)
+            self.image_catalogue = ImageCatalogue()
+            self.session_pool.invalidate()
+        else:
+            # images are kept, but shares will be associated again
+            self.image_catalogue.clear_associations("Share")
 
     def get_endpoint_id(self):
         return f"{self.site_config['endpoint']}_OpenStack_v3"
@@ -78,71 +116,68 @@ class OpenStackProvider(base.BaseProvider):
             authentication=self.opts.os_auth_type,
         )
 
+    @tracing.traced
     def rescope_project(self, auth=None, os_cloud=None):
         """Switch to OS project whenever there is a change.
 
         It updates every OpenStack client used in case of new project.
+        Sessions and clients come from the session pool, so they are only
+        created the first time a project is used.
         """
         if not self.opts.os_auth_url:
             self.opts.os_auth_url = self.site_config["endpoint"]
-        cloud_config = os_client_config.OpenStackConfig()
-        if os_cloud:
-            cloud = cloud_config.get_one_cloud(os_cloud)
-        else:
-            cloud = cloud_config.get_one_cloud(argparse=self.opts)
+        cloud = self.session_pool.get_cloud(
+            self.opts, os_cloud or self.site_config.get("cloud")
+        )
         auth_plugin_name = cloud.config.get("auth_type", "password")
         auth_args = cloud.get_auth_args()
         if auth:
             for k, v in auth.items():
                 auth_args[k] = v
-        loader = loading.get_plugin_loader(auth_plugin_name)
-        self.auth_plugin = loader.load_from_options(**auth_args)
-        self.session = loading.session.Session().load_from_options(
-            auth=self.auth_plugin
+        scoped = self.session_pool.get(
+            auth_plugin_name, auth_args, cloud.config.get("region_name", "")
         )
-        self.auth_plugin.invalidate()
-        try:
-            self.project_id = self.session.get_project_id()
-        except http_exc.Unauthorized as e:
-            raise exceptions.OpenStackProviderException(e.details)
-
+        self.auth_plugin = scoped.auth_plugin
+        self.session = scoped.session
+        self.project_id = scoped.project_id
         self.last_working_auth = auth
         # make sure the clients know about the change
-        self.nova = novaclient.client.Client(
-            2,
-            session=self.session,
-            region_name=cloud.config.get("region_name", ""),
-        )
-        self.glance = glanceclient.Client(
-            "2",
-            session=self.session,
-            region_name=cloud.config.get("region_name", ""),
-        )
+        self.nova = scoped.nova
+        self.glance = scoped.glance
+
+    def _instance_type_data(self, flavor):
+        """Returns the instance type attributes and extra properties of flavor"""
+        attrs = {
+            "id": flavor.id,
+            "disk": flavor.disk,
+            "cpu": flavor.vcpus,
+            "name": flavor.name,
+            "ram": flavor.ram,
+            "platform": "amd64",
+        }
+        extra_properties = {}
+        extra_specs = self.flavor_catalogue.extra_specs(flavor)
+        for property_id, opt in self.flavor_properties.items():
+            v = extra_specs.get(opt["key"])
+            if v:
+                opts_v = opt["value"]
+                if opts_v:
+                    extra_properties[property_id] = v == opts_v
+                else:
+                    extra_properties[property_id] = v
+        return attrs, extra_properties
 
     def build_instance_type(self, flavor, share):
-        itype = glue.CloudComputingInstanceType(
-            id=flavor.id,
-            disk=flavor.disk,
-            cpu=flavor.vcpus,
-            name=flavor.name,
-            ram=flavor.ram,
-            platform="amd64",
+        attrs, extra_properties = self.flavor_catalogue.instance_type(
+            flavor, self._instance_type_data
         )
+        itype = glue.CloudComputingInstanceType.trusted(**attrs)
         itype.add_associated_object(share)
         itype.add_associated_object(self.endpoint)
         itype.add_associated_object(self.manager)
         # TODO add infiniband stuff, unclear where that lives in glue
         self.add_glue(itype)
 
-        extra_properties = {}
-        for property_id, opt in self.flavor_properties.items():
-            v = flavor.get_keys().get(opt["key"])
-            if v:
-                opts_v = opt["value"]
-                if opts_v:
-                    extra_properties[property_id] = v == opts_v
-                else:
-                    extra_properties[property_id] = v
         if extra_properties.get("flavor_gpu_number"):
             acc = glue.CloudComputingVirtualAccelerator(
                 id=f"{flavor.id}_gpu",
@@ -157,16 +192,15 @@ class OpenStackProvider(base.BaseProvider):
             self.add_glue(acc)
         return itype
 
+    @tracing.traced
     def build_share_instance_types(self, share):
         ram = []
         cpu = []
-        add_all = self.select_flavors == "all"
         itypes = []
-        for flavor in self.nova.flavors.list(detailed=True, is_public=None):
-            add_pub = self.select_flavors == "public" and flavor.is_public
-            add_priv = self.select_flavors == "private" and not flavor.is_public
-            if not (add_all or add_pub or add_priv):
-                continue
+        flavors = self.flavor_catalogue.flavors(
+            self.nova, self.select_flavors, self.project_id
+        )
+        for flavor in flavors:
             itype = self.build_instance_type(flavor, share)
             ram.append(itype.ram)
             cpu.append(itype.cpu)
@@ -179,13 +213,35 @@ class OpenStackProvider(base.BaseProvider):
         return itypes
 
     def build_image(self, image, share):
+        """Returns the Glue image for image, associated to share
+
+        Images are built once and shared by every share using them, see
+        ImageCatalogue.
+        """
+        glue_image = self.image_catalogue.image(image, self._build_catalogue_image)
+        if glue_image:
+            self.image_catalogue.associate(glue_image, share)
+            self.add_glue(glue_image)
+        return glue_image
+
+    def _build_catalogue_image(self, image):
+        marketplace_url = image.get(
+            "vmcatcher_event_ad_mpuri", image.get("marketplace")
+        )
+        if not marketplace_url:
+            if self.all_images:
+                link = urljoin(
+                    self.glance.http_client.get_endpoint(), image.get("file")
+                )
+                marketplace_url = link
+            else:
+                # discard the image before doing any further processing
+                return None
+
         image_descr = image.get(
             "vmcatcher_event_dc_description",
             image.get("vmcatcher_event_dc_title", "UNKNOWN"),
         )
-        marketplace_url = image.get(
-            "vmcatcher_event_ad_mpuri", image.get("marketplace")
-        )
 
         other_info = {}
         try:
@@ -203,16 +259,7 @@ class OpenStackProvider(base.BaseProvider):
             other_info["base_mpuri"] = extra_attrs["ad:base_mpuri"]
         other_info.update(extra_attrs)
 
-        if not marketplace_url:
-            if self.all_images:
-                link = urljoin(
-                    self.glance.http_client.get_endpoint(), image.get("file")
-                )
-                marketplace_url = link
-            else:
-                return None
-
-        glue_image = glue.CloudComputingImage(
+        glue_image = glue.CloudComputingImage.trusted(
             id=image["id"],
             name=image["name"],
             osName=image.get("os_distro", "UNKNOWN"),
@@ -222,23 +269,102 @@ class OpenStackProvider(base.BaseProvider):
             marketplace_url=marketplace_url,
             other_info=other_info,
         )
-        glue_image.add_associated_object(share)
         glue_image.add_associated_object(self.endpoint)
         glue_image.add_associated_object(self.manager)
-        self.add_glue(glue_image)
         # TODO add associated image objects (Image Network)
         return glue_image
 
+    def get_image_filters(self):
+        """Returns the filters for listing images in Glance"""
+        filters = {"status": "active"}
+        for k, v in self.image_filters:
+            if k == "tag":
+                filters.setdefault("tag", []).append(v)
+            else:
+                filters[k] = v
+        return filters
+
+    def _list_images(self, **filters):
+        """Returns the Glue images listed from Glance with the filters
+
+        Images are listed in pages of `page_size` and filtered by Glance
+        with the configured image filters. Each one is built as soon as it
+        is received, so the image listing is never kept in memory.
+        """
+        glue_images = []
+        images = self.glance.images.list(
+            filters=dict(self.get_image_filters(), **filters),
+            page_size=self.page_size,
+        )
+        for image in images:
+            glue_image = self.image_catalogue.image(image, self._build_catalogue_image)
+            if glue_image:
+                glue_images.append(glue_image)
+        return glue_images
+
+    def iter_share_images(self, share):
+        """Yields the images of the share
+
+        Public images are listed once for all the projects, and only the
+        images owned by or shared with the project are listed for it. Once
+        listed, the images are taken from the catalogue. Filters selecting
+        the visibility or the owner of the images are used as given for
+        every project instead.
+        """
+        filters = self.get_image_filters()
+        # images already filtered by visibility or owner are listed as is
+        restricted = "visibility" in filters or "owner" in filters
+        public = []
+        if not restricted:
+            public = self.image_catalogue.public_images(
+                lambda: self._list_images(visibility="public")
+            )
+        glue_images = self.image_catalogue.project_images(self.project_id)
+        if glue_images is None:
+            if restricted:
+                glue_images = self._list_images()
+            else:
+                glue_images = self._list_images(
+                    owner=self.project_id
+                ) + self._list_images(visibility="shared")
+            self.image_catalogue.set_project_images(self.project_id, glue_images)
+        seen = set()
+        for glue_image in itertools.chain(public, glue_images):
+            # public images owned by the project are listed twice
+            if id(glue_image) in seen:
+                continue
+            seen.add(id(glue_image))
+            self.image_catalogue.associate(glue_image, share)
+            self.add_glue(glue_image)
+            yield glue_image
+
+    @tracing.traced
     def build_share_images(self, share):
-        image_list = []
-        for image in self.glance.images.list(
-            detailed=True, filters={"status": "active"}
-        ):
-            glue_img = self.build_image(image, share)
-            if glue_img:
-                image_list.append(glue_img)
-        return image_list
+        return list(self.iter_share_images(share))
+
+    def count_servers(self, status=None):
+        """Counts the servers of the current project, optionally by status
+
+        Servers are listed without details, one page at a time, so only
+        their ids are transferred and never kept in memory. The listing
+        ends with the first page shorter than the page size, which should
+        not be larger than the max_limit of Nova (1000 by default).
+        """
+        search_opts = {"status": status} if status else None
+        count, marker = 0, None
+        while True:
+            page = self.nova.servers.list(
+                detailed=False,
+                search_opts=search_opts,
+                marker=marker,
+                limit=self.page_size,
+            )
+            count += len(page)
+            if len(page) < self.page_size:
+                return count
+            marker = page[-1].id
 
+    @tracing.traced
     def build_share_quotas(self, share):
         """Return the quotas set for the current project."""
         quota_resources = [
@@ -270,78 +396,179 @@ class OpenStackProvider(base.BaseProvider):
             pass
         share.max_vm = quotas.get("instances", 0)
         share.other_info.update({"quotas": quotas})
-        # also compute current instance count
-        running_vm, halted_vm, suspended_vm = 0, 0, 0
-        for s in self.nova.servers.list():
-            if s.status == "SHUTOFF":
-                halted_vm += 1
-            elif s.status == "SUSPENDED":
-                suspended_vm += 1
-            else:  # this includes several cases (i.e. errors), but assume that's ok
-                running_vm += 1
+        # also compute current instance count, any other status than
+        # SHUTOFF or SUSPENDED (i.e. errors) is considered as running
+        total_vm = self.count_servers()
+        halted_vm = self.count_servers("SHUTOFF")
+        suspended_vm = self.count_servers("SUSPENDED")
+        # servers may change between the listings
+        running_vm = max(0, total_vm - halted_vm - suspended_vm)
         share.running_vm = running_vm
         share.halted_vm = halted_vm
         share.suspended_vm = suspended_vm
         share.total_vm = running_vm + halted_vm + suspended_vm
 
+    def build_share(self, vo):
+        """Builds the share, and its related objects, for a single VO
+
+        Expects the provider to be already scoped to the VO project.
+        """
+        share_id = f"{self.get_endpoint_id()}_share_{vo['name']}_{self.project_id}"
+        name = f"{vo['name']} - {self.project_id} share"
+        description = f"Share in service {self.get_endpoint_id()} for VO {vo['name']} (Project {self.project_id})"
+        access = self.auth_plugin.get_access(self.session)
+        other_info = {
+            "project_name": access.project_name,
+            "project_domain_name": access.project_domain_name,
+        }
+        share = glue.Share.trusted(
+            id=share_id,
+            name=name,
+            project_id=self.project_id,
+            other_info=other_info,
+            description=description,
+        )
+        share.add_associated_object(self.service)
+        share.add_associated_object(self.endpoint)
+        self.build_share_images(share)
+        self.build_share_instance_types(share)
+        self.build_share_quotas(share)
+        self.add_glue(share)
+
+        # policies
+        rule = f"VO:{vo['name']}"
+        mapping_policy = glue.MappingPolicy.trusted(
+            id=f"{share_id}_Policy", rule=[rule]
+        )
+        mapping_policy.add_associated_object(share)
+        mapping_policy.add_association("PolicyUserDomain", vo["name"])
+        self.add_glue(mapping_policy)
+        return share
+
+    def _share_worker(self):
+        """Returns a copy of the provider for building a share on its own
+
+        The copy gets its own session, clients and Glue objects, but keeps
+        the service, manager and endpoint of this provider so the share
+        objects can be associated to them.
+        """
+        worker = copy.copy(self)
+        worker.objs = glue.GlueStore(
+            o for obj_type in SHARED_OBJ_TYPES for o in self.get_objs(obj_type)
+        )
+        return worker
+
+    def _build_vo_share(self, vo):
+        """Builds the share of a VO in a new worker
+
+        Returns the worker and the share, or the worker and the exception
+        if the project could not be scoped or the run deadline is over.
+        """
+        worker = self._share_worker()
+        with tracing.span("share", vo=vo["name"]):
+            try:
+                deadline.check()
+                worker.rescope_project(vo["auth"])
+                share = worker.build_share(vo)
+            except exceptions.OpenStackProviderException as e:
+                return worker, e
+            except Exception:
+                # requests are cut short once the deadline is over
+                if deadline.expired():
+                    return worker, exceptions.DeadlineExceeded(
+                        seconds=deadline.current().seconds
+                    )
+                raise
+            tracing.count_objects(
+                {k: v for k, v in worker.objs.items() if k not in SHARED_OBJ_TYPES}
+            )
+        return worker, share
+
+    def _merge_worker(self, worker):
+        """Adds the objects built by a share worker to the provider
+
+        Objects shared with previous workers (i.e. images) are only added
+        once.
+        """
+        self.objs.merge(worker.objs)
+        self.last_working_auth = worker.last_working_auth
+
+    def _sort_share_associations(self, shares):
+        """Sorts the shares associated to images as the shares themselves
+
+        Shares are associated to images concurrently, sort them so the
+        output is the same regardless of the number of workers. Shares that
+        failed after associating images (e.g. when the deadline is over)
+        are removed from them.
+        """
+        order = {share.id: i for i, share in enumerate(shares)}
+        for image in self.get_objs("CloudComputingImage"):
+            associated = image.associations.get("Share", [])
+            if all(share_id in order for share_id in associated):
+                associated.sort(key=order.get)
+            else:
+                image.remove_associations("Share")
+                for share_id in sorted(
+                    (s for s in associated if s in order), key=order.get
+                ):
+                    image.add_association("Share", share_id)
+
     def build_shares(self):
-        """Builds the share information for every VO"""
+        """Builds the share information for every VO
+
+        Shares are built concurrently with up to `share_workers` workers,
+        each of them with its own session and clients. Results are merged
+        following the order of the VOs in the site configuration, so the
+        output does not depend on the number of workers. Shares not built
+        before the run deadline are left out and the endpoint is set in
+        warning.
+        """
         share_objs = []
         rules = []
         total_vm, running_vm, halted_vm, suspended_vm = 0, 0, 0, 0
         max_cpu, min_cpu, max_ram, min_ram = 0, 0, 0, 0
         vo_list = self.site_config.get("vos", None) or []
-        for vo in vo_list:
-            try:
-                self.rescope_project(vo["auth"])
-            except exceptions.OpenStackProviderException as e:
-                if self.exit_on_share_errors:
-                    raise
-                else:
+        shares = []
+        missing = 0
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, self.share_workers)
+        )
+        try:
+            results = executor.map(tracing.propagate(self._build_vo_share), vo_list)
+            for vo, (worker, result) in zip(vo_list, results):
+                if isinstance(result, exceptions.DeadlineExceeded):
+                    missing += 1
                     self.endpoint.health_state = "warning"
-                    self.endpoint.health_state_info = str(e)
+                    self.endpoint.health_state_info = (
+                        f"{result}, {missing} of {len(vo_list)} shares missing"
+                    )
                     continue
-            share_id = f"{self.get_endpoint_id()}_share_{vo['name']}_{self.project_id}"
-            name = f"{vo['name']} - {self.project_id} share"
-            description = f"Share in service {self.get_endpoint_id()} for VO {vo['name']} (Project {self.project_id})"
-            access = self.auth_plugin.get_access(self.session)
-            other_info = {
-                "project_name": access.project_name,
-                "project_domain_name": access.project_domain_name,
-            }
-            share = glue.Share(
-                id=share_id,
-                name=name,
-                project_id=self.project_id,
-                other_info=other_info,
-                description=description,
-            )
-            share.add_associated_object(self.service)
-            share.add_associated_object(self.endpoint)
-            self.build_share_images(share)
-            self.build_share_instance_types(share)
-            self.build_share_quotas(share)
-            max_ram = max(0, share.instance_max_ram)
-            min_ram = min(0, share.instance_min_ram)
-            max_cpu = max(0, share.instance_max_cpu)
-            min_cpu = min(0, share.instance_min_cpu)
-            self.add_glue(share)
-
-            # policies
-            rule = f"VO:{vo['name']}"
-            rules.append(rule)
-            mapping_policy = glue.MappingPolicy(id=f"{share_id}_Policy", rule=[rule])
-            mapping_policy.add_associated_object(share)
-            mapping_policy.add_association("PolicyUserDomain", vo["name"])
-            self.add_glue(mapping_policy)
-
-            running_vm += share.running_vm
-            halted_vm += share.halted_vm
-            suspended_vm += share.suspended_vm
-            total_vm += share.total_vm
+                if isinstance(result, exceptions.OpenStackProviderException):
+                    if self.exit_on_share_errors:
+                        raise result
+                    else:
+                        self.endpoint.health_state = "warning"
+                        self.endpoint.health_state_info = str(result)
+                        continue
+                share = result
+                shares.append(share)
+                self._merge_worker(worker)
+                max_ram = max(0, share.instance_max_ram)
+                min_ram = min(0, share.instance_min_ram)
+                max_cpu = max(0, share.instance_max_cpu)
+                min_cpu = min(0, share.instance_min_cpu)
+                rules.append(f"VO:{vo['name']}")
+
+                running_vm += share.running_vm
+                halted_vm += share.halted_vm
+                suspended_vm += share.suspended_vm
+                total_vm += share.total_vm
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        self._sort_share_associations(shares)
 
         # global policy
-        access_policy = glue.AccessPolicy(
+        access_policy = glue.AccessPolicy.trusted(
             id=f"{self.endpoint.id}_policy",
             rule=rules,
         )
@@ -359,6 +586,7 @@ class OpenStackProvider(base.BaseProvider):
         self.manager.instance_min_cpu = min_cpu
         return share_objs
 
+    @tracing.traced
     def check_auditor_role(self, cloud_name):
         auditor_role = False
         try:
@@ -373,17 +601,24 @@ class OpenStackProvider(base.BaseProvider):
 
     def fetch(self):
         super().fetch()
-        if self.last_working_auth:
+        if deadline.expired():
+            # publish the information obtained so far
+            logging.warning("Run deadline exceeded, publishing partial information")
+            if self.endpoint.health_state == "ok":
+                self.endpoint.health_state_info = "Run deadline exceeded"
+            self.endpoint.health_state = "warning"
+        elif self.last_working_auth:
             self.rescope_project(self.last_working_auth)
-            self.endpoint.interface_version = self.nova.api_version.get_string()
-            self.endpoint.implementation_version = (
-                self.nova.versions.get_current().version
-            )
+            with tracing.span("endpoint_version"):
+                self.endpoint.interface_version = self.nova.api_version.get_string()
+                self.endpoint.implementation_version = (
+                    self.nova.versions.get_current().version
+                )
         else:
             self.endpoint.health_state = "unknown"
             self.endpoint.health_state_info = "No working authentication configured"
 
-        if self.opts.auditor_role_cloud:
+        if self.opts.auditor_role_cloud and not deadline.expired():
             self.endpoint.other_info.update(
                 self.check_auditor_role(self.opts.auditor_role_cloud)
             )
@@ -405,6 +640,40 @@ class OpenStackProvider(base.BaseProvider):
             help="Select all (default), public or private flavors.",
         )
 
+        parser.add_argument(
+            "--share-workers",
+            metavar="N",
+            type=int,
+            default=1,
+            help=(
+                "Number of shares (VOs) to build concurrently. Each of them "
+                "uses its own session and clients."
+            ),
+        )
+
+        parser.add_argument(
+            "--extra-specs-workers",
+            metavar="N",
+            type=int,
+            default=8,
+            help=(
+                "Number of flavors to get the extra specs from concurrently, "
+                "for Nova versions not returning them when listing flavors "
+                "(before microversion 2.61)."
+            ),
+        )
+
+        parser.add_argument(
+            "--page-size",
+            metavar="N",
+            type=int,
+            default=1000,
+            help=(
+                "Number of resources to request per page when listing them, "
+                "at most the max_limit of Nova."
+            ),
+        )
+
         parser.add_argument(
             "--only-appdb-images",
             action="store_true",
@@ -414,6 +683,21 @@ class OpenStackProvider(base.BaseProvider):
             ),
         )
 
+        parser.add_argument(
+            "--image-filter",
+            metavar="KEY=VALUE",
+            dest="image_filters",
+            type=_image_filter,
+            action="append",
+            default=[],
+            help=(
+                "Only publish images matching the given property value. The "
+                "filter is done by Glance, so other images are not even "
+                "transferred. Use 'tag=<tag>' to filter by tags. May be "
+                "specified several times."
+            ),
+        )
+
         # PROPERTIES
         # If "property-<property>-value" is provided, the capability will only
         # be published when the given value matches the one in the flavor
@@ -0,0 +1,219 @@
+"""
+Run-wide catalogues of OpenStack resources shared by every share
+"""
+
+import concurrent.futures
+import threading
+from urllib.parse import urlparse
+
+from novaclient import api_versions
+from novaclient import exceptions as nova_exc
+from novaclient.v2.flavors import Flavor
+
+from .. import deadline, tracing
+
+# First Nova microversion returning the extra specs in the flavor listing
+EXTRA_SPECS_MICROVERSION = api_versions.APIVersion("2.61")
+
+
+class FlavorCatalogue:
+    """Catalogue of Nova flavors for a provider run
+
+    Public flavors and the extra specs of every flavor are the same for all
+    the projects, so they are only fetched once per run. Only the private
+    flavors visible to each project are obtained from the per-project
+    listing.
+
+    Extra specs are taken from the listing if Nova supports microversion
+    2.61, otherwise they are fetched for up to `workers` flavors at a time.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._public = None
+        self._projects = {}
+        self._extra_specs = {}
+        self._instance_types = {}
+        self._inline_specs = None
+
+    def _supports_inline_specs(self, nova):
+        """Checks once whether Nova returns the extra specs in the listing"""
+        if self._inline_specs is None:
+            try:
+                current = nova.versions.get_current()
+                version = api_versions.APIVersion(current.version)
+            except (
+                AttributeError,
+                nova_exc.ClientException,
+                nova_exc.UnsupportedVersion,
+            ):
+                version = api_versions.APIVersion()
+            self._inline_specs = version >= EXTRA_SPECS_MICROVERSION
+        return self._inline_specs
+
+    def _list_flavors(self, nova):
+        """Lists every flavor visible by the project, following Nova pages
+
+        The extra specs returned with the flavors are kept in the catalogue.
+        """
+        headers = {}
+        inline_specs = self._supports_inline_specs(nova)
+        if inline_specs:
+            version = EXTRA_SPECS_MICROVERSION.get_string()
+            headers = {
+                api_versions.HEADER_NAME: f"{api_versions.SERVICE_TYPE} {version}",
+                api_versions.LEGACY_HEADER_NAME: version,
+            }
+        flavors = []
+        # Nova returns public and project accessible private flavors for
+        # regular users, no matter what is_public filter is used
+        query = "is_public=None"
+        while query:
+            _, body = nova.client.get(f"/flavors/detail?{query}", headers=headers)
+            flavors.extend(
+                Flavor(nova.flavors, info, loaded=True) for info in body["flavors"]
+            )
+            query = None
+            for link in body.get("flavors_links", []):
+                if link.get("rel") == "next":
+                    query = urlparse(link["href"]).query
+        if inline_specs:
+            with self._lock:
+                for flavor in flavors:
+                    specs = getattr(flavor, "extra_specs", None)
+                    if specs is not None:
+                        self._extra_specs.setdefault(flavor.id, specs)
+        return flavors
+
+    @staticmethod
+    def _get_keys(flavor):
+        deadline.check()
+        return flavor.get_keys()
+
+    def _fetch_extra_specs(self, flavors):
+        """Fetches concurrently the extra specs of the flavors not known yet"""
+        with self._lock:
+            missing = [f for f in flavors if f.id not in self._extra_specs]
+        if not missing:
+            return
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, self.workers)
+        ) as executor:
+            specs = list(executor.map(tracing.propagate(self._get_keys), missing))
+        with self._lock:
+            for flavor, flavor_specs in zip(missing, specs):
+                self._extra_specs.setdefault(flavor.id, flavor_specs)
+
+    def flavors(self, nova, select="all", project_id=None):
+        """Returns the flavors visible by the project of the nova client
+
+        `select` can be `all`, `public` or `private`. Public flavors are
+        taken from the catalogue once they are known, so listing only
+        public flavors does not need any request after the first one. The
+        flavors visible by each project are only listed once. The extra
+        specs of the returned flavors are known once this returns.
+        """
+        with self._lock:
+            if select == "public" and self._public is not None:
+                flavors = self._public
+            else:
+                flavors = self._projects.get(project_id)
+        if flavors is None:
+            flavors = self._list_flavors(nova)
+            with self._lock:
+                self._projects[project_id] = flavors
+                if self._public is None:
+                    self._public = [f for f in flavors if f.is_public]
+        if select == "public":
+            flavors = [f for f in flavors if f.is_public]
+        elif select == "private":
+            flavors = [f for f in flavors if not f.is_public]
+        else:
+            flavors = list(flavors)
+        self._fetch_extra_specs(flavors)
+        return flavors
+
+    def extra_specs(self, flavor):
+        """Returns the extra specs of the flavor, fetching them only once"""
+        with self._lock:
+            specs = self._extra_specs.get(flavor.id)
+        if specs is None:
+            specs = flavor.get_keys()
+            with self._lock:
+                specs = self._extra_specs.setdefault(flavor.id, specs)
+        return specs
+
+    def instance_type(self, flavor, builder):
+        """Returns the instance type data of the flavor
+
+        The data is built with `builder(flavor)` the first time the flavor
+        is seen and reused for any other share.
+        """
+        with self._lock:
+            data = self._instance_types.get(flavor.id)
+        if data is None:
+            data = builder(flavor)
+            with self._lock:
+                data = self._instance_types.setdefault(flavor.id, data)
+        return data
+
+
+class ImageCatalogue:
+    """Catalogue of Glance images for a provider run
+
+    Images are built once, keyed by their id and checksum, and the same
+    object is shared by every share that can use the image. Public images
+    are the same for all the projects, so they are only listed once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._images = {}
+        self._projects = {}
+        self._public = None
+        # held while listing the public images, so they are listed once
+        self._public_lock = threading.Lock()
+
+    def image(self, image, builder):
+        """Returns the Glue image for the Glance image
+
+        The Glue image is built with `builder(image)` the first time the
+        image is seen. The builder may return None for discarded images,
+        which are not processed again either.
+        """
+        key = (image["id"], image.get("checksum"))
+        with self._lock:
+            if key in self._images:
+                return self._images[key]
+        glue_image = builder(image)
+        with self._lock:
+            return self._images.setdefault(key, glue_image)
+
+    def associate(self, glue_image, obj):
+        """Associates obj to the shared glue_image"""
+        with self._lock:
+            glue_image.add_associated_object(obj)
+
+    def public_images(self, lister):
+        """Returns the public Glue images, listed with `lister()` only once"""
+        with self._public_lock:
+            if self._public is None:
+                self._public = lister()
+            return self._public
+
+    def project_images(self, project_id):
+        """Returns the Glue images of the project, None if not known yet"""
+        with self._lock:
+            return self._projects.get(project_id)
+
+    def set_project_images(self, project_id, glue_images):
+        with self._lock:
+            self._projects[project_id] = glue_images
+
+    def clear_associations(self, name):
+        """Removes the associations with name from every image"""
+        with self._lock:
+            for glue_image in self._images.values():
+                if glue_image:
+                    glue_image.remove_associations(name)
@@ -0,0 +1,185 @@
+"""
+Keystone sessions and OpenStack clients reused across project rescopes
+"""
+
+import json
+import logging
+import threading
+
+import glanceclient
+import novaclient.client
+import os_client_config
+import requests
+from keystoneauth1 import access, loading
+from keystoneauth1.exceptions import http as http_exc
+from keystoneauth1.identity import v3
+
+from .. import deadline, exceptions, http_stats
+
+logger = logging.getLogger(__name__)
+
+# Authentication arguments that define the scope of the token rather than
+# the identity of the user
+SCOPE_ARGS = (
+    "project_id",
+    "project_name",
+    "project_domain_id",
+    "project_domain_name",
+    "domain_id",
+    "domain_name",
+    "system_scope",
+    "trust_id",
+)
+
+# Do not reuse tokens expiring within this time (in seconds)
+TOKEN_STALE_DURATION = 300
+
+
+class HTTPSession(requests.Session):
+    """requests session limiting every request to the run deadline
+
+    Requests without a timeout get the given one.
+    """
+
+    def __init__(self, timeout=None):
+        super().__init__()
+        self.timeout = timeout
+
+    def send(self, request, **kwargs):
+        kwargs["timeout"] = deadline.timeout(kwargs.get("timeout") or self.timeout)
+        return super().send(request, **kwargs)
+
+
+class ScopedClients:
+    """Session, auth plugin and clients scoped to a project"""
+
+    def __init__(self, session, auth_plugin, project_id, region_name):
+        self.session = session
+        self.auth_plugin = auth_plugin
+        self.project_id = project_id
+        self.nova = novaclient.client.Client(
+            2,
+            session=session,
+            region_name=region_name,
+        )
+        self.glance = glanceclient.Client(
+            "2",
+            session=session,
+            region_name=region_name,
+        )
+
+
+class SessionPool:
+    """Pool of keystone sessions for a provider run
+
+    Every identity authenticates once with its configured auth plugin. The
+    token obtained is then used for getting tokens scoped to other projects,
+    falling back to a full authentication if keystone does not allow it.
+    All sessions share the same HTTP connection pool and the scoped clients
+    are kept for every project. Requests time out after timeout seconds or
+    when the run deadline is over.
+    """
+
+    def __init__(self, timeout=None):
+        self._lock = threading.Lock()
+        self._http = HTTPSession(timeout)
+        self._http.hooks["response"].append(http_stats.response_hook)
+        self._clouds = {}
+        self._tokens = {}
+        self._scoped = {}
+
+    def get_cloud(self, opts, os_cloud=None):
+        """Returns the cloud configuration from opts or the named cloud"""
+        # providers of different sites have their own opts
+        key = os_cloud or id(opts)
+        with self._lock:
+            if key not in self._clouds:
+                cloud_config = os_client_config.OpenStackConfig()
+                if os_cloud:
+                    cloud = cloud_config.get_one_cloud(os_cloud)
+                else:
+                    cloud = cloud_config.get_one_cloud(argparse=opts)
+                self._clouds[key] = cloud
+            return self._clouds[key]
+
+    def _token_auth(self, identity, auth_args, scope):
+        """Returns a token auth plugin for scope from the identity token"""
+        with self._lock:
+            token = self._tokens.get(identity)
+        if not token or token.will_expire_soon(TOKEN_STALE_DURATION):
+            return None
+        return v3.Token(auth_url=auth_args["auth_url"], token=token.auth_token, **scope)
+
+    def _is_stale(self, scoped):
+        """Checks whether the token of the scoped clients is about to expire
+
+        Plugins rescoped from a token can not get a new token once the one
+        they were created from expires, so they need to be created again.
+        """
+        auth_ref = getattr(scoped.auth_plugin, "auth_ref", None)
+        if isinstance(auth_ref, access.AccessInfo):
+            return auth_ref.will_expire_soon(TOKEN_STALE_DURATION)
+        return False
+
+    def _authenticate(self, auth_plugin):
+        session = loading.session.Session().load_from_options(
+            auth=auth_plugin, session=self._http
+        )
+        return session, session.get_project_id()
+
+    def get(self, auth_plugin_name, auth_args, region_name=""):
+        """Returns the ScopedClients for the given authentication
+
+        Raises OpenStackProviderException if authentication fails.
+        """
+        http_stats.register_endpoint("identity", auth_args.get("auth_url"))
+        scope = {k: v for k, v in auth_args.items() if k in SCOPE_ARGS and v}
+        identity = json.dumps(
+            [auth_plugin_name]
+            + sorted((k, v) for k, v in auth_args.items() if k not in SCOPE_ARGS),
+            default=str,
+        )
+        key = (identity, json.dumps(sorted(scope.items()), default=str), region_name)
+        with self._lock:
+            scoped = self._scoped.get(key)
+        if scoped and not self._is_stale(scoped):
+            return scoped
+
+        session = None
+        auth_plugin = self._token_auth(identity, auth_args, scope)
+        if auth_plugin:
+            try:
+                session, project_id = self._authenticate(auth_plugin)
+            except http_exc.HttpError as e:
+                logger.debug("Unable to rescope token, authenticating: %s", e)
+                session = None
+                with self._lock:
+                    self._tokens.pop(identity, None)
+        if session is None:
+            loader = loading.get_plugin_loader(auth_plugin_name)
+            auth_plugin = loader.load_from_options(**auth_args)
+            try:
+                session, project_id = self._authenticate(auth_plugin)
+            except http_exc.Unauthorized as e:
+                raise exceptions.OpenStackProviderException(e.details)
+            if "auth_url" in auth_args:
+                with self._lock:
+                    self._tokens[identity] = auth_plugin.get_access(session)
+
+        scoped = ScopedClients(session, auth_plugin, project_id, region_name)
+        if http_stats.get_stats() is not None:
+            for service_type in ("compute", "image"):
+                http_stats.register_endpoint(
+                    service_type,
+                    session.get_endpoint(
+                        service_type=service_type, region_name=region_name or None
+                    ),
+                )
+        with self._lock:
+            return self._scoped.setdefault(key, scoped)
+
+    def invalidate(self):
+        """Forgets every token and scoped client of the pool"""
+        with self._lock:
+            self._tokens.clear()
+            self._scoped.clear()
@@ -2,8 +2,14 @@
 Simple utilities for getting information from endpoints
 """
 
+import errno
+import json
 import logging
+import os
+import selectors
 import socket
+import threading
+import time
 from urllib.parse import urlparse
 from xml.etree.ElementTree import ParseError  # nosec
 
@@ -11,8 +17,50 @@ import defusedxml.ElementTree
 import requests
 from OpenSSL import SSL
 
+from .. import http_stats
+from ..utils import write_atomic
+
 logger = logging.getLogger(__name__)
 
+GOCDB_URL = "https://goc.egi.eu/gocdbpi/public/"
+DEFAULT_GOCDB_CACHE_TTL = 3600
+DEFAULT_CA_TIMEOUT = 10
+DEFAULT_CA_CACHE_TTL = 24 * 3600
+HAPPY_EYEBALLS_DELAY = 0.25
+
+# Providers running in the same process refresh each GOCDB index only once
+# and do not overwrite the changes of each other to a cache file
+_cache_locks = {}
+_cache_locks_lock = threading.Lock()
+
+
+def _cache_lock(cache_file):
+    """Returns the lock guarding the updates of cache_file"""
+    with _cache_locks_lock:
+        return _cache_locks.setdefault(cache_file, threading.Lock())
+
+
+def load_cache(cache_file):
+    """Loads a JSON cache file, returns an empty dict if not usable"""
+    try:
+        with open(cache_file, "r") as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring cache file %s: %s", cache_file, e)
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_cache(cache_file, cache):
+    """Atomically writes the cache dict as JSON into cache_file"""
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        write_atomic(cache_file, json.dumps(cache).encode())
+    except OSError as e:
+        logger.warning("Unable to write cache file %s: %s", cache_file, e)
+
 
 def _are_url_similar(u1, u2):
     """Compares 2 urls just considering host and path"""
@@ -26,6 +74,53 @@ def _are_url_similar(u1, u2):
     return False
 
 
+def _url_key(url):
+    """Returns the key of an URL in the GOCDB index
+
+    URLs are considered the same if they have the same scheme, host and
+    path, as done by `_are_url_similar`.
+    """
+    if isinstance(url, str):
+        url = urlparse(url)
+    return f"{url.scheme}://{url.netloc}/{url.path.strip('/')}"
+
+
+def _get_service_urls(svc):
+    urls = []
+    elems = [svc.find("URL")]
+    elems.extend(ep.find("URL") for ep in svc.find("ENDPOINTS"))
+    for elem in elems:
+        try:
+            if elem.text:
+                urls.append(urlparse(elem.text))
+        except AttributeError:
+            # something is wrong at GOCDB, do not care
+            pass
+    return urls
+
+
+def _get_service_info(svc):
+    return {
+        "gocdb_id": svc.attrib["PRIMARY_KEY"],
+        "site_name": svc.find("SITENAME").text,
+    }
+
+
+def _build_gocdb_index(result):
+    """Builds an index from URL key to the GOCDB service info
+
+    When several services share an URL, the first one in the GOCDB output
+    wins, as in `_find_url_in_result`.
+    """
+    index = {}
+    for svc in result:
+        for url in _get_service_urls(svc):
+            key = _url_key(url)
+            if key not in index:
+                index[key] = _get_service_info(svc)
+    return index
+
+
 def _find_url_in_result(svc_url, result):
     """Finds service matching URL in GOCDB
 
@@ -38,44 +133,184 @@ def _find_url_in_result(svc_url, result):
 
     svc_url = urlparse(svc_url)
     for svc in result:
-        urls = []
-        try:
-            urls.append(urlparse(svc.find("URL").text))
-        except AttributeError:
-            # something is wrong at GOCDB, do not care
-            pass
-        for ep in svc.find("ENDPOINTS"):
-            try:
-                urls.append(urlparse(ep.find("URL").text))
-            except AttributeError:
-                # something is wrong at GOCDB, do not care
-                pass
-        for url in urls:
+        for url in _get_service_urls(svc):
             if _are_url_similar(svc_url, url):
-                return {
-                    "gocdb_id": svc.attrib["PRIMARY_KEY"],
-                    "site_name": svc.find("SITENAME").text,
-                }
+                return _get_service_info(svc)
     logger.warning("Unable to find URL %s in GOCDB!", svc_url)
     return {}
 
 
-def find_in_gocdb(svc_url, svc_type, insecure=False, timeout=None):
-    """Find service matching URL and service type in GOCDB"""
+class _ResponseReader:
+    """File-like object reading the content of a streamed response"""
+
+    def __init__(self, response, chunk_size=64 * 1024):
+        self._chunks = response.iter_content(chunk_size=chunk_size)
+
+    def read(self, size=-1):
+        # the XML parser is fine with getting less data than requested
+        return next(self._chunks, b"")
+
+
+def _iter_gocdb_services(response):
+    """Yields the services of a streamed GOCDB response as they are parsed
+
+    Services are removed from the parsed tree once consumed, so only one of
+    them is kept in memory at a time.
+    """
+    depth = 0
+    root = None
+    try:
+        for event, elem in defusedxml.ElementTree.iterparse(
+            _ResponseReader(response), events=("start", "end")
+        ):
+            if event == "start":
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                yield elem
+                root.clear()
+    finally:
+        response.close()
+
+
+def _get_gocdb_services(
+    svc_type, insecure=False, timeout=None, stream=False, gocdb_url=None, **kwargs
+):
+    """Queries GOCDB (at gocdb_url if given) for the services of svc_type
 
-    verify = not insecure
+    Returns the response and an iterable with the services, which is None
+    if the response is not successful. With stream, the services are
+    parsed incrementally while iterating over them.
+    """
+    if stream:
+        kwargs["stream"] = True
     r = requests.get(
-        "https://goc.egi.eu/gocdbpi/public/",
+        gocdb_url or GOCDB_URL,
         params={"method": "get_service", "service_type": svc_type},
-        verify=verify,
+        verify=not insecure,
         timeout=timeout,
+        **kwargs,
     )
+    http_stats.record_response(r, service="gocdb", stream=stream)
     if r.status_code != 200:
-        logger.warning("Something went wrong with GOC %s", r.text)
-        return {}
+        return r, None
+    if stream:
+        return r, _iter_gocdb_services(r)
+    return r, defusedxml.ElementTree.fromstring(r.text)
+
+
+def get_gocdb_index(
+    svc_type,
+    cache_dir,
+    cache_ttl,
+    insecure=False,
+    timeout=None,
+    stream=False,
+    gocdb_url=None,
+):
+    """Returns the index of GOCDB services of the given type
+
+    The index is kept in a file under cache_dir. The file is used as is
+    for cache_ttl seconds, then GOCDB is queried again with a conditional
+    request so the service list is only downloaded if it changed. Concurrent
+    calls for the same index wait for the one refreshing it.
+    """
+    cache_file = os.path.join(cache_dir, f"gocdb-{svc_type}.json")
+    with _cache_lock(cache_file):
+        return _get_gocdb_index(
+            cache_file, svc_type, cache_ttl, insecure, timeout, stream, gocdb_url
+        )
+
+
+def _get_gocdb_index(
+    cache_file, svc_type, cache_ttl, insecure, timeout, stream, gocdb_url
+):
+    cache = load_cache(cache_file)
+    now = time.time()
+    if "index" in cache and now - cache.get("timestamp", 0) < cache_ttl:
+        return cache["index"]
+
+    headers = {}
+    if "index" in cache:
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified"):
+            headers["If-Modified-Since"] = cache["last_modified"]
+    try:
+        r, services = _get_gocdb_services(
+            svc_type, insecure, timeout, stream, gocdb_url, headers=headers
+        )
+        if r.status_code == 304 and "index" in cache:
+            cache["timestamp"] = now
+            save_cache(cache_file, cache)
+            return cache["index"]
+        if services is None:
+            logger.warning("Something went wrong with GOC %s", r.text)
+            return cache.get("index", {})
+        index = _build_gocdb_index(services)
+    except requests.RequestException as e:
+        if "index" not in cache:
+            raise
+        logger.warning("Unable to refresh GOC info, using cached one: %s", e)
+        return cache["index"]
+    except ParseError:
+        logger.warning("Something went wrong with parsing GOC output")
+        return cache.get("index", {})
+    save_cache(
+        cache_file,
+        {
+            "timestamp": now,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "index": index,
+        },
+    )
+    return index
+
+
+def find_in_gocdb(
+    svc_url,
+    svc_type,
+    insecure=False,
+    timeout=None,
+    cache_dir=None,
+    cache_ttl=DEFAULT_GOCDB_CACHE_TTL,
+    stream=False,
+    gocdb_url=None,
+):
+    """Find service matching URL and service type in GOCDB
+
+    If cache_dir is set, the GOCDB services are kept in a persistent index
+    (see `get_gocdb_index`), otherwise they are downloaded on every call.
+    With stream, the GOCDB response is parsed while it is downloaded and,
+    when not building the index, the download stops at the first match.
+    """
+
+    if cache_dir:
+        index = get_gocdb_index(
+            svc_type, cache_dir, cache_ttl, insecure, timeout, stream, gocdb_url
+        )
+        info = index.get(_url_key(svc_url))
+        if info is None:
+            logger.warning("Unable to find URL %s in GOCDB!", svc_url)
+            return {}
+        return dict(info)
+
     try:
-        goc_xml = defusedxml.ElementTree.fromstring(r.text)
-        return _find_url_in_result(svc_url, goc_xml)
+        r, services = _get_gocdb_services(
+            svc_type, insecure, timeout, stream, gocdb_url
+        )
+        if services is None:
+            logger.warning("Something went wrong with GOC %s", r.text)
+            return {}
+        result = _find_url_in_result(svc_url, services)
+        if stream:
+            # stop the download if we found the service before the end
+            services.close()
+        return result
     except ParseError:
         logger.warning("Something went wrong with parsing GOC output")
         return {}
@@ -90,52 +325,218 @@ def get_dn(x509name):
     return obj_name[start:end]
 
 
-def get_endpoint_ca_information(endpoint_url, insecure=False):
-    """Return certificate issuer and trusted CAs list of HTTPS endpoint."""
-    ca_info = {"issuer": "UNKNOWN", "trusted_cas": ["UNKNOWN"]}
+def _interleave_addrinfo(infos):
+    """Sorts addresses alternating their families, as in RFC 8305
 
-    verify = SSL.VERIFY_NONE if insecure else SSL.VERIFY_PEER
+    The first family returned by the resolver (usually IPv6) goes first.
+    """
+    by_family = {}
+    for info in infos:
+        by_family.setdefault(info[0], []).append(info)
+    families = list(by_family.values())
+    result = []
+    for i in range(max((len(f) for f in families), default=0)):
+        result.extend(f[i] for f in families if i < len(f))
+    return result
 
-    scheme = urlparse(endpoint_url).scheme
-    host = urlparse(endpoint_url).hostname
-    port = urlparse(endpoint_url).port
 
-    if scheme != "https":
-        return ca_info
+def _wait_socket(sock, events, deadline):
+    with selectors.DefaultSelector() as sel:
+        sel.register(sock, events)
+        if not sel.select(max(0, deadline - time.monotonic())):
+            raise TimeoutError("Timed out waiting for the endpoint")
 
-    # use default port for https
-    if not port:
-        port = 443
 
+def _getaddrinfo(host, port, deadline):
+    """Resolves host and port for TCP before the deadline
+
+    socket.getaddrinfo has no timeout, so it is run in a daemon thread that
+    is left behind if the resolution does not finish in time.
+    """
+    result = {}
+
+    def resolve():
+        try:
+            result["addrinfo"] = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            result["error"] = e
+
+    resolver = threading.Thread(target=resolve, daemon=True)
+    resolver.start()
+    resolver.join(max(0, deadline - time.monotonic()))
+    if resolver.is_alive():
+        raise TimeoutError(f"Timed out resolving {host}")
+    if "error" in result:
+        raise result["error"]
+    return result["addrinfo"]
+
+
+def _connect(host, port, deadline, delay=HAPPY_EYEBALLS_DELAY):
+    """Opens a non-blocking TCP connection to host and port
+
+    Addresses are tried following Happy Eyeballs (RFC 8305): a new
+    connection attempt is started every `delay` seconds, or as soon as the
+    previous one fails, alternating address families. The first attempt
+    to connect wins and the others are closed.
+    """
+    pending = _interleave_addrinfo(_getaddrinfo(host, port, deadline))
+    attempts = []
+    winner = None
+    last_error = None
+    next_attempt = time.monotonic()
+    sel = selectors.DefaultSelector()
     try:
-        ctx = SSL.Context(SSL.TLSv1_2_METHOD)
-        ctx.set_options(SSL.OP_NO_SSLv2)
-        ctx.set_options(SSL.OP_NO_SSLv3)
-        ctx.set_verify(verify, lambda conn, cert, errno, depth, ok: ok)
-        ctx.set_default_verify_paths()
+        while pending or attempts:
+            now = time.monotonic()
+            if now >= deadline:
+                raise TimeoutError(f"Timed out connecting to {host}:{port}")
+            if pending and (now >= next_attempt or not attempts):
+                family, sock_type, proto, _, addr = pending.pop(0)
+                sock = socket.socket(family, sock_type, proto)
+                sock.setblocking(False)
+                err = sock.connect_ex(addr)
+                if err == 0:
+                    winner = sock
+                    return sock
+                if err not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                    sock.close()
+                    last_error = OSError(err, os.strerror(err))
+                    continue
+                sel.register(sock, selectors.EVENT_WRITE)
+                attempts.append(sock)
+                next_attempt = now + delay
+            timeout = deadline - now
+            if pending:
+                timeout = min(timeout, max(0, next_attempt - now))
+            for key, _ in sel.select(timeout):
+                sock = key.fileobj
+                sel.unregister(sock)
+                attempts.remove(sock)
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0:
+                    winner = sock
+                    return sock
+                sock.close()
+                last_error = OSError(err, os.strerror(err))
+                # no need to wait for starting the next attempt
+                next_attempt = time.monotonic()
+        raise last_error or OSError(f"Unable to connect to {host}:{port}")
+    finally:
+        for sock in attempts:
+            if sock is not winner:
+                sock.close()
+        sel.close()
+
+
+def _probe_ca_information(host, port, insecure, timeout):
+    """Returns the certificate fingerprint, issuer and trusted CAs of host
 
-        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client.connect((host, port))
+    Both the connection and the TLS handshake need to complete within
+    timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    verify = SSL.VERIFY_NONE if insecure else SSL.VERIFY_PEER
 
+    ctx = SSL.Context(SSL.TLSv1_2_METHOD)
+    ctx.set_options(SSL.OP_NO_SSLv2)
+    ctx.set_options(SSL.OP_NO_SSLv3)
+    ctx.set_verify(verify, lambda conn, cert, errno, depth, ok: ok)
+    ctx.set_default_verify_paths()
+
+    client = _connect(host, port, deadline)
+    try:
         client_ssl = SSL.Connection(ctx, client)
         client_ssl.set_connect_state()
         client_ssl.set_tlsext_host_name(host.encode("utf-8"))
-        client_ssl.do_handshake()
+        while True:
+            try:
+                client_ssl.do_handshake()
+                break
+            except SSL.WantReadError:
+                _wait_socket(client, selectors.EVENT_READ, deadline)
+            except SSL.WantWriteError:
+                _wait_socket(client, selectors.EVENT_WRITE, deadline)
 
         cert = client_ssl.get_peer_certificate()
-        issuer = get_dn(cert.get_issuer())
+        ca_info = {
+            "fingerprint": cert.digest("sha256").decode("ascii"),
+            "issuer": get_dn(cert.get_issuer()),
+            "trusted_cas": [get_dn(ca) for ca in client_ssl.get_client_ca_list()],
+        }
+        try:
+            client_ssl.shutdown()
+        except SSL.Error:
+            # non-blocking socket, we are not waiting for the peer
+            pass
+    finally:
+        client.close()
+    return ca_info
+
+
+def unknown_ca_information():
+    """Returns the CA information used when it cannot be obtained"""
+    return {"issuer": "UNKNOWN", "trusted_cas": ["UNKNOWN"]}
+
+
+def get_endpoint_ca_information(
+    endpoint_url,
+    insecure=False,
+    timeout=DEFAULT_CA_TIMEOUT,
+    cache_dir=None,
+    cache_ttl=DEFAULT_CA_CACHE_TTL,
+):
+    """Return certificate issuer and trusted CAs list of HTTPS endpoint.
+
+    If cache_dir is set, the information obtained is kept there, keyed by
+    host:port together with the fingerprint of the certificate, and reused
+    for cache_ttl seconds without connecting to the endpoint.
+    """
+    ca_info = unknown_ca_information()
 
-        client_ca_list = client_ssl.get_client_ca_list()
-        trusted_cas = [get_dn(ca) for ca in client_ca_list]
+    scheme = urlparse(endpoint_url).scheme
+    host = urlparse(endpoint_url).hostname
+    port = urlparse(endpoint_url).port
+
+    if scheme != "https":
+        return ca_info
+
+    # use default port for https
+    if not port:
+        port = 443
 
-        client_ssl.shutdown()
-        client_ssl.close()
+    key = f"{host}:{port}"
+    cache = {}
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, "ca-info.json")
+        cache = load_cache(cache_file)
+        cached = cache.get(key, {})
+        if time.time() - cached.get("timestamp", 0) < cache_ttl:
+            ca_info["issuer"] = cached["issuer"]
+            ca_info["trusted_cas"] = cached["trusted_cas"]
+            return ca_info
 
-        ca_info["issuer"] = issuer
-        ca_info["trusted_cas"] = trusted_cas
+    try:
+        probed = _probe_ca_information(host, port, insecure, timeout)
     except SSL.Error as e:
         logger.warning("Issue when getting CA info from endpoint: %s", e)
+        return ca_info
     except TimeoutError as e:
         logger.warning("Timeout when getting CA info from endpoint: %s", e)
+        return ca_info
+    except OSError as e:
+        logger.warning("Unable to connect to endpoint for CA info: %s", e)
+        return ca_info
 
+    ca_info["issuer"] = probed["issuer"]
+    ca_info["trusted_cas"] = probed["trusted_cas"]
+    if cache_dir:
+        previous = cache.get(key, {}).get("fingerprint")
+        if previous and previous != probed["fingerprint"]:
+            logger.info("Certificate of %s changed since last run", key)
+        probed["timestamp"] = time.time()
+        with _cache_lock(cache_file):
+            # keep the entries saved by others since it was loaded
+            cache = load_cache(cache_file)
+            cache[key] = probed
+            save_cache(cache_file, cache)
     return ca_info
@@ -1,4 +1,8 @@
 class BasePublisher(object):
+    # publishers keeping a single output, like a file or stdout, need the
+    # information of several sites combined in one publication
+    single_output = False
+
     def __init__(self, opts):
         self.opts = opts
 
@@ -9,3 +13,28 @@ class BasePublisher(object):
 
     def publish(self, output):
         raise NotImplementedError
+
+    def publish_chunks(self, chunks):
+        """Publishes the output given as an iterable of strings
+
+        Publishers able to write the output as it is produced should
+        override this, by default the chunks are joined and published.
+        """
+        self.publish("".join(chunks))
+
+    def publish_glue(self, formatter, opts, glue):
+        """Publishes the Glue objects using formatter
+
+        By default the output of formatter is published in chunks, but
+        publishers can get the structured document from the formatter and
+        encode it on their own.
+        """
+        self.publish_chunks(formatter.iter_format(opts, glue))
+
+    def publish_document(self, formatter, opts, document):
+        """Publishes a document as returned by formatter.document"""
+        self.publish_chunks(formatter.iter_encode(document))
+
+    def close(self):
+        """Releases the resources kept between publications, if any"""
+        pass
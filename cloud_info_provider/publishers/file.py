@@ -0,0 +1,121 @@
+"""
+File Publisher
+
+Writes the output to a file, replacing it atomically
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+from cloud_info_provider.diff import object_hash
+from cloud_info_provider.exceptions import CloudInfoException
+from cloud_info_provider.publishers.base import BasePublisher
+from cloud_info_provider.utils import write_atomic
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(document):
+    """Returns a hash of the document ignoring the volatile fields"""
+    h = hashlib.sha256()
+    for name, objs in document.items():
+        h.update(json.dumps(name).encode())
+        for o in objs:
+            h.update(object_hash(o).encode())
+    return h.hexdigest()
+
+
+class FilePublisher(BasePublisher):
+    # every site would overwrite the output of the previous one
+    single_output = True
+
+    def __init__(self, opts):
+        super().__init__(opts)
+        if not opts.output_file:
+            raise CloudInfoException("--output-file is needed by the file publisher")
+        if opts.output_compression == "zstd" and zstandard is None:
+            raise CloudInfoException("zstd compression needs the zstandard package")
+        self.output_file = opts.output_file
+        self.hash_file = f"{opts.output_file}.hash"
+
+    @staticmethod
+    def populate_parser(parser):
+        """Populate the argparser 'parser' with the needed options."""
+        parser.add_argument(
+            "--output-file",
+            metavar="<file>",
+            help="File to write the output to.",
+        )
+
+        parser.add_argument(
+            "--output-compression",
+            choices=["none", "gzip", "zstd"],
+            default="none",
+            help="Compression of the output file.",
+        )
+
+    def _digest(self, content_digest, formatter=None):
+        """Returns the digest of the output file
+
+        The content digest is combined with the formatter and compression
+        used, as any of them changes the file written.
+        """
+        name = type(formatter).__name__ if formatter else ""
+        compression = self.opts.output_compression
+        return hashlib.sha256(
+            f"{name}:{compression}:{content_digest}".encode()
+        ).hexdigest()
+
+    def _changed(self, digest):
+        try:
+            with open(self.hash_file) as f:
+                previous = f.read().strip()
+        except OSError:
+            return True
+        return previous != digest or not os.path.exists(self.output_file)
+
+    def _open_compressed(self, f):
+        if self.opts.output_compression == "gzip":
+            return gzip.GzipFile(fileobj=f, mode="wb", mtime=0)
+        elif self.opts.output_compression == "zstd":
+            return zstandard.ZstdCompressor().stream_writer(f, closefd=False)
+        return f
+
+    def _publish(self, digest, chunks):
+        if not self._changed(digest):
+            logger.info("Output unchanged, not writing %s", self.output_file)
+            return False
+        write_atomic(
+            self.output_file,
+            (chunk.encode("utf-8") for chunk in chunks),
+            wrap=self._open_compressed,
+        )
+        write_atomic(self.hash_file, f"{digest}\n".encode())
+        return True
+
+    def publish(self, output):
+        digest = self._digest(hashlib.sha256(output.encode()).hexdigest())
+        return self._publish(digest, [output])
+
+    def publish_glue(self, formatter, opts, glue):
+        """Writes the output of formatter, unless it did not change
+
+        Returns whether the file was written.
+        """
+        try:
+            document = formatter.document(opts, glue)
+        except NotImplementedError:
+            return self.publish("".join(formatter.iter_format(opts, glue)))
+        return self.publish_document(formatter, opts, document)
+
+    def publish_document(self, formatter, opts, document):
+        digest = self._digest(content_hash(document), formatter)
+        return self._publish(digest, formatter.iter_encode(document))
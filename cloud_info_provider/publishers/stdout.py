@@ -7,12 +7,14 @@ Just prints to stdout
 from __future__ import print_function
 
 import json
-from io import StringIO
+import sys
 
 from cloud_info_provider.publishers.base import BasePublisher
 
 
 class StdOutPublisher(BasePublisher):
+    single_output = True
+
     @staticmethod
     def populate_parser(parser):
         """Populate the argparser 'parser' with the needed options."""
@@ -21,14 +23,36 @@ class StdOutPublisher(BasePublisher):
     def publish(self, output):
         print(output)
 
+    def publish_chunks(self, chunks):
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+
 
 class JSONStdOutPublisher(BasePublisher):
+    single_output = True
+
     @staticmethod
     def populate_parser(parser):
         """Populate the argparser 'parser' with the needed options."""
         pass
 
     def publish(self, output):
-        output_io = StringIO(output.replace("'", '"'))
-        json_data = json.load(output_io)
-        print(json.dumps(json_data, indent=4, sort_keys=True))
+        self._dump(json.loads(output))
+
+    def publish_glue(self, formatter, opts, glue):
+        try:
+            document = formatter.document(opts, glue)
+        except NotImplementedError:
+            super().publish_glue(formatter, opts, glue)
+        else:
+            self.publish_document(formatter, opts, document)
+
+    def publish_document(self, formatter, opts, document):
+        self._dump(document)
+
+    def _dump(self, document):
+        json.dump(document, sys.stdout, indent=4, sort_keys=True, default=str)
+        sys.stdout.write("\n")
+        sys.stdout.flush()
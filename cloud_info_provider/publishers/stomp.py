@@ -0,0 +1,414 @@
+"""
+STOMP Publisher
+
+Sends the output to a message broker using STOMP 1.2
+"""
+
+import collections
+import itertools
+import json
+import logging
+import re
+import socket
+import ssl
+import time
+import uuid
+
+from cloud_info_provider.exceptions import StompPublisherException
+from cloud_info_provider.publishers.base import BasePublisher
+from cloud_info_provider.utils import env
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 61613
+MAX_BACKOFF = 60
+
+Frame = collections.namedtuple("Frame", ["command", "headers", "body"])
+
+_ESCAPES = {"\\": "\\\\", "\r": "\\r", "\n": "\\n", ":": "\\c"}
+_UNESCAPES = {v: k for k, v in _ESCAPES.items()}
+
+
+def _escape(value):
+    return "".join(_ESCAPES.get(c, c) for c in value)
+
+
+def _unescape(value):
+    return re.sub(r"\\.", lambda m: _UNESCAPES.get(m.group(0), m.group(0)), value)
+
+
+def encode_frame(command, headers=None, body=b""):
+    """Returns the bytes of a STOMP frame"""
+    # headers of the connection frames are not escaped
+    escape = _escape if command not in ("CONNECT", "CONNECTED") else str
+    lines = [command]
+    for k, v in (headers or {}).items():
+        lines.append(f"{escape(k)}:{escape(str(v))}")
+    if body:
+        lines.append(f"content-length:{len(body)}")
+    return ("\n".join(lines) + "\n\n").encode("utf-8") + body + b"\0"
+
+
+class FrameReader:
+    """Reads STOMP frames from a socket"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b""
+
+    def _recv(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("Connection closed by the broker")
+        self.buffer += data
+
+    def read(self):
+        while True:
+            # skip heart-beats
+            self.buffer = self.buffer.lstrip(b"\r\n")
+            end = self.buffer.find(b"\n\n")
+            if end >= 0:
+                break
+            self._recv()
+        lines = self.buffer[:end].decode("utf-8").split("\n")
+        command = lines[0].rstrip("\r")
+        unescape = _unescape if command not in ("CONNECT", "CONNECTED") else str
+        headers = {}
+        for line in lines[1:]:
+            k, _, v = line.rstrip("\r").partition(":")
+            # repeated headers: the first one is the valid one
+            headers.setdefault(unescape(k), unescape(v))
+        start = end + 2
+        if "content-length" in headers:
+            body_end = start + int(headers["content-length"])
+            while len(self.buffer) <= body_end:
+                self._recv()
+        else:
+            while (body_end := self.buffer.find(b"\0", start)) < 0:
+                self._recv()
+        body = self.buffer[start:body_end]
+        self.buffer = self.buffer[body_end + 1 :]
+        return Frame(command, headers, body)
+
+
+class StompConnection:
+    """Minimal STOMP 1.2 client connection for sending messages"""
+
+    def __init__(
+        self,
+        host,
+        port=DEFAULT_PORT,
+        login=None,
+        passcode=None,
+        vhost=None,
+        use_ssl=False,
+        insecure=False,
+        timeout=None,
+    ):
+        sock = socket.create_connection((host, port), timeout=timeout)
+        if use_ssl:
+            context = ssl.create_default_context()
+            if insecure:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            sock = context.wrap_socket(sock, server_hostname=host)
+        self.sock = sock
+        self.reader = FrameReader(sock)
+        self._receipt_ids = (f"{uuid.uuid4().hex}-{i}" for i in itertools.count())
+        headers = {"accept-version": "1.2", "host": vhost or host, "heart-beat": "0,0"}
+        if login:
+            headers["login"] = login
+            headers["passcode"] = passcode or ""
+        try:
+            self._send_frame("CONNECT", headers)
+            frame = self._read_frame()
+        except BaseException:
+            sock.close()
+            raise
+        if frame.command != "CONNECTED":
+            sock.close()
+            raise StompPublisherException(f"Unexpected {frame.command} frame")
+
+    def _send_frame(self, command, headers=None, body=b""):
+        self.sock.sendall(encode_frame(command, headers, body))
+
+    def _read_frame(self):
+        frame = self.reader.read()
+        if frame.command == "ERROR":
+            message = frame.headers.get("message", "")
+            raise StompPublisherException(f"Broker error: {message}")
+        return frame
+
+    def _wait_receipt(self, pending, on_receipt):
+        frame = self._read_frame()
+        if frame.command != "RECEIPT":
+            logger.debug("Ignoring %s frame from the broker", frame.command)
+            return
+        receipt_id = frame.headers.get("receipt-id")
+        # the broker processes the frames in order, so a receipt also
+        # confirms any previous message
+        while pending:
+            receipt, i = pending.popleft()
+            if on_receipt:
+                on_receipt(i)
+            if receipt == receipt_id:
+                break
+
+    def send_many(self, destination, messages, window=10, on_receipt=None):
+        """Sends the messages to destination
+
+        messages are (index, body) tuples. At most window messages are sent
+        without getting their receipt from the broker, and on_receipt is
+        called with the index of every message received by the broker.
+        """
+        pending = collections.deque()
+        for i, body in messages:
+            receipt = next(self._receipt_ids)
+            headers = {
+                "destination": destination,
+                "content-type": "application/json",
+                "persistent": "true",
+                "receipt": receipt,
+            }
+            self._send_frame("SEND", headers, body)
+            pending.append((receipt, i))
+            while len(pending) >= max(1, window):
+                self._wait_receipt(pending, on_receipt)
+        while pending:
+            self._wait_receipt(pending, on_receipt)
+
+    def close(self):
+        try:
+            self._send_frame("DISCONNECT", {"receipt": next(self._receipt_ids)})
+            self._read_frame()
+        except (OSError, StompPublisherException):
+            pass
+        finally:
+            self.sock.close()
+
+
+def batch_messages(document, max_bytes=0):
+    """Returns the messages for the objects of the document
+
+    Each message is a JSON document with the same structure as the original
+    one and as many objects as fit in max_bytes, or just one if max_bytes
+    is 0. Objects bigger than max_bytes go alone in their message.
+    """
+    batches = []
+    batch = {}
+    size = 2
+    for name, objs in document.items():
+        name = json.dumps(name)
+        for o in objs:
+            obj = json.dumps(o, default=str)
+            # upper bound of the size added, including separators
+            obj_size = len(obj) + 2
+            name_size = 0 if name in batch else len(name) + 6
+            if batch and (not max_bytes or size + obj_size + name_size > max_bytes):
+                batches.append(batch)
+                batch = {}
+                size = 2
+                name_size = len(name) + 6
+            size += obj_size + name_size
+            batch.setdefault(name, []).append(obj)
+    if batch:
+        batches.append(batch)
+    return [
+        ("{" + ", ".join(f"{k}: [{', '.join(v)}]" for k, v in b.items()) + "}").encode(
+            "utf-8"
+        )
+        for b in batches
+    ]
+
+
+class StompPublisher(BasePublisher):
+    """Sends the Glue objects to a STOMP destination
+
+    The connection is kept open between publications (e.g. in daemon
+    mode) and opened again when needed. Sending is retried with
+    exponential backoff, starting from the first message without receipt.
+    """
+
+    def __init__(self, opts):
+        super().__init__(opts)
+        if not opts.stomp_destination:
+            raise StompPublisherException(
+                "--stomp-destination is needed by the stomp publisher"
+            )
+        self._password = self._get_password(opts)
+        self._conn = None
+
+    @staticmethod
+    def _get_password(opts):
+        """Returns the password from the options, a file or the environment"""
+        if opts.stomp_password:
+            return opts.stomp_password
+        if opts.stomp_password_file:
+            try:
+                with open(opts.stomp_password_file) as f:
+                    return f.readline().rstrip("\n")
+            except OSError as e:
+                raise StompPublisherException(
+                    f"Unable to read the STOMP password file: {e}"
+                )
+        return env("STOMP_PASSWORD", default=None)
+
+    @staticmethod
+    def populate_parser(parser):
+        """Populate the argparser 'parser' with the needed options."""
+        parser.add_argument(
+            "--stomp-host",
+            default="localhost",
+            help="Host of the STOMP broker.",
+        )
+
+        parser.add_argument(
+            "--stomp-port",
+            type=int,
+            default=DEFAULT_PORT,
+            help="Port of the STOMP broker.",
+        )
+
+        parser.add_argument(
+            "--stomp-ssl",
+            action="store_true",
+            default=False,
+            help="Use SSL for connecting to the STOMP broker.",
+        )
+
+        parser.add_argument(
+            "--stomp-user",
+            default=None,
+            help="User for the STOMP broker.",
+        )
+
+        parser.add_argument(
+            "--stomp-password",
+            default=None,
+            help=(
+                "Password for the STOMP broker. Visible to other local users, "
+                "prefer --stomp-password-file or the STOMP_PASSWORD environment "
+                "variable."
+            ),
+        )
+
+        parser.add_argument(
+            "--stomp-password-file",
+            metavar="<file>",
+            default=None,
+            help="File with the password for the STOMP broker in its first line.",
+        )
+
+        parser.add_argument(
+            "--stomp-vhost",
+            default=None,
+            help="Virtual host of the STOMP broker, if not the broker host.",
+        )
+
+        parser.add_argument(
+            "--stomp-destination",
+            default=None,
+            help="STOMP destination (e.g. /topic/cloud-info) for the messages.",
+        )
+
+        parser.add_argument(
+            "--stomp-batch-size",
+            metavar="<bytes>",
+            type=int,
+            default=1024 * 1024,
+            help=(
+                "Maximum size of the messages, each with as many objects as "
+                "fit. Use 0 for sending each object on its own message."
+            ),
+        )
+
+        parser.add_argument(
+            "--stomp-window",
+            metavar="N",
+            type=int,
+            default=10,
+            help="Maximum number of messages sent without broker receipt.",
+        )
+
+        parser.add_argument(
+            "--stomp-retries",
+            metavar="N",
+            type=int,
+            default=5,
+            help="Times to retry sending the messages to the broker.",
+        )
+
+        parser.add_argument(
+            "--stomp-backoff",
+            metavar="<seconds>",
+            type=float,
+            default=1,
+            help="Time to wait before the first retry, doubled on every retry.",
+        )
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = StompConnection(
+                self.opts.stomp_host,
+                self.opts.stomp_port,
+                login=self.opts.stomp_user,
+                passcode=self._password,
+                vhost=self.opts.stomp_vhost,
+                use_ssl=self.opts.stomp_ssl,
+                insecure=self.opts.insecure,
+                timeout=self.opts.timeout,
+            )
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def send(self, messages):
+        """Sends the messages, retrying from the first without receipt"""
+        done = 0
+        failures = 0
+
+        def received(i):
+            nonlocal done
+            done = i + 1
+
+        while done < len(messages):
+            start = done
+            try:
+                self._connection().send_many(
+                    self.opts.stomp_destination,
+                    itertools.islice(enumerate(messages), done, None),
+                    window=self.opts.stomp_window,
+                    on_receipt=received,
+                )
+            except (OSError, StompPublisherException) as e:
+                if self._conn is not None:
+                    self._conn.sock.close()
+                    self._conn = None
+                failures = failures + 1 if done == start else 1
+                if failures > self.opts.stomp_retries:
+                    raise StompPublisherException(
+                        f"Unable to send messages to the broker: {e}"
+                    )
+                delay = min(self.opts.stomp_backoff * 2 ** (failures - 1), MAX_BACKOFF)
+                logger.warning(
+                    "Error sending messages to the broker, retrying in %ss: %s",
+                    delay,
+                    e,
+                )
+                time.sleep(delay)
+
+    def publish(self, output):
+        self.send([output.encode("utf-8")])
+
+    def publish_glue(self, formatter, opts, glue):
+        try:
+            document = formatter.document(opts, glue)
+        except NotImplementedError:
+            return super().publish_glue(formatter, opts, glue)
+        self.publish_document(formatter, opts, document)
+
+    def publish_document(self, formatter, opts, document):
+        self.send(batch_messages(document, self.opts.stomp_batch_size))
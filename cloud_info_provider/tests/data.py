@@ -74,16 +74,18 @@ class OpenStackFakes(object):
         self.flavors = [FakeObject(**f) for f in flavors]
 
         self.servers = [
-            FakeObject(status=s)
-            for s in (
-                "SHUTOFF",
-                "SUSPENDED",
-                "SUSPENDED",
-                "SUSPENDED",
-                "SUSPENDED",
-                "RUNNING",
-                "RUNNING",
-                "RUNNING",
+            FakeObject(id=f"server{i}", status=s)
+            for i, s in enumerate(
+                (
+                    "SHUTOFF",
+                    "SUSPENDED",
+                    "SUSPENDED",
+                    "SUSPENDED",
+                    "SUSPENDED",
+                    "RUNNING",
+                    "RUNNING",
+                    "RUNNING",
+                )
             )
         ]
 
@@ -0,0 +1,95 @@
+"""
+Local STOMP broker stand-in for testing the STOMP publisher
+"""
+
+import queue
+import socket
+import threading
+import time
+
+from cloud_info_provider.publishers.stomp import FrameReader, encode_frame
+
+
+class FakeBroker:
+    """Threaded STOMP broker that records the messages sent to it
+
+    `errors` is the number of connections rejected with an ERROR frame,
+    `drop_after` closes the connection after receiving that many messages
+    (only once) and `receipt_delay` delays every receipt, so the number of
+    messages waiting for receipt at once can be checked in `max_in_flight`.
+    """
+
+    def __init__(self, errors=0, drop_after=None, receipt_delay=0):
+        self.errors = errors
+        self.drop_after = drop_after
+        self.receipt_delay = receipt_delay
+        self.messages = []
+        self.connections = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.close()
+
+    def _serve(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(sock,), daemon=True).start()
+
+    def _acker(self, sock, receipts, in_flight):
+        while (receipt := receipts.get()) is not None:
+            time.sleep(self.receipt_delay)
+            with self._lock:
+                in_flight[0] -= 1
+            try:
+                sock.sendall(encode_frame("RECEIPT", {"receipt-id": receipt}))
+            except OSError:
+                return
+
+    def _handle(self, sock):
+        reader = FrameReader(sock)
+        receipts = queue.Queue()
+        in_flight = [0]
+        acker = threading.Thread(target=self._acker, args=(sock, receipts, in_flight))
+        acker.start()
+        try:
+            frame = reader.read()
+            with self._lock:
+                self.connections += 1
+                reject = self.errors > 0
+                self.errors -= 1
+            if frame.command != "CONNECT" or reject:
+                sock.sendall(encode_frame("ERROR", {"message": "rejected"}))
+                return
+            sock.sendall(encode_frame("CONNECTED", {"version": "1.2"}))
+            while True:
+                frame = reader.read()
+                if frame.command == "SEND":
+                    with self._lock:
+                        self.messages.append((frame.headers, frame.body))
+                        in_flight[0] += 1
+                        self.max_in_flight = max(self.max_in_flight, in_flight[0])
+                        drop = len(self.messages) == self.drop_after
+                    if drop:
+                        self.drop_after = None
+                        return
+                    receipts.put(frame.headers["receipt"])
+                elif frame.command == "DISCONNECT":
+                    receipts.put(frame.headers["receipt"])
+                    return
+        except (ConnectionError, OSError):
+            return
+        finally:
+            receipts.put(None)
+            acker.join()
+            sock.close()
@@ -1,6 +1,10 @@
+import time
+
 import cloud_info_provider.providers.base
 import mock
-from cloud_info_provider import glue
+import requests
+from cloud_info_provider import deadline, glue
+from cloud_info_provider.exceptions import CloudInfoException
 from cloud_info_provider.tests import base
 from cloud_info_provider.tests import utils as utils
 from cloud_info_provider.tests.data import DATA
@@ -18,6 +22,13 @@ class BaseProviderTest(base.TestCase):
             timeout = 1234
             site_config = None
             insecure = None
+            cache_dir = None
+            gocdb_cache_ttl = 3600
+            gocdb_stream = False
+            gocdb_url = None
+            ca_timeout = 10
+            ca_cache_ttl = 3600
+            strict_validation = False
 
         super().setUp()
         self.provider = FakeBaseProvider(Opts())
@@ -101,5 +112,86 @@ class BaseProviderTest(base.TestCase):
             self.provider.fetch()
             # just check the complexity here
             assert self.provider.service.complexity == "endpointType=1,share=0"
+            assert self.provider._ca_info == {
+                DATA.endpoint_url: {"issuer": "foo_ca", "trusted_cas": ["ca1", "ca2"]}
+            }
+            assert self.provider.endpoint.issuer_ca == "foo_ca"
             assert self.provider.manager
             assert self.provider.endpoint
+
+    def _slow_requests_get(self, url, timeout=None, **kwargs):
+        time.sleep(timeout)
+        raise requests.exceptions.ReadTimeout("slow gocdb")
+
+    def _slow_connect(self, host, port, expires, delay=None):
+        time.sleep(max(0, expires - time.monotonic()))
+        raise TimeoutError("slow endpoint")
+
+    def test_fetch_slow_services(self):
+        with utils.nested(
+            deadline.start(0.2),
+            mock.patch("requests.get", side_effect=self._slow_requests_get),
+            mock.patch(
+                "cloud_info_provider.providers.utils._connect",
+                side_effect=self._slow_connect,
+            ),
+        ) as (_, m_get, m_connect):
+            self.provider.fetch()
+            m_get.assert_called_once()
+            m_connect.assert_called_once()
+        assert self.provider.service.other_info == {}
+        assert self.provider.endpoint.issuer_ca == "UNKNOWN"
+        assert self.provider.endpoint.health_state == "warning"
+        assert (
+            self.provider.endpoint.health_state_info
+            == "GOCDB information not available"
+        )
+        # the GOCDB information is obtained again in the next run
+        assert self.provider._goc_info == {}
+
+    def test_fetch_deadline_exceeded(self):
+        with utils.nested(
+            deadline.start(0),
+            mock.patch("requests.get"),
+            mock.patch("cloud_info_provider.providers.utils._connect"),
+        ) as (_, m_get, m_connect):
+            self.provider.fetch()
+            m_get.assert_not_called()
+            m_connect.assert_not_called()
+        assert self.provider.service.other_info == {}
+        assert self.provider.endpoint.trusted_cas == ["UNKNOWN"]
+        assert self.provider.endpoint.health_state == "warning"
+        assert (
+            self.provider.endpoint.health_state_info
+            == "GOCDB and CA information not available"
+        )
+        assert self.provider._goc_info == {}
+        assert self.provider._ca_info == {}
+
+    def test_validate_objs(self):
+        share = glue.Share.trusted(id="share", total_vm=2, description="ignored")
+        assert share.model_dump(exclude={"creation_time"}) == glue.Share(
+            id="share", total_vm=2
+        ).model_dump(exclude={"creation_time"})
+        assert share.model_fields_set == {"id", "total_vm"}
+        # defaults are not shared between objects
+        share.add_association("Foo", "bar")
+        assert glue.Share.trusted(id="other").associations == {}
+        self.provider.add_glue(share)
+        self.provider.validate_objs()
+        self.provider.add_glue(glue.Share.trusted(id="wrong", total_vm="2"))
+        self.assertRaises(CloudInfoException, self.provider.validate_objs)
+
+    def test_fetch_strict_validation(self):
+        self.provider.opts.strict_validation = True
+        with mock.patch.object(self.provider, "validate_objs") as m_validate:
+            with utils.nested(
+                mock.patch("cloud_info_provider.providers.utils.find_in_gocdb"),
+                mock.patch(
+                    "cloud_info_provider.providers.utils.get_endpoint_ca_information"
+                ),
+            ) as (m_goc_find, m_ca_get):
+                m_goc_find.return_value = {}
+                m_ca_get.return_value = {"issuer": "foo_ca", "trusted_cas": []}
+                self.provider.fetch()
+            m_validate.assert_called_once_with()
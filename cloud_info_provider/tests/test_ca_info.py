@@ -0,0 +1,152 @@
+import concurrent.futures
+import socket
+import time
+
+import fixtures
+import mock
+
+from cloud_info_provider.providers import utils
+from cloud_info_provider.tests import base
+
+
+class CAInfoTest(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = self.useFixture(fixtures.TempDir()).path
+        self.probed = {
+            "fingerprint": "AA:BB",
+            "issuer": "/CN=Foo CA",
+            "trusted_cas": ["/CN=Foo CA", "/CN=Bar CA"],
+        }
+
+    def _listen(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        self.addCleanup(server.close)
+        return server.getsockname()[1]
+
+    def test_not_https(self):
+        with mock.patch.object(utils, "_probe_ca_information") as m_probe:
+            ca_info = utils.get_endpoint_ca_information("http://foo.example.org")
+            assert ca_info == {"issuer": "UNKNOWN", "trusted_cas": ["UNKNOWN"]}
+            m_probe.assert_not_called()
+
+    def test_probe(self):
+        with mock.patch.object(utils, "_probe_ca_information") as m_probe:
+            m_probe.return_value = self.probed
+            ca_info = utils.get_endpoint_ca_information(
+                "https://foo.example.org/v3", insecure=True, timeout=5
+            )
+            assert ca_info == {
+                "issuer": "/CN=Foo CA",
+                "trusted_cas": ["/CN=Foo CA", "/CN=Bar CA"],
+            }
+            m_probe.assert_called_once_with("foo.example.org", 443, True, 5)
+
+    def test_probe_cached(self):
+        with mock.patch.object(utils, "_probe_ca_information") as m_probe:
+            m_probe.return_value = self.probed
+            first = utils.get_endpoint_ca_information(
+                "https://foo.example.org:5000/v3", cache_dir=self.cache_dir
+            )
+            second = utils.get_endpoint_ca_information(
+                "https://foo.example.org:5000", cache_dir=self.cache_dir
+            )
+            assert first == second
+            m_probe.assert_called_once()
+            # other port is another entry
+            utils.get_endpoint_ca_information(
+                "https://foo.example.org:8774", cache_dir=self.cache_dir
+            )
+            assert m_probe.call_count == 2
+        cache = utils.load_cache(f"{self.cache_dir}/ca-info.json")
+        assert cache["foo.example.org:5000"]["fingerprint"] == "AA:BB"
+
+    def test_probe_cached_concurrently(self):
+        def probe(host, port, insecure, timeout):
+            # all the probes start from the same cache
+            time.sleep(0.1)
+            return dict(self.probed)
+
+        ports = range(5000, 5008)
+        with mock.patch.object(utils, "_probe_ca_information", side_effect=probe):
+            with concurrent.futures.ThreadPoolExecutor(len(ports)) as executor:
+                list(
+                    executor.map(
+                        lambda port: utils.get_endpoint_ca_information(
+                            f"https://foo.example.org:{port}",
+                            cache_dir=self.cache_dir,
+                        ),
+                        ports,
+                    )
+                )
+        cache = utils.load_cache(f"{self.cache_dir}/ca-info.json")
+        assert sorted(cache) == [f"foo.example.org:{port}" for port in ports]
+
+    def test_probe_cache_expired(self):
+        self.probed["timestamp"] = time.time() - 100
+        utils.save_cache(
+            f"{self.cache_dir}/ca-info.json", {"foo.example.org:443": self.probed}
+        )
+        with mock.patch.object(utils, "_probe_ca_information") as m_probe:
+            m_probe.return_value = dict(self.probed, issuer="/CN=New CA")
+            ca_info = utils.get_endpoint_ca_information(
+                "https://foo.example.org", cache_dir=self.cache_dir, cache_ttl=10
+            )
+            assert ca_info["issuer"] == "/CN=New CA"
+            m_probe.assert_called_once()
+
+    def test_probe_errors_not_cached(self):
+        with mock.patch.object(utils, "_probe_ca_information") as m_probe:
+            m_probe.side_effect = ConnectionRefusedError()
+            for _ in range(2):
+                ca_info = utils.get_endpoint_ca_information(
+                    "https://foo.example.org", cache_dir=self.cache_dir
+                )
+                assert ca_info == {"issuer": "UNKNOWN", "trusted_cas": ["UNKNOWN"]}
+            assert m_probe.call_count == 2
+
+    def test_handshake_timeout(self):
+        # the server accepts the connection but never answers the handshake
+        port = self._listen()
+        start = time.monotonic()
+        ca_info = utils.get_endpoint_ca_information(
+            f"https://127.0.0.1:{port}", timeout=0.2
+        )
+        assert time.monotonic() - start < 2
+        assert ca_info == {"issuer": "UNKNOWN", "trusted_cas": ["UNKNOWN"]}
+        assert "Timeout when getting CA info" in self.log_fixture.output
+
+    def test_connect(self):
+        port = self._listen()
+        sock = utils._connect("127.0.0.1", port, time.monotonic() + 1)
+        assert sock.getpeername() == ("127.0.0.1", port)
+        sock.close()
+
+    def test_connect_refused(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        port = server.getsockname()[1]
+        # nothing listening on the port
+        server.close()
+        self.assertRaises(
+            OSError, utils._connect, "127.0.0.1", port, time.monotonic() + 1
+        )
+
+    def test_connect_slow_resolver(self):
+        def slow_getaddrinfo(*args, **kwargs):
+            time.sleep(1)
+
+        with mock.patch("socket.getaddrinfo", side_effect=slow_getaddrinfo):
+            start = time.monotonic()
+            self.assertRaises(
+                TimeoutError, utils._connect, "foo.example.org", 443, start + 0.1
+            )
+            assert time.monotonic() - start < 0.5
+
+    def test_interleave_addrinfo(self):
+        v4 = [(socket.AF_INET, 1, 6, "", (f"10.0.0.{i}", 443)) for i in range(3)]
+        v6 = [(socket.AF_INET6, 1, 6, "", (f"::{i}", 443, 0, 0)) for i in range(2)]
+        infos = utils._interleave_addrinfo(v6 + v4)
+        assert infos == [v6[0], v4[0], v6[1], v4[1], v4[2]]
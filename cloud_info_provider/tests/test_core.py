@@ -1,5 +1,10 @@
+import json
+import os
+
+import fixtures
 import mock
-from cloud_info_provider import core
+from cloud_info_provider import core, deadline, glue
+from cloud_info_provider.formatters import glue as glue_formatter
 from cloud_info_provider.tests import base
 
 
@@ -32,3 +37,335 @@ class CoreOptionsTest(base.TestCase):
         assert opts.format == "glue21json"
         assert opts.publisher == "stdout"
         assert not opts.debug
+        assert opts.timeout == 600
+        assert opts.deadline is None
+
+    def test_populate_parser_timeouts(self):
+        parser = core.get_parser({}, [], {})
+        opts = parser.parse_args(["--timeout", "30", "--deadline", "300"])
+        assert opts.timeout == 30
+        assert opts.deadline == 300
+
+
+class CoreDaemonTest(base.TestCase):
+    def test_run(self):
+        provider, formatter, publisher = mock.Mock(), mock.Mock(), mock.Mock()
+        opts = mock.Mock(diff=False, deadline=None, trace_file=None, metrics_file=None)
+        core.run(opts, [provider], formatter, publisher)
+        publisher.publish_glue.assert_called_once_with(
+            formatter, opts, provider.fetch.return_value
+        )
+
+    def test_run_deadline(self):
+        provider, formatter, publisher = mock.Mock(), mock.Mock(), mock.Mock()
+        provider.fetch.side_effect = lambda: deadline.current()
+        opts = mock.Mock(diff=False, deadline=300, trace_file=None, metrics_file=None)
+        core.run(opts, [provider], formatter, publisher)
+        run_deadline = publisher.publish_glue.call_args.args[2]
+        assert run_deadline.seconds == 300
+        # the deadline only applies to the run
+        assert deadline.current() is None
+
+    def test_run_daemon(self):
+        opts = core.get_parser({}, [], {}).parse_args(
+            ["--daemon", "--interval", "10", "--full-refresh-interval", "30"]
+        )
+        provider, formatter, publisher = mock.Mock(), mock.Mock(), mock.Mock()
+        # first run fails, but the daemon keeps running
+        provider.fetch.side_effect = [Exception("boom")] + [mock.Mock()] * 5
+        now = [0]
+
+        def sleep(seconds):
+            if len(provider.reset.call_args_list) == 5:
+                raise KeyboardInterrupt()
+            now[0] += seconds
+
+        with (
+            mock.patch("time.monotonic", side_effect=lambda: now[0]),
+            mock.patch("time.sleep", side_effect=sleep) as m_sleep,
+        ):
+            self.assertRaises(
+                KeyboardInterrupt,
+                core.run_daemon,
+                opts,
+                [provider],
+                formatter,
+                publisher,
+            )
+        m_sleep.assert_called_with(10)
+        assert provider.fetch.call_count == 6
+        assert publisher.publish_glue.call_count == 5
+        assert [c.kwargs["full"] for c in provider.reset.call_args_list] == [
+            False,
+            False,
+            True,
+            False,
+            False,
+        ]
+        assert "Unable to publish the cloud information" in self.log_fixture.output
+
+
+class CoreMultiSiteTest(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.opts = core.get_parser({}, [], {}).parse_args(["--site-workers", "2"])
+        self.opts.site_config = ["site1.yaml", "site2.yaml", "site3.yaml"]
+        self.formatter, self.publisher = mock.Mock(), mock.Mock()
+
+    def test_get_site_providers(self):
+        provider_class = mock.Mock()
+        provider_class.shared_state.return_value = {"session_pool": "pool"}
+        providers = core.get_site_providers(provider_class, self.opts)
+        assert len(providers) == 3
+        for call, site_config in zip(
+            provider_class.call_args_list, self.opts.site_config
+        ):
+            site_opts = call.args[0]
+            assert site_opts.site_config == site_config
+            assert site_opts is not self.opts
+            assert call.kwargs == {"session_pool": "pool"}
+        provider_class.shared_state.assert_called_once_with(self.opts)
+
+    def _providers(self):
+        providers = []
+        for i, site_config in enumerate(self.opts.site_config):
+            provider = mock.Mock()
+            provider.opts.site_config = site_config
+            provider.fetch.return_value = {"Share": [f"share{i}"]}
+            providers.append(provider)
+        providers[1].fetch.side_effect = Exception("boom")
+        return providers
+
+    def test_run_separate(self):
+        core.run(self.opts, self._providers(), self.formatter, self.publisher)
+        assert self.publisher.publish_glue.call_args_list == [
+            mock.call(self.formatter, self.opts, {"Share": ["share0"]}),
+            mock.call(self.formatter, self.opts, {"Share": ["share2"]}),
+        ]
+        assert "Unable to get the information of site2.yaml" in (
+            self.log_fixture.output
+        )
+
+    def test_run_combined(self):
+        self.opts.site_output = "combined"
+        core.run(self.opts, self._providers(), self.formatter, self.publisher)
+        self.publisher.publish_glue.assert_called_once_with(
+            self.formatter, self.opts, {"Share": ["share0", "share2"]}
+        )
+
+    def test_run_profile(self):
+        path = self.useFixture(fixtures.TempDir()).path
+        self.opts.trace_file = os.path.join(path, "trace.json")
+        self.opts.metrics_file = os.path.join(path, "metrics.prom")
+        providers = self._providers()
+        self.assertRaises(
+            Exception,
+            core.run,
+            self.opts,
+            providers[1:2],
+            self.formatter,
+            self.publisher,
+        )
+        with open(self.opts.metrics_file) as f:
+            assert "cloud_info_provider_last_run_success 0" in f.read()
+        core.run(self.opts, providers, self.formatter, self.publisher)
+        with open(self.opts.trace_file) as f:
+            trace = json.load(f)
+        # sites are fetched concurrently, so their spans may be in any order
+        fetches = sorted(
+            (c for c in trace["children"] if c["name"] == "fetch"),
+            key=lambda c: c["labels"]["site"],
+        )
+        assert [c["labels"]["site"] for c in fetches] == self.opts.site_config
+        assert ["error" in c for c in fetches] == [False, True, False]
+        assert [c["name"] for c in trace["children"][3:]] == ["publish", "publish"]
+
+    def test_run_all_failing(self):
+        providers = self._providers()
+        for provider in providers:
+            provider.fetch.side_effect = Exception("boom")
+        self.assertRaises(
+            Exception, core.run, self.opts, providers, self.formatter, self.publisher
+        )
+        self.publisher.publish_glue.assert_not_called()
+
+
+class CoreDiffTest(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        self.opts = core.get_parser({}, [], {}).parse_args(
+            ["--diff", "--cache-dir", self.dir]
+        )
+        self.formatter = glue_formatter.GLUE21Json()
+        self.publisher = mock.Mock()
+        self.provider = mock.Mock()
+        self.provider.opts.site_config = "site.yaml"
+
+    def _run(self, *shares):
+        self.provider.fetch.return_value = {
+            "Share": [glue.Share(id=i, total_vm=vm) for i, vm in shares]
+        }
+        self.publisher.reset_mock()
+        core.run(self.opts, [self.provider], self.formatter, self.publisher)
+
+    def _published(self):
+        self.publisher.publish_glue.assert_not_called()
+        (_, _, document), _ = self.publisher.publish_document.call_args
+        return {
+            name: [(o.get("Type"), o["ID"]) for o in objs]
+            for name, objs in document.items()
+        }
+
+    def test_diff(self):
+        self._run(("a", 1), ("b", 1))
+        assert self._published() == {"Share": [(None, "a"), (None, "b")]}
+        # new objects with the same information are not published again
+        self._run(("a", 1), ("b", 2), ("c", 1))
+        assert self._published() == {"Share": [(None, "b"), (None, "c")]}
+        self._run(("b", 2), ("c", 1))
+        assert self._published() == {"Removed": [("Share", "a")]}
+        self._run(("b", 2), ("c", 1))
+        self.publisher.publish_document.assert_not_called()
+        with open(os.path.join(self.dir, "diff-state.json")) as f:
+            assert list(json.load(f)["site.yaml"]["Share"]) == ["b", "c"]
+
+    def test_diff_shared_ids(self):
+        def run(*shares):
+            types = []
+            for share_id, ram in shares:
+                instance_type = glue.CloudComputingInstanceType(id="flavor", ram=ram)
+                instance_type.add_association("Share", share_id)
+                types.append(instance_type)
+            self.provider.fetch.return_value = {"CloudComputingInstanceType": types}
+            self.publisher.reset_mock()
+            core.run(self.opts, [self.provider], self.formatter, self.publisher)
+
+        # the same flavor in two shares
+        run(("a", 1), ("b", 1))
+        assert len(self._published()["CloudComputingInstanceType"]) == 2
+        run(("a", 1), ("b", 1))
+        self.publisher.publish_document.assert_not_called()
+        run(("a", 1), ("b", 2))
+        (_, _, document), _ = self.publisher.publish_document.call_args
+        changed = document["CloudComputingInstanceType"]
+        assert [o["Associations"] for o in changed] == [{"Share": ["b"]}]
+        run(("b", 2))
+        (_, _, document), _ = self.publisher.publish_document.call_args
+        assert document == {
+            "Removed": [
+                {
+                    "Type": "CloudComputingInstanceType",
+                    "ID": "flavor",
+                    "Associations": {"Share": ["a"]},
+                }
+            ]
+        }
+
+    def test_diff_publish_failure(self):
+        self._run(("a", 1))
+        self.publisher.publish_document.side_effect = Exception("boom")
+        self.assertRaises(Exception, self._run, ("a", 2))
+        # the state is not updated, so the change is published again
+        self.publisher.publish_document.side_effect = None
+        self._run(("a", 2))
+        assert self._published() == {"Share": [(None, "a")]}
+
+    def test_diff_state_file(self):
+        self.opts.diff_state_file = os.path.join(self.dir, "state", "diff.json")
+        self._run(("a", 1))
+        assert os.path.exists(self.opts.diff_state_file)
+
+
+class CorePluginsTest(base.TestCase):
+    def _entry_point(self, name):
+        ep = mock.Mock()
+        ep.name = name
+        return ep
+
+    def setUp(self):
+        super().setUp()
+        self.eps = {
+            "cip.providers": [self._entry_point(n) for n in ("foo", "bar")],
+            "cip.formatters": [self._entry_point(n) for n in ("glue21json", "baz")],
+            "cip.publishers": [self._entry_point(n) for n in ("stdout", "boom")],
+        }
+        provider = self.eps["cip.providers"][1].load.return_value
+        provider.populate_parser.side_effect = lambda parser: parser.add_argument(
+            "site_config", nargs="+"
+        )
+        provider.shared_state.return_value = {}
+        self.useFixture(
+            fixtures.MockPatch(
+                "importlib.metadata.entry_points",
+                side_effect=lambda group: self.eps[group],
+            )
+        )
+
+    def test_get_plugins(self):
+        plugins = core.get_plugins("cip.providers")
+        assert list(plugins) == ["foo", "bar"]
+        for ep in self.eps["cip.providers"]:
+            ep.load.assert_not_called()
+
+    def test_main_loads_selected(self):
+        with mock.patch.object(core, "run") as m_run:
+            core.main(["--middleware", "bar", "--publisher", "boom", "site.yaml"])
+        loaded = {
+            group: [ep.name for ep in eps if ep.load.called]
+            for group, eps in self.eps.items()
+        }
+        assert loaded == {
+            "cip.providers": ["bar"],
+            "cip.formatters": ["glue21json"],
+            "cip.publishers": ["boom"],
+        }
+        opts, providers, formatter, publisher = m_run.call_args.args
+        assert opts.site_config == ["site.yaml"]
+        provider_class = self.eps["cip.providers"][1].load.return_value
+        assert providers == [provider_class.return_value]
+        publisher_class = self.eps["cip.publishers"][1].load.return_value
+        assert publisher is publisher_class.return_value
+        publisher_class.assert_called_once_with(opts)
+        publisher.close.assert_called_once_with()
+
+    def test_main_closes_publisher(self):
+        argv = ["--middleware", "bar", "--publisher", "boom", "site.yaml"]
+        publisher = self.eps["cip.publishers"][1].load.return_value.return_value
+        with mock.patch.object(core, "run", side_effect=RuntimeError("boom")):
+            self.assertRaises(RuntimeError, core.main, argv)
+        publisher.close.assert_called_once_with()
+        with mock.patch.object(core, "run_daemon", side_effect=KeyboardInterrupt):
+            self.assertRaises(KeyboardInterrupt, core.main, argv + ["--daemon"])
+        assert publisher.close.call_count == 2
+
+    def test_main_site_output(self):
+        argv = ["--middleware", "bar", "--publisher", "boom", "a.yaml", "b.yaml"]
+        publisher_class = self.eps["cip.publishers"][1].load.return_value
+        for single_output, site_output in ((True, "combined"), (False, "separate")):
+            publisher_class.single_output = single_output
+            with mock.patch.object(core, "run") as m_run:
+                core.main(argv)
+            assert m_run.call_args.args[0].site_output == site_output
+        # several outputs one after another in a single output
+        publisher_class.single_output = True
+        with mock.patch("sys.stderr"):
+            self.assertRaises(
+                SystemExit, core.main, argv + ["--site-output", "separate"]
+            )
+        with mock.patch.object(core, "run") as m_run:
+            core.main(argv[:-1] + ["--site-output", "separate"])
+        assert m_run.call_args.args[0].site_output == "separate"
+
+    def test_main_version(self):
+        with mock.patch("sys.stdout"):
+            self.assertRaises(SystemExit, core.main, ["--version"])
+        for eps in self.eps.values():
+            for ep in eps:
+                ep.load.assert_not_called()
+
+    def test_main_diff_needs_state_file(self):
+        with mock.patch("sys.stderr"):
+            self.assertRaises(
+                SystemExit, core.main, ["--middleware", "bar", "--diff", "site.yaml"]
+            )
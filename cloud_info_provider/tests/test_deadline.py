@@ -0,0 +1,41 @@
+"""
+Tests for the deadline of a run
+"""
+
+import concurrent.futures
+
+from cloud_info_provider import deadline, tracing
+from cloud_info_provider.exceptions import DeadlineExceeded
+from cloud_info_provider.tests import base
+
+
+class DeadlineTest(base.TestCase):
+    def test_no_deadline(self):
+        with deadline.start(None) as d:
+            assert d is None
+            assert deadline.timeout() is None
+            assert deadline.timeout(10) == 10
+            assert not deadline.expired()
+            deadline.check()
+
+    def test_timeout(self):
+        with deadline.start(60) as d:
+            assert deadline.current() is d
+            assert 59 < deadline.timeout() <= 60
+            assert deadline.timeout(10) == 10
+            assert deadline.timeout((5, None))[0] == 5
+            assert 59 < deadline.timeout((5, None))[1] <= 60
+            d.expires = 0
+            assert deadline.expired()
+            self.assertRaises(DeadlineExceeded, deadline.timeout, 10)
+            e = self.assertRaises(DeadlineExceeded, deadline.check)
+            assert str(e) == "Run deadline of 60 seconds exceeded"
+        assert deadline.current() is None
+
+    def test_propagate(self):
+        with deadline.start(0):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                propagated = executor.submit(tracing.propagate(deadline.expired))
+                other = executor.submit(deadline.expired)
+        assert propagated.result()
+        assert not other.result()
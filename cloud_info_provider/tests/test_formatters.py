@@ -0,0 +1,85 @@
+"""
+Tests for the formatters
+"""
+
+import json
+
+from cloud_info_provider import glue
+from cloud_info_provider.formatters import glue as glue_formatter
+from cloud_info_provider.tests import base
+
+
+class GLUE21JsonTest(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.formatter = glue_formatter.GLUE21Json()
+        share = glue.Share(id="share", other_info={"foo": "bar"}, total_vm=3)
+        itype = glue.CloudComputingInstanceType(id="itype", cpu=2)
+        itype.add_associated_object(share)
+        self.glue = {
+            "CloudComputingService": [
+                glue.CloudComputingService(id="svc", status_info="ok")
+            ],
+            "Share": [share, glue.Share(id="other")],
+            "CloudComputingInstanceType": [itype],
+            "CloudComputingImage": [],
+        }
+
+    def test_format(self):
+        expected = {
+            name: [self.formatter.dump_glue_object(o) for o in objs]
+            for name, objs in self.glue.items()
+        }
+        assert self.formatter.document(None, self.glue) == expected
+        output = self.formatter.format(None, self.glue)
+        assert output == json.dumps(expected, default=str)
+        itype = json.loads(output)["CloudComputingInstanceType"][0]
+        assert itype["NetworkIn"] == "UNKNOWN"
+        assert itype["Associations"] == {"Share": ["share"]}
+
+    def test_format_empty(self):
+        assert self.formatter.format(None, {}) == "{}"
+
+    def test_iter_encode(self):
+        document = self.formatter.document(None, self.glue)
+        assert "".join(self.formatter.iter_encode(document)) == self.formatter.format(
+            None, self.glue
+        )
+
+    def test_iter_format(self):
+        chunks = list(self.formatter.iter_format(None, self.glue))
+        # one chunk per object
+        assert len([c for c in chunks if c.startswith('{"ID"')]) == 4
+        assert "".join(chunks) == self.formatter.format(None, self.glue)
+
+    def test_dump_glue_object(self):
+        objs = [
+            glue.CloudComputingService(id="svc", status_info="ok", total_vm=1),
+            glue.CloudComputingManager(
+                id="mgr", failover=glue.BoolEnum.FALSE, live_migration=True
+            ),
+            glue.CloudComputingEndpoint(
+                id="ept", url="https://foo", interface_name="bar", trusted_cas=[]
+            ),
+            glue.CloudComputingImage(id="img", other_info={"a": "b"}),
+            glue.CloudComputingInstanceType(id="itype", network_info="infiniband"),
+            glue.CloudComputingVirtualAccelerator(id="acc", type="GPU"),
+            glue.MappingPolicy(id="mp", rule=["VO:foo"]),
+            glue.AccessPolicy(id="ap", name="access"),
+            glue.Share(id="share", max_vm=0),
+            glue.GlueBase(id="base", validity=10),
+        ]
+        for o in objs:
+            o.add_association("Share", "share")
+            dumped = self.formatter.dump_glue_object(o)
+            reference = glue_formatter.reflection_dump(o)
+            assert dumped == reference
+            assert list(dumped) == list(reference)
+        mgr = self.formatter.dump_glue_object(objs[1])
+        assert mgr["ManagerFailover"] is False
+        assert mgr["ManagerLiveMigration"] is True
+        assert mgr["CreationTime"] == objs[1].creation_time.isoformat()
+
+    def test_serializer_cached(self):
+        serializer = glue_formatter.get_serializer(glue.Share)
+        assert serializer is glue_formatter.get_serializer(glue.Share)
@@ -0,0 +1,86 @@
+"""
+Tests for the Glue objects
+"""
+
+import copy
+import datetime
+import pickle
+
+from cloud_info_provider import glue
+from cloud_info_provider.tests import base
+
+
+class GlueBaseTest(base.TestCase):
+    def test_defaults_not_shared(self):
+        foo, bar = glue.Share(id="foo"), glue.Share(id="bar")
+        foo.add_association("Foo", "foo")
+        foo.other_info["foo"] = "bar"
+        assert bar.associations == {}
+        assert bar.other_info == {}
+        assert foo.creation_time <= glue.Share(id="baz").creation_time
+
+    def test_trusted(self):
+        # trusted builds the same objects as validating the values
+        now = datetime.datetime.now(datetime.timezone.utc)
+        kwargs = {
+            glue.CloudComputingService: {"status_info": "ok"},
+            glue.CloudComputingEndpoint: {"url": "https://foo", "interface_name": ""},
+            glue.CloudComputingVirtualAccelerator: {"type": "GPU"},
+            glue.Share: {"total_vm": 2, "other_info": {"foo": "bar"}},
+        }
+        for cls in (
+            glue.CloudComputingService,
+            glue.CloudComputingManager,
+            glue.CloudComputingEndpoint,
+            glue.CloudComputingImage,
+            glue.CloudComputingInstanceType,
+            glue.CloudComputingVirtualAccelerator,
+            glue.MappingPolicy,
+            glue.AccessPolicy,
+            glue.Share,
+        ):
+            kw = dict(kwargs.get(cls, {}), id="foo", creation_time=now)
+            trusted = cls.trusted(unknown="ignored", **kw)
+            validated = cls.model_validate(kw)
+            assert trusted == validated
+            # same fields in the same order
+            assert list(trusted.model_dump().items()) == list(
+                validated.model_dump().items()
+            )
+            assert trusted.model_fields_set == validated.model_fields_set
+            assert trusted.__pydantic_extra__ == validated.__pydantic_extra__
+            assert trusted.__pydantic_private__ == validated.__pydantic_private__
+            assert trusted.model_copy() == validated.model_copy()
+
+
+class GlueStoreTest(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.share = glue.Share(id="share")
+        self.itypes = [glue.CloudComputingInstanceType(id=str(i)) for i in range(3)]
+        for itype in self.itypes[:2]:
+            itype.add_associated_object(self.share)
+        self.store = glue.GlueStore([self.share] + self.itypes)
+
+    def test_mapping(self):
+        assert list(self.store) == ["Share", "CloudComputingInstanceType"]
+        assert self.store["CloudComputingInstanceType"] == self.itypes
+        assert self.store.get("CloudComputingImage") is None
+        # objects are only added once
+        self.store.add(self.share)
+        assert self.store["Share"] == [self.share]
+
+    def test_merge(self):
+        other = glue.GlueStore([self.share])
+        image = glue.CloudComputingImage(id="image")
+        other.add(image)
+        # associated while the share belongs to the other store
+        image.add_associated_object(self.share)
+        self.share.add_association("Foo", "bar")
+        self.store.merge(other)
+        assert self.store["Share"] == [self.share]
+        assert self.store["CloudComputingImage"] == [image]
+        # objects do not refer to their store
+        assert self.store == glue.GlueStore([self.share] + self.itypes + [image])
+        assert copy.deepcopy(image) == image
+        assert pickle.loads(pickle.dumps(self.share)) == self.share
@@ -1,3 +1,8 @@
+import concurrent.futures
+import os
+import time
+
+import fixtures
 import mock
 from cloud_info_provider.providers import utils
 from cloud_info_provider.tests import base
@@ -93,6 +98,17 @@ class GOCDBTest(base.TestCase):
             )
             assert {} == r
 
+    def test_request_call_gocdb_url(self):
+        with mock.patch("requests.get") as m_requests:
+            m_requests.return_value = mock.MagicMock()
+            utils.find_in_gocdb("foo", "bar", gocdb_url="http://localhost/gocdb/")
+            m_requests.assert_called_once_with(
+                "http://localhost/gocdb/",
+                params={"method": "get_service", "service_type": "bar"},
+                verify=True,
+                timeout=None,
+            )
+
     def test_goc_non_200(self):
         with mock.patch("requests.get") as m_requests:
             r = mock.MagicMock()
@@ -148,3 +164,204 @@ class GOCDBTest(base.TestCase):
             assert expected == utils.find_in_gocdb(
                 "https://horizon.baz.example.com:5000/v3", "bar"
             )
+
+    def test_goc_parse_error(self):
+        with mock.patch("requests.get") as m_requests:
+            r = mock.MagicMock()
+            r.status_code = 200
+            r.text = "<results><foo></results>"
+            m_requests.return_value = r
+            assert {} == utils.find_in_gocdb("foo", "bar")
+
+
+class GOCDBStreamTest(base.TestCase):
+    def _response(self, text, chunk_size=16):
+        r = mock.MagicMock()
+        r.status_code = 200
+        data = text.encode("utf-8")
+        r.iter_content.return_value = iter(
+            data[i : i + chunk_size] for i in range(0, len(data), chunk_size)
+        )
+        return r
+
+    def test_request_call_stream(self):
+        with mock.patch("requests.get") as m_requests:
+            m_requests.return_value = self._response("<results/>")
+            assert {} == utils.find_in_gocdb("foo", "bar", stream=True)
+            m_requests.assert_called_once_with(
+                "https://goc.egi.eu/gocdbpi/public/",
+                params={"method": "get_service", "service_type": "bar"},
+                verify=True,
+                timeout=None,
+                stream=True,
+            )
+            m_requests.return_value.close.assert_called_once_with()
+
+    def test_goc_stream_found(self):
+        with mock.patch("requests.get") as m_requests:
+            m_requests.return_value = self._response(sample_goc_ep_response)
+            expected = {"gocdb_id": "00000G0", "site_name": "BAR-FOO-SITE"}
+            assert expected == utils.find_in_gocdb(
+                "https://horizon.baz.example.com:5000/v3", "bar", stream=True
+            )
+
+    def test_goc_stream_stops_at_match(self):
+        text = sample_goc_response.replace(
+            "</results>", "<SERVICE_ENDPOINT>" + "x" * 1000 + "</broken>"
+        )
+        with mock.patch("requests.get") as m_requests:
+            r = self._response(text)
+            m_requests.return_value = r
+            expected = {"gocdb_id": "1234G0", "site_name": "FOO-BAR-SITE"}
+            assert expected == utils.find_in_gocdb(
+                "https://keystone.example.com:5000/v2.0", "bar", stream=True
+            )
+            # rest of the document is never read
+            assert next(r.iter_content.return_value, None) is not None
+            r.close.assert_called_once_with()
+
+    def test_goc_stream_parse_error(self):
+        with mock.patch("requests.get") as m_requests:
+            m_requests.return_value = self._response("<results><foo></results>")
+            assert {} == utils.find_in_gocdb("foo", "bar", stream=True)
+
+    def test_goc_stream_index(self):
+        index = utils._build_gocdb_index(
+            utils._iter_gocdb_services(self._response(sample_goc_ep_response))
+        )
+        assert index == {
+            "https://horizon.baz.example.com:5000/v3": {
+                "gocdb_id": "00000G0",
+                "site_name": "BAR-FOO-SITE",
+            }
+        }
+
+
+class GOCDBCacheTest(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = self.useFixture(fixtures.TempDir()).path
+
+    def _response(self, status_code=200, text=sample_goc_ep_response, etag="abc"):
+        r = mock.MagicMock()
+        r.status_code = status_code
+        r.text = text
+        r.headers = {"ETag": etag, "Last-Modified": "yesterday"}
+        return r
+
+    def test_cache_created(self):
+        with mock.patch("requests.get") as m_requests:
+            m_requests.return_value = self._response()
+            expected = {"gocdb_id": "00000G0", "site_name": "BAR-FOO-SITE"}
+            assert expected == utils.find_in_gocdb(
+                "https://horizon.baz.example.com:5000/v3/",
+                "bar",
+                cache_dir=self.cache_dir,
+            )
+            m_requests.assert_called_once_with(
+                "https://goc.egi.eu/gocdbpi/public/",
+                params={"method": "get_service", "service_type": "bar"},
+                headers={},
+                verify=True,
+                timeout=None,
+            )
+        cache = utils.load_cache(os.path.join(self.cache_dir, "gocdb-bar.json"))
+        assert cache["etag"] == "abc"
+        assert cache["index"] == {
+            "https://horizon.baz.example.com:5000/v3": expected,
+        }
+
+    def test_cache_fresh(self):
+        with mock.patch("requests.get") as m_requests:
+            m_requests.return_value = self._response()
+            utils.find_in_gocdb("foo", "bar", cache_dir=self.cache_dir)
+            m_requests.reset_mock()
+            expected = {"gocdb_id": "00000G0", "site_name": "BAR-FOO-SITE"}
+            assert expected == utils.find_in_gocdb(
+                "https://horizon.baz.example.com:5000/v3",
+                "bar",
+                cache_dir=self.cache_dir,
+            )
+            assert {} == utils.find_in_gocdb("foo", "bar", cache_dir=self.cache_dir)
+            m_requests.assert_not_called()
+
+    def test_cache_concurrent(self):
+        with mock.patch("requests.get") as m_requests:
+            m_requests.return_value = self._response()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(
+                    executor.map(
+                        lambda _: utils.find_in_gocdb(
+                            "https://horizon.baz.example.com:5000/v3",
+                            "bar",
+                            cache_dir=self.cache_dir,
+                        ),
+                        range(8),
+                    )
+                )
+            # only one of the threads gets the services from GOCDB
+            m_requests.assert_called_once()
+        assert all(
+            r == {"gocdb_id": "00000G0", "site_name": "BAR-FOO-SITE"} for r in results
+        )
+
+    def test_cache_revalidated(self):
+        cache_file = os.path.join(self.cache_dir, "gocdb-bar.json")
+        utils.save_cache(
+            cache_file,
+            {
+                "timestamp": time.time() - 100,
+                "etag": "abc",
+                "last_modified": "yesterday",
+                "index": {"https://foo.example.com/": {"gocdb_id": "1"}},
+            },
+        )
+        with mock.patch("requests.get") as m_requests:
+            m_requests.return_value = self._response(status_code=304, text="")
+            assert {"gocdb_id": "1"} == utils.find_in_gocdb(
+                "https://foo.example.com", "bar", cache_dir=self.cache_dir, cache_ttl=10
+            )
+            m_requests.assert_called_once_with(
+                "https://goc.egi.eu/gocdbpi/public/",
+                params={"method": "get_service", "service_type": "bar"},
+                headers={"If-None-Match": "abc", "If-Modified-Since": "yesterday"},
+                verify=True,
+                timeout=None,
+            )
+        assert time.time() - utils.load_cache(cache_file)["timestamp"] < 10
+
+    def test_cache_changed(self):
+        cache_file = os.path.join(self.cache_dir, "gocdb-bar.json")
+        utils.save_cache(
+            cache_file,
+            {
+                "timestamp": 0,
+                "etag": "old",
+                "index": {"https://foo.example.com/": {"gocdb_id": "1"}},
+            },
+        )
+        with mock.patch("requests.get") as m_requests:
+            m_requests.return_value = self._response(text=sample_goc_response)
+            assert {} == utils.find_in_gocdb(
+                "https://foo.example.com", "bar", cache_dir=self.cache_dir
+            )
+            expected = {"gocdb_id": "1234G0", "site_name": "FOO-BAR-SITE"}
+            assert expected == utils.find_in_gocdb(
+                "https://keystone.example.com:5000/v2.0",
+                "bar",
+                cache_dir=self.cache_dir,
+            )
+            m_requests.assert_called_once()
+        assert utils.load_cache(cache_file)["etag"] == "abc"
+
+    def test_cache_stale_on_error(self):
+        cache_file = os.path.join(self.cache_dir, "gocdb-bar.json")
+        utils.save_cache(
+            cache_file,
+            {"timestamp": 0, "index": {"https://foo.example.com/": {"gocdb_id": "1"}}},
+        )
+        with mock.patch("requests.get") as m_requests:
+            m_requests.side_effect = utils.requests.ConnectionError()
+            assert {"gocdb_id": "1"} == utils.find_in_gocdb(
+                "https://foo.example.com", "bar", cache_dir=self.cache_dir
+            )
@@ -0,0 +1,114 @@
+"""
+Tests for the accounting of HTTP requests
+"""
+
+import datetime
+import io
+
+import fixtures
+import mock
+import requests
+
+from cloud_info_provider import core, http_stats
+from cloud_info_provider.tests import base
+
+
+def make_response(method, url, status=200, content=b"", elapsed=0.01, headers=None):
+    r = requests.Response()
+    r.request = requests.Request(method, url).prepare()
+    r.url = url
+    r.status_code = status
+    r._content = content
+    r.headers.update(headers or {})
+    r.elapsed = datetime.timedelta(seconds=elapsed)
+    return r
+
+
+class HTTPStatsTest(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.useFixture(
+            fixtures.MonkeyPatch("cloud_info_provider.http_stats._stats", None)
+        )
+
+    def test_url_template(self):
+        assert (
+            http_stats.url_template("/v2.1/flavors/flavor-00001/os-extra_specs")
+            == "/v2.1/flavors/{id}/os-extra_specs"
+        )
+        assert (
+            http_stats.url_template("/v2/images/0a1b2c3d-ffff/file")
+            == "/v2/images/{id}/file"
+        )
+        assert http_stats.url_template("/v2.1/flavors/detail") == "/v2.1/flavors/detail"
+
+    def test_disabled(self):
+        http_stats.response_hook(make_response("GET", "http://foo/bar"))
+        assert http_stats.get_stats() is None
+
+    def test_record(self):
+        stats = http_stats.enable()
+        assert http_stats.enable() is stats
+        http_stats.register_endpoint("compute", "http://nova:8774/v2.1/")
+        http_stats.register_endpoint("image", "http://glance:9292")
+        for i, status in enumerate((200, 200, 404)):
+            http_stats.response_hook(
+                make_response(
+                    "GET",
+                    f"http://nova:8774/v2.1/flavors/{i}/os-extra_specs?foo=bar",
+                    status=status,
+                    content=b"1234",
+                    elapsed=0.02 * (i + 1),
+                )
+            )
+        http_stats.response_hook(
+            make_response(
+                "GET",
+                "http://glance:9292/v2/images",
+                headers={"Content-Length": "100"},
+                elapsed=3,
+            ),
+            stream=True,
+        )
+        http_stats.record_response(
+            make_response("GET", "https://goc.egi.eu/gocdbpi/public/"),
+            service="gocdb",
+            stream=True,
+        )
+        http_stats.response_hook(make_response("POST", "http://keystone/v3/auth"))
+
+        specs = stats.requests[("compute", "GET", "/v2.1/flavors/{id}/os-extra_specs")]
+        assert specs.count == 3
+        assert specs.bytes == 12
+        assert specs.statuses == {200: 2, 404: 1}
+        assert round(specs.max_time, 2) == 0.06
+        assert specs.quantile(0.5) == 0.05
+        assert specs.quantile(0.95) == 0.1
+        images = stats.requests[("image", "GET", "/v2/images")]
+        assert images.bytes == 100
+        assert images.quantile(1) == 5
+        assert stats.requests[("gocdb", "GET", "/gocdbpi/public/")].bytes == 0
+        assert ("keystone", "POST", "/v3/auth") in stats.requests
+
+        summary = stats.summary().splitlines()
+        assert len(summary) == 6
+        assert summary[-1] == "6 requests, 112 bytes"
+        stats.reset()
+        assert stats.requests == {}
+
+    def test_run_summary(self):
+        stats = http_stats.enable()
+        stats.record("GET", "http://foo/bar", 200, 10, 0.1)
+        provider, formatter, publisher = mock.Mock(), mock.Mock(), mock.Mock()
+        provider.fetch.side_effect = lambda: stats.record(
+            "GET", "http://foo/baz", 200, 10, 0.1
+        )
+        opts = mock.Mock(diff=False, deadline=None, trace_file=None, metrics_file=None)
+        stderr = self.useFixture(
+            fixtures.MockPatch("sys.stderr", new_callable=io.StringIO)
+        ).mock
+        core.run(opts, [provider], formatter, publisher)
+        # previous runs are not accounted
+        assert "/bar" not in stderr.getvalue()
+        assert "/baz" in stderr.getvalue()
+        assert "1 requests, 10 bytes" in stderr.getvalue()
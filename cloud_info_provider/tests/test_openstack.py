@@ -1,10 +1,20 @@
 import argparse
+import json
+import re
+from urllib.parse import parse_qsl, urlencode, urlparse
 
+import fixtures
 import keystoneauth1.loading.session
 import mock
-from cloud_info_provider import glue
-from cloud_info_provider.exceptions import OpenStackProviderException
+import novaclient.v2.flavors
+import requests
+from cloud_info_provider import deadline, glue
+from cloud_info_provider.exceptions import (
+    DeadlineExceeded,
+    OpenStackProviderException,
+)
 from cloud_info_provider.providers import openstack as os_provider
+from cloud_info_provider.providers import openstack_catalogue, openstack_session
 from cloud_info_provider.tests import base, data
 from cloud_info_provider.tests import utils as utils
 from keystoneauth1.exceptions import http as http_exc
@@ -12,6 +22,70 @@ from keystoneauth1.exceptions import http as http_exc
 FAKES = data.OS_FAKES
 
 
+def fake_servers_list(detailed=True, search_opts=None, marker=None, limit=None):
+    """Lists FAKES.servers filtering and paginating them like nova"""
+    servers = FAKES.servers
+    if search_opts and "status" in search_opts:
+        servers = [s for s in servers if s.status == search_opts["status"]]
+    if marker:
+        ids = [s.id for s in servers]
+        servers = servers[ids.index(marker) + 1 :]
+    return servers[:limit] if limit else servers
+
+
+def fake_images_list(filters=None, page_size=None):
+    """Lists FAKES.images filtering them by visibility and owner like glance"""
+    filters = filters or {}
+    images = []
+    for image in FAKES.images:
+        visibility = image.get("visibility", "public")
+        if filters.get("visibility", visibility) != visibility:
+            continue
+        if "owner" in filters and image.get("owner") != filters["owner"]:
+            continue
+        images.append(image)
+    return images
+
+
+def fake_nova_get(max_limit=1000):
+    """Returns a nova client get serving FAKES.flavors like nova
+
+    Flavors are listed in pages of max_limit flavors, with their extra specs
+    if microversion 2.61 is requested.
+    """
+
+    def get(url, headers=None):
+        url = urlparse(url)
+        flavors = {f.id: f for f in FAKES.flavors}
+        match = re.fullmatch("/flavors/([^/]+)/os-extra_specs", url.path)
+        if match:
+            return mock.Mock(), {"extra_specs": flavors[match.group(1)].d}
+        assert url.path == "/flavors/detail"
+        query = dict(parse_qsl(url.query))
+        ids = list(flavors)
+        start = ids.index(query["marker"]) + 1 if "marker" in query else 0
+        page = FAKES.flavors[start : start + max_limit]
+        body = {"flavors": []}
+        for f in page:
+            info = {k: v for k, v in f.d.items() if k in ("id", "name", "ram", "vcpus")}
+            info["disk"] = f.disk
+            info["os-flavor-access:is_public"] = f.is_public
+            if (headers or {}).get("X-OpenStack-Nova-API-Version") == "2.61":
+                info["extra_specs"] = f.d
+            body["flavors"].append(info)
+        if len(page) == max_limit:
+            next_query = urlencode(dict(query, marker=page[-1].id))
+            body["flavors_links"] = [
+                {
+                    "rel": "next",
+                    "href": f"http://nova.example.org/v2.1/flavors/detail?{next_query}",
+                }
+            ]
+        return mock.Mock(), body
+
+    return get
+
+
 class OpenStackProviderOptionsTest(base.TestCase):
     def test_populate_parser(self):
         parser = argparse.ArgumentParser(conflict_handler="resolve")
@@ -30,6 +104,14 @@ class OpenStackProviderOptionsTest(base.TestCase):
                 "--only-appdb-images",
                 "--select-flavors",
                 "public",
+                "--share-workers",
+                "4",
+                "--page-size",
+                "100",
+                "--image-filter",
+                "os_type=linux",
+                "--image-filter",
+                "tag=egi",
                 "site_config",
             ]
         )
@@ -40,6 +122,19 @@ class OpenStackProviderOptionsTest(base.TestCase):
         assert opts.insecure
         assert opts.only_appdb_images
         assert opts.select_flavors == "public"
+        assert opts.share_workers == 4
+        assert opts.page_size == 100
+        assert opts.image_filters == [("os_type", "linux"), ("tag", "egi")]
+
+    def test_populate_parser_bad_image_filter(self):
+        parser = argparse.ArgumentParser(conflict_handler="resolve")
+        os_provider.OpenStackProvider.populate_parser(parser)
+        with mock.patch("sys.stderr"):
+            self.assertRaises(
+                SystemExit,
+                parser.parse_args,
+                ["--image-filter", "foo", "site_config"],
+            )
 
 
 class OpenStackProviderAuthTest(base.TestCase):
@@ -54,6 +149,8 @@ class OpenStackProviderAuthTest(base.TestCase):
                 self.project_id = None
                 self.os_region = None
                 self.opts = mock.Mock()
+                self.site_config = data.DATA.site_config
+                self.session_pool = openstack_session.SessionPool()
 
         self.provider = FakeProvider(None)
 
@@ -73,6 +170,17 @@ class OpenStackProviderAuthTest(base.TestCase):
             assert "foo" == self.provider.project_id
             assert auth == self.provider.last_working_auth
 
+    def test_rescope_site_cloud(self):
+        self.provider.site_config = dict(data.DATA.site_config, cloud="foo")
+        with mock.patch.object(self.provider.session_pool, "get_cloud") as m_cloud:
+            m_cloud.return_value.config = {}
+            m_cloud.return_value.get_auth_args.return_value = {}
+            with mock.patch.object(self.provider.session_pool, "get"):
+                self.provider.rescope_project({"project_id": "foo"})
+                m_cloud.assert_called_once_with(self.provider.opts, "foo")
+                self.provider.rescope_project(None, os_cloud="bar")
+                m_cloud.assert_called_with(self.provider.opts, "bar")
+
     def test_rescope_fails(self):
         session = mock.Mock()
         session.get_project_id.side_effect = http_exc.Unauthorized()
@@ -90,6 +198,99 @@ class OpenStackProviderAuthTest(base.TestCase):
             )
 
 
+class SessionPoolTest(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.pool = openstack_session.SessionPool()
+        self.session = mock.Mock()
+        self.session.get_project_id.side_effect = lambda: "project"
+        self.m_loader = self.useFixture(
+            fixtures.MockPatch("keystoneauth1.loading.get_plugin_loader")
+        ).mock
+        auth_plugin = self.m_loader.return_value.load_from_options.return_value
+        auth_plugin.get_access.return_value = mock.Mock(
+            auth_token="token", **{"will_expire_soon.return_value": False}
+        )
+        self.m_session = self.useFixture(
+            fixtures.MockPatchObject(
+                keystoneauth1.loading.session.Session,
+                "load_from_options",
+                return_value=self.session,
+            )
+        ).mock
+        self.m_token = self.useFixture(
+            fixtures.MockPatchObject(openstack_session.v3, "Token")
+        ).mock
+        self.auth_args = {"auth_url": "https://foo.example.org:5000/v3", "user": "u"}
+
+    def test_same_project_reused(self):
+        auth = dict(self.auth_args, project_id="foo")
+        scoped = self.pool.get("password", auth)
+        assert scoped.project_id == "project"
+        assert scoped is self.pool.get("password", dict(auth))
+        self.m_loader.return_value.load_from_options.assert_called_once_with(**auth)
+        self.m_token.assert_not_called()
+        self.m_session.assert_called_once()
+
+    def test_rescope_with_token(self):
+        self.pool.get("password", dict(self.auth_args, project_id="foo"))
+        scoped = self.pool.get("password", dict(self.auth_args, project_id="bar"))
+        self.m_loader.return_value.load_from_options.assert_called_once()
+        self.m_token.assert_called_once_with(
+            auth_url="https://foo.example.org:5000/v3",
+            token="token",
+            project_id="bar",
+        )
+        assert scoped.auth_plugin is self.m_token.return_value
+        # all sessions share the HTTP connections
+        for call in self.m_session.call_args_list:
+            assert call.kwargs["session"] is self.pool._http
+
+    def test_rescope_with_token_fails(self):
+        self.pool.get("password", dict(self.auth_args, project_id="foo"))
+        projects = iter([http_exc.Forbidden(), "bar"])
+
+        def get_project_id():
+            p = next(projects)
+            if isinstance(p, Exception):
+                raise p
+            return p
+
+        self.session.get_project_id.side_effect = get_project_id
+        scoped = self.pool.get("password", dict(self.auth_args, project_id="bar"))
+        assert scoped.project_id == "bar"
+        self.m_token.assert_called_once()
+        assert self.m_loader.return_value.load_from_options.call_count == 2
+
+    def test_other_identity(self):
+        self.pool.get("password", dict(self.auth_args, project_id="foo"))
+        self.pool.get("password", dict(self.auth_args, user="v", project_id="bar"))
+        self.m_token.assert_not_called()
+        assert self.m_loader.return_value.load_from_options.call_count == 2
+
+    def test_invalidate(self):
+        auth = dict(self.auth_args, project_id="foo")
+        scoped = self.pool.get("password", auth)
+        self.pool.invalidate()
+        assert scoped is not self.pool.get("password", auth)
+        self.m_token.assert_not_called()
+
+    def test_request_timeout(self):
+        m_send = self.useFixture(
+            fixtures.MockPatchObject(requests.Session, "send")
+        ).mock
+        http = openstack_session.HTTPSession(30)
+        http.send(mock.sentinel.request)
+        m_send.assert_called_once_with(mock.sentinel.request, timeout=30)
+        http.send(mock.sentinel.request, timeout=5)
+        assert m_send.call_args.kwargs["timeout"] == 5
+        with deadline.start(10):
+            http.send(mock.sentinel.request)
+            assert 0 < m_send.call_args.kwargs["timeout"] <= 10
+        with deadline.start(0):
+            self.assertRaises(DeadlineExceeded, http.send, mock.sentinel.request)
+
+
 class OpenStackProviderTest(base.TestCase):
     # Do not limit diff output on failures
     maxDiff = None
@@ -105,10 +306,11 @@ class OpenStackProviderTest(base.TestCase):
                     self.project_id = "noproject"
 
             def __init__(self, opts):
-                self.objs = {}
+                self.objs = glue.GlueStore()
                 self.nova = mock.Mock()
-                self.nova.servers.list.return_value = FAKES.servers
-                self.nova.flavors.list.return_value = FAKES.flavors
+                self.nova.servers.list.side_effect = fake_servers_list
+                self.nova.client.get.side_effect = fake_nova_get()
+                self.nova.flavors = novaclient.v2.flavors.FlavorManager(self.nova)
                 self.nova.quotas.get.return_value = FAKES.quotas
                 self.nova.versions.get_current.return_value = FAKES.version
                 self.nova.api_version.get_string.return_value = "vx.y"
@@ -116,7 +318,7 @@ class OpenStackProviderTest(base.TestCase):
                 self.glance.http_client.get_endpoint.return_value = (
                     "http://glance.example.org:9292/v2"
                 )
-                self.glance.images.list.return_value = FAKES.images
+                self.glance.images.list.side_effect = fake_images_list
                 self.session = mock.Mock()
                 self.project_id = None
                 self.session.get_project_id.return_value = "TEST_PROJECT_ID"
@@ -127,6 +329,11 @@ class OpenStackProviderTest(base.TestCase):
                 self.os_region = None
                 self.select_flavors = "all"
                 self.all_images = False
+                self.share_workers = 1
+                self.page_size = 1000
+                self.image_filters = []
+                self.flavor_catalogue = openstack_catalogue.FlavorCatalogue()
+                self.image_catalogue = openstack_catalogue.ImageCatalogue()
                 self.flavor_properties = {
                     "infiniband": {"key": "infiniband", "value": "true"},
                     "flavor_gpu_number": {"key": "gpu_number", "value": None},
@@ -147,6 +354,7 @@ class OpenStackProviderTest(base.TestCase):
                 self.add_glue(glue.CloudComputingManager(id="baz"))
                 self._goc_info = {data.DATA.endpoint_url: {"foo": "bar"}}
                 self._ca_info = {data.DATA.endpoint_url: {"foo": "bar"}}
+                self._missing_info = []
                 self.last_working_auth = {"project_id": "foo"}
                 self.opts = mock.Mock()
                 self.opts.os_auth_type = "oidc"
@@ -222,11 +430,99 @@ class OpenStackProviderTest(base.TestCase):
         images = self.provider.build_share_images(share)
         expected_images = {"bar id", "foo.id", "baz id"}
         assert expected_images == {i.id for i in images}
+        # the image catalogue is kept for the whole run, start a new one
+        self.provider.image_catalogue = openstack_catalogue.ImageCatalogue()
         self.provider.all_images = False
         images = self.provider.build_share_images(share)
         expected_images = {"foo.id"}
         assert expected_images == {i.id for i in images}
 
+    def test_build_image_discarded_early(self):
+        image = dict(FAKES.images[1], APPLIANCE_ATTRIBUTES="{not json")
+        with mock.patch("json.loads") as m_loads:
+            assert self.provider.build_image(image, glue.Share(id="share")) is None
+            m_loads.assert_not_called()
+
+    def test_build_images_filters(self):
+        self.provider.page_size = 10
+        self.provider.image_filters = [("os_type", "linux"), ("tag", "a"), ("tag", "b")]
+        images = self.provider.iter_share_images(glue.Share(id="share"))
+        # nothing is listed until needed
+        self.provider.glance.images.list.assert_not_called()
+        assert ["foo.id"] == [i.id for i in images]
+        filters = {"status": "active", "os_type": "linux", "tag": ["a", "b"]}
+        assert self.provider.glance.images.list.call_args_list == [
+            mock.call(filters=dict(filters, visibility="public"), page_size=10),
+            mock.call(filters=dict(filters, owner=None), page_size=10),
+            mock.call(filters=dict(filters, visibility="shared"), page_size=10),
+        ]
+
+    def test_build_images_visibility(self):
+        self.provider.all_images = True
+        private = dict(FAKES.images[1], id="private", visibility="private", owner="bar")
+        shared = dict(FAKES.images[1], id="shared", visibility="shared")
+        self.useFixture(
+            fixtures.MockPatchObject(FAKES, "images", FAKES.images + (private, shared))
+        )
+        self.provider.project_id = "bar"
+        images = self.provider.build_share_images(glue.Share(id="bar"))
+        assert ["foo.id", "bar id", "baz id", "private", "shared"] == [
+            i.id for i in images
+        ]
+        self.provider.project_id = "baz"
+        images = self.provider.build_share_images(glue.Share(id="baz"))
+        assert ["foo.id", "bar id", "baz id", "shared"] == [i.id for i in images]
+        # public images are only listed once
+        visibility = [
+            c.kwargs["filters"].get("visibility")
+            for c in self.provider.glance.images.list.call_args_list
+        ]
+        assert visibility == ["public", None, "shared", None, "shared"]
+        # unless the visibility is filtered
+        self.provider.image_filters = [("visibility", "private")]
+        self.provider.project_id = "foo"
+        self.provider.glance.images.list.reset_mock()
+        self.provider.build_share_images(glue.Share(id="foo"))
+        self.provider.glance.images.list.assert_called_once_with(
+            filters={"status": "active", "visibility": "private"}, page_size=1000
+        )
+
+    def test_build_image_catalogue(self):
+        shares = [glue.Share(id="share1"), glue.Share(id="share2")]
+        with mock.patch("json.loads", wraps=json.loads) as m_loads:
+            images = [self.provider.build_image(FAKES.images[0], s) for s in shares]
+            m_loads.assert_called_once()
+        assert images[0] is images[1]
+        assert images[0].associations["Share"] == ["share1", "share2"]
+        # same id but different checksum is another image
+        image = dict(FAKES.images[0], checksum="other")
+        assert self.provider.build_image(image, shares[0]) is not images[0]
+
+    def test_reset(self):
+        self.provider.session_pool = mock.Mock()
+        shared = [
+            o
+            for obj_type in os_provider.SHARED_OBJ_TYPES
+            for o in self.provider.get_objs(obj_type)
+        ]
+        images = self.provider.build_share_images(glue.Share(id="share1"))
+        self.provider.reset()
+        assert not self.provider.objs
+        # images of the project are not listed again
+        again = self.provider.build_share_images(glue.Share(id="share2"))
+        assert images == again
+        assert again[0].associations["Share"] == ["share2"]
+        # public images, owned by and shared with the project
+        assert self.provider.glance.images.list.call_count == 3
+        self.provider.session_pool.invalidate.assert_not_called()
+        self.provider.reset(full=True)
+        self.provider.session_pool.invalidate.assert_called_once_with()
+        # endpoint and manager are built again by fetch
+        self.provider.objs = glue.GlueStore(shared)
+        images = self.provider.build_share_images(glue.Share(id="share3"))
+        assert images[0] is not again[0]
+        assert self.provider.glance.images.list.call_count == 6
+
     def test_build_instance_type(self):
         share = glue.Share(id="share")
         itype = self.provider.build_instance_type(FAKES.flavors[0], share)
@@ -315,6 +611,75 @@ class OpenStackProviderTest(base.TestCase):
         assert share.instance_max_cpu == 30
         assert share.instance_min_cpu == 30
 
+    def _flavor_requests(self, path):
+        return [
+            c
+            for c in self.provider.nova.client.get.call_args_list
+            if re.fullmatch(path, urlparse(c.args[0]).path)
+        ]
+
+    def test_build_instances_catalogue(self):
+        self.provider.select_flavors = "public"
+        for share_id in ("share1", "share2", "share3"):
+            share = glue.Share(id=share_id)
+            itypes = self.provider.build_share_instance_types(share)
+            assert {"1", "3"} == {i.id for i in itypes}
+            assert itypes[0].associations["Share"] == [share_id]
+        # public flavors are only listed once
+        assert len(self._flavor_requests("/flavors/detail")) == 1
+        self.provider.select_flavors = "all"
+        itypes = self.provider.build_share_instance_types(glue.Share(id="share"))
+        assert ["1", "2", "3"] == [i.id for i in itypes]
+        assert len(self._flavor_requests("/flavors/detail")) == 1
+        # extra specs are only fetched once per flavor
+        specs = self._flavor_requests("/flavors/.*/os-extra_specs")
+        assert sorted(c.args[0] for c in specs) == [
+            f"/flavors/{i}/os-extra_specs" for i in ("1", "2", "3")
+        ]
+        gpu = self.provider.get_first_obj("CloudComputingVirtualAccelerator")
+        assert gpu.number == 23
+
+    def test_build_instances_inline_specs(self):
+        self.provider.nova.versions.get_current.return_value = mock.Mock(version="2.96")
+        itypes = self.provider.build_share_instance_types(glue.Share(id="share"))
+        assert ["1", "2", "3"] == [i.id for i in itypes]
+        # extra specs come with the flavors
+        (listing,) = self._flavor_requests("/flavors/detail")
+        assert listing.kwargs["headers"] == {
+            "OpenStack-API-Version": "compute 2.61",
+            "X-OpenStack-Nova-API-Version": "2.61",
+        }
+        assert self._flavor_requests("/flavors/.*/os-extra_specs") == []
+        gpu = self.provider.get_first_obj("CloudComputingVirtualAccelerator")
+        assert gpu.number == 23
+
+    def test_build_instances_deadline(self):
+        nova_get = fake_nova_get()
+
+        def slow_get(url, headers=None):
+            # the deadline is over while listing the flavors
+            d.expires = 0
+            return nova_get(url, headers=headers)
+
+        self.provider.nova.client.get.side_effect = slow_get
+        with deadline.start(3600) as d:
+            self.assertRaises(
+                DeadlineExceeded,
+                self.provider.build_share_instance_types,
+                glue.Share(id="share"),
+            )
+        assert self._flavor_requests("/flavors/.*/os-extra_specs") == []
+
+    def test_build_instances_paginated(self):
+        self.provider.nova.client.get.side_effect = fake_nova_get(max_limit=2)
+        itypes = self.provider.build_share_instance_types(glue.Share(id="share"))
+        assert ["1", "2", "3"] == [i.id for i in itypes]
+        pages = self._flavor_requests("/flavors/detail")
+        assert [c.args[0] for c in pages] == [
+            "/flavors/detail?is_public=None",
+            "/flavors/detail?is_public=None&marker=2",
+        ]
+
     def test_build_quotas(self):
         share = glue.Share(id="share")
         self.provider.build_share_quotas(share)
@@ -324,6 +689,41 @@ class OpenStackProviderTest(base.TestCase):
         assert share.total_vm == 8
         assert share.max_vm == 4
         assert share.other_info["quotas"] == FAKES.quotas.get_dict()
+        # a single page per count
+        assert self.provider.nova.servers.list.call_count == 3
+        for call in self.provider.nova.servers.list.call_args_list:
+            assert call.kwargs["detailed"] is False
+
+    def test_build_quotas_paginated(self):
+        self.provider.page_size = 2
+        share = glue.Share(id="share")
+        self.provider.build_share_quotas(share)
+        assert share.running_vm == 3
+        assert share.halted_vm == 1
+        assert share.suspended_vm == 4
+        assert share.total_vm == 8
+        # 5 pages for all, 1 for SHUTOFF and 3 for SUSPENDED
+        assert self.provider.nova.servers.list.call_count == 9
+        self.provider.nova.servers.list.assert_any_call(
+            detailed=False,
+            search_opts={"status": "SUSPENDED"},
+            marker="server2",
+            limit=2,
+        )
+
+    def test_build_quotas_churn(self):
+        # servers halted between the listings are not counted as running
+        total = len(FAKES.servers)
+        self.provider.count_servers = lambda status=None: {
+            None: total,
+            "SHUTOFF": total,
+            "SUSPENDED": 4,
+        }[status]
+        share = glue.Share(id="share")
+        self.provider.build_share_quotas(share)
+        assert share.running_vm == 0
+        assert share.halted_vm == total
+        assert share.total_vm == total + 4
 
     def test_build_failing_share(self):
         def fail_rescope(auth):
@@ -340,9 +740,9 @@ class OpenStackProviderTest(base.TestCase):
 
     def test_build_shares(self):
         self.provider.build_shares()
-        # 2 shares and a global policy
+        # 2 shares and a global policy, 1 image shared by both shares
         # For each share:
-        # 1 image, 1 mapping policy, 3 flavors, 1 virtual accelerator
+        # 1 mapping policy, 3 flavors, 1 virtual accelerator
         shares = self.provider.get_objs("Share")
         assert {
             "https://foo.example.org:5000/v3_OpenStack_v3_share_foo1_bar",
@@ -350,9 +750,19 @@ class OpenStackProviderTest(base.TestCase):
         } == {s.id for s in shares}
         assert len(self.provider.get_objs("CloudComputingInstanceType")) == 6
         assert len(self.provider.get_objs("CloudComputingVirtualAccelerator")) == 2
-        assert len(self.provider.get_objs("CloudComputingImage")) == 2
+        assert len(self.provider.get_objs("CloudComputingImage")) == 1
+        assert self.provider.get_first_obj("CloudComputingImage").associations == {
+            "CloudComputingEndpoint": ["bar"],
+            "CloudComputingManager": ["baz"],
+            "Share": [
+                "https://foo.example.org:5000/v3_OpenStack_v3_share_foo1_bar",
+                "https://foo.example.org:5000/v3_OpenStack_v3_share_foo2_baz",
+            ],
+        }
         assert len(self.provider.get_objs("MappingPolicy")) == 2
         assert len(self.provider.get_objs("AccessPolicy")) == 1
+        # objects built without validation are valid
+        self.provider.validate_objs()
 
         bar_shares = [s for s in shares if s.project_id == "bar"][0]
         assert utils.compare_glue(
@@ -440,6 +850,99 @@ class OpenStackProviderTest(base.TestCase):
             self.provider.get_first_obj("AccessPolicy"),
         )
 
+    def test_build_shares_workers(self):
+        def dump(objs):
+            return {
+                k: [o.model_dump(exclude={"creation_time"}) for o in v]
+                for k, v in objs.items()
+            }
+
+        self.provider.build_shares()
+        serial = dump(self.provider.objs)
+
+        provider = self.provider.__class__(None)
+        provider.share_workers = 4
+        provider.build_shares()
+        parallel = dump(provider.objs)
+        assert list(serial) == list(parallel)
+        assert serial == parallel
+        # objects associated to the shares are in the merged store
+        for share in provider.get_objs("Share"):
+            itypes = [
+                i
+                for i in provider.get_objs("CloudComputingInstanceType")
+                if share.id in i.associations["Share"]
+            ]
+            assert ["1", "2", "3"] == [i.id for i in itypes]
+            for image in provider.get_objs("CloudComputingImage"):
+                assert share.id in image.associations["Share"]
+
+    def test_build_shares_workers_failing_share(self):
+        def fail_rescope(auth):
+            if auth["project_id"] == "bar":
+                raise OpenStackProviderException("err")
+            self.provider.project_id = auth["project_id"]
+
+        self.provider.share_workers = 2
+        self.provider.exit_on_share_errors = False
+        self.provider.rescope_project = fail_rescope
+        self.provider.build_shares()
+        assert self.provider.endpoint.health_state == "warning"
+        assert self.provider.endpoint.health_state_info == "err"
+        assert len(self.provider.get_objs("Share")) == 1
+        assert self.provider.get_first_obj("AccessPolicy").rule == ["VO:foo2"]
+
+    def test_build_shares_deadline(self):
+        def slow_rescope(auth):
+            if auth["project_id"] == "baz":
+                # the deadline is over while talking to the cloud
+                d.expires = 0
+                raise requests.exceptions.Timeout()
+            self.provider.project_id = auth["project_id"]
+
+        self.provider.rescope_project = slow_rescope
+        self.provider.exit_on_share_errors = True
+        with deadline.start(3600) as d:
+            self.provider.build_shares()
+        assert self.provider.endpoint.health_state == "warning"
+        assert self.provider.endpoint.health_state_info == (
+            "Run deadline of 3600 seconds exceeded, 1 of 2 shares missing"
+        )
+        assert len(self.provider.get_objs("Share")) == 1
+        assert self.provider.get_first_obj("AccessPolicy").rule == ["VO:foo1"]
+
+    def test_build_shares_deadline_images(self):
+        build_share_quotas = self.provider.build_share_quotas
+
+        def slow_quotas(share):
+            if self.provider.project_id == "baz":
+                d.expires = 0
+                raise requests.exceptions.Timeout()
+            build_share_quotas(share)
+
+        def rescope(auth):
+            self.provider.project_id = auth["project_id"]
+
+        self.provider.rescope_project = rescope
+        self.provider.build_share_quotas = slow_quotas
+        with deadline.start(3600) as d:
+            self.provider.build_shares()
+        (share,) = self.provider.get_objs("Share")
+        # the image is only associated to the share that was built
+        image = self.provider.get_first_obj("CloudComputingImage")
+        assert image.associations["Share"] == [share.id]
+
+    def test_fetch_deadline(self):
+        with deadline.start(0):
+            self.provider.fetch()
+        assert self.provider.service.complexity == "endpointType=1,share=0"
+        assert self.provider.endpoint.health_state == "warning"
+        assert self.provider.endpoint.health_state_info == (
+            "Run deadline of 0 seconds exceeded, 2 of 2 shares missing"
+        )
+        assert self.provider.endpoint.interface_version is None
+        self.provider.nova.versions.get_current.assert_not_called()
+
     def test_fetch_working_auth(self):
         self.provider.fetch()
         assert self.provider.service.complexity == "endpointType=1,share=2"
@@ -4,15 +4,316 @@ Tests for the publishers
 
 from __future__ import print_function
 
+import gzip
+import io
+import json
+import os
+import unittest
+
+import fixtures
 import mock
-from cloud_info_provider.publishers import stdout
-from cloud_info_provider.tests import base
+from cloud_info_provider import glue
+from cloud_info_provider.exceptions import (
+    CloudInfoException,
+    StompPublisherException,
+)
+from cloud_info_provider.formatters import glue as glue_formatter
+from cloud_info_provider.publishers import file as file_publisher
+from cloud_info_provider.publishers import stdout, stomp
+from cloud_info_provider.tests import base, fake_stomp
 
 
 class StdOutPublisherTest(base.TestCase):
+    def test_publish_glue(self):
+        publisher = stdout.StdOutPublisher(None)
+        formatter = mock.Mock()
+        with mock.patch.object(publisher, "publish_chunks") as m_publish:
+            publisher.publish_glue(formatter, "opts", "glue")
+            formatter.iter_format.assert_called_once_with("opts", "glue")
+            m_publish.assert_called_once_with(formatter.iter_format.return_value)
+
     def test_publish(self):
         publisher = stdout.StdOutPublisher(None)
         output = "foo"
         with mock.patch("builtins.print") as m_print:
             publisher.publish(output)
             m_print.assert_called_with(output)
+
+    def test_publish_chunks(self):
+        publisher = stdout.StdOutPublisher(None)
+        with mock.patch("sys.stdout") as m_stdout:
+            publisher.publish_chunks(iter(["{", '"foo": []', "}"]))
+            assert m_stdout.write.call_args_list == [
+                mock.call("{"),
+                mock.call('"foo": []'),
+                mock.call("}"),
+                mock.call("\n"),
+            ]
+
+
+class JSONStdOutPublisherTest(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.publisher = stdout.JSONStdOutPublisher(None)
+        self.stdout = self.useFixture(
+            fixtures.MockPatch("sys.stdout", new_callable=io.StringIO)
+        ).mock
+
+    def test_publish_chunks(self):
+        self.publisher.publish_chunks(iter(["{", '"foo": [1]', "}"]))
+        assert self.stdout.getvalue() == '{\n    "foo": [\n        1\n    ]\n}\n'
+
+    def test_publish_glue(self):
+        formatter = glue_formatter.GLUE21Json()
+        image = glue.CloudComputingImage(id="img", description="Bob's image")
+        with mock.patch("json.loads") as m_loads:
+            self.publisher.publish_glue(
+                formatter, None, {"CloudComputingImage": [image]}
+            )
+            m_loads.assert_not_called()
+        output = json.loads(self.stdout.getvalue())
+        assert output["CloudComputingImage"][0]["Description"] == "Bob's image"
+        assert self.stdout.getvalue() == (
+            json.dumps(
+                formatter.document(None, {"CloudComputingImage": [image]}),
+                indent=4,
+                sort_keys=True,
+            )
+            + "\n"
+        )
+
+
+class FilePublisherTest(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+
+        class Opts(object):
+            output_file = os.path.join(self.dir, "cloud-info.json")
+            output_compression = "none"
+
+        self.opts = Opts()
+        self.formatter = glue_formatter.GLUE21Json()
+        self.glue = {"Share": [glue.Share(id="share", total_vm=1)]}
+
+    def test_publish_glue(self):
+        publisher = file_publisher.FilePublisher(self.opts)
+        assert publisher.publish_glue(self.formatter, None, self.glue)
+        with open(self.opts.output_file) as f:
+            assert f.read() == self.formatter.format(None, self.glue)
+        # only the output and the hash are left in the directory
+        assert sorted(os.listdir(self.dir)) == [
+            "cloud-info.json",
+            "cloud-info.json.hash",
+        ]
+
+    def test_publish_glue_unchanged(self):
+        publisher = file_publisher.FilePublisher(self.opts)
+        publisher.publish_glue(self.formatter, None, self.glue)
+        # a new object with the same information but different CreationTime
+        same = {"Share": [glue.Share(id="share", total_vm=1)]}
+        with mock.patch("os.replace") as m_replace:
+            assert not publisher.publish_glue(self.formatter, None, same)
+            m_replace.assert_not_called()
+        changed = {"Share": [glue.Share(id="share", total_vm=2)]}
+        assert publisher.publish_glue(self.formatter, None, changed)
+        with open(self.opts.output_file) as f:
+            assert json.loads(f.read())["Share"][0]["TotalVM"] == 2
+        # written again if the output disappears
+        os.unlink(self.opts.output_file)
+        assert publisher.publish_glue(self.formatter, None, changed)
+
+    def test_publish_gzip(self):
+        self.opts.output_compression = "gzip"
+        publisher = file_publisher.FilePublisher(self.opts)
+        publisher.publish_glue(self.formatter, None, self.glue)
+        with gzip.open(self.opts.output_file, "rt") as f:
+            assert f.read() == self.formatter.format(None, self.glue)
+
+    def test_publish_compression_changed(self):
+        publisher = file_publisher.FilePublisher(self.opts)
+        assert publisher.publish_glue(self.formatter, None, self.glue)
+        # same content but a different output file
+        self.opts.output_compression = "gzip"
+        assert publisher.publish_glue(self.formatter, None, self.glue)
+        with gzip.open(self.opts.output_file, "rt") as f:
+            assert f.read() == self.formatter.format(None, self.glue)
+        assert not publisher.publish_glue(self.formatter, None, self.glue)
+
+    def test_publish_formatter_changed(self):
+        class OtherJson(glue_formatter.GLUE21Json):
+            pass
+
+        publisher = file_publisher.FilePublisher(self.opts)
+        assert publisher.publish_glue(self.formatter, None, self.glue)
+        assert publisher.publish_glue(OtherJson(), None, self.glue)
+
+    @unittest.skipIf(file_publisher.zstandard is None, "zstandard not installed")
+    def test_publish_zstd(self):
+        self.opts.output_compression = "zstd"
+        publisher = file_publisher.FilePublisher(self.opts)
+        publisher.publish_glue(self.formatter, None, self.glue)
+        with open(self.opts.output_file, "rb") as f:
+            output = file_publisher.zstandard.ZstdDecompressor().decompressobj()
+            output = output.decompress(f.read()).decode()
+        assert output == self.formatter.format(None, self.glue)
+
+    def test_zstd_not_available(self):
+        self.opts.output_compression = "zstd"
+        with mock.patch.object(file_publisher, "zstandard", None):
+            self.assertRaises(
+                CloudInfoException, file_publisher.FilePublisher, self.opts
+            )
+
+    def test_no_output_file(self):
+        self.opts.output_file = None
+        self.assertRaises(CloudInfoException, file_publisher.FilePublisher, self.opts)
+
+    def test_write_failure(self):
+        publisher = file_publisher.FilePublisher(self.opts)
+        with mock.patch("os.replace", side_effect=OSError()):
+            self.assertRaises(OSError, publisher.publish, "foo")
+        assert os.listdir(self.dir) == []
+
+    def test_content_hash(self):
+        document = self.formatter.document(None, self.glue)
+        digest = file_publisher.content_hash(document)
+        document["Share"][0]["CreationTime"] = "yesterday"
+        assert digest == file_publisher.content_hash(document)
+        document["Share"][0]["Name"] = "foo"
+        assert digest != file_publisher.content_hash(document)
+
+
+class StompPublisherTest(base.TestCase):
+    def setUp(self):
+        super().setUp()
+
+        class Opts(object):
+            stomp_host = "127.0.0.1"
+            stomp_port = None
+            stomp_ssl = False
+            stomp_user = "user"
+            stomp_password = "secret"
+            stomp_password_file = None
+            stomp_vhost = None
+            stomp_destination = "/topic/cloud-info"
+            stomp_batch_size = 0
+            stomp_window = 3
+            stomp_retries = 2
+            stomp_backoff = 1
+            insecure = False
+            timeout = 10
+
+        self.opts = Opts()
+        self.formatter = glue_formatter.GLUE21Json()
+        self.glue = {
+            "Share": [glue.Share(id=f"share{i}", total_vm=i) for i in range(10)],
+            "Manager": [glue.CloudComputingManager(id="manager")],
+        }
+        m_time = self.useFixture(fixtures.MockPatchObject(stomp, "time")).mock
+        self.m_sleep = m_time.sleep
+
+    def broker(self, **kwargs):
+        broker = fake_stomp.FakeBroker(**kwargs)
+        self.opts.stomp_port = broker.port
+        self.addCleanup(broker.__exit__)
+        return broker.__enter__()
+
+    def received(self, broker):
+        objs = {}
+        for _, body in broker.messages:
+            for name, values in json.loads(body).items():
+                objs.setdefault(name, []).extend(values)
+        return objs
+
+    def test_frame(self):
+        headers = {"destination": "/topic/a:b", "foo": "line\nbreak\\"}
+        reader = stomp.FrameReader(mock.Mock())
+        reader.sock.recv.side_effect = [
+            b"\n" + stomp.encode_frame("SEND", headers, b"body\0with nul")
+        ]
+        frame = reader.read()
+        assert frame.command == "SEND"
+        assert frame.headers == dict(headers, **{"content-length": "13"})
+        assert frame.body == b"body\0with nul"
+
+    def test_batch_messages(self):
+        document = self.formatter.document(None, self.glue)
+        messages = stomp.batch_messages(document)
+        assert len(messages) == 11
+        assert all(len(sum(json.loads(m).values(), [])) == 1 for m in messages)
+        max_bytes = max(len(m) for m in messages) * 4
+        batches = stomp.batch_messages(document, max_bytes)
+        assert 1 < len(batches) < 11
+        assert all(len(m) <= max_bytes for m in batches)
+        objs = {}
+        for m in batches:
+            for name, values in json.loads(m).items():
+                objs.setdefault(name, []).extend(values)
+        assert objs == document
+        assert len(stomp.batch_messages(document, 10**6)) == 1
+
+    def test_publish_glue(self):
+        broker = self.broker(receipt_delay=0.01)
+        publisher = stomp.StompPublisher(self.opts)
+        publisher.publish_glue(self.formatter, None, self.glue)
+        assert self.received(broker) == self.formatter.document(None, self.glue)
+        assert all(h["destination"] == "/topic/cloud-info" for h, _ in broker.messages)
+        assert broker.max_in_flight <= self.opts.stomp_window
+        # connection is reused for the next publication
+        publisher.publish_glue(self.formatter, None, self.glue)
+        assert len(broker.messages) == 22
+        assert broker.connections == 1
+        publisher.close()
+
+    def test_password(self):
+        assert stomp.StompPublisher(self.opts)._password == "secret"
+        self.opts.stomp_password = None
+        self.useFixture(fixtures.EnvironmentVariable("STOMP_PASSWORD", "from-env"))
+        assert stomp.StompPublisher(self.opts)._password == "from-env"
+        password_file = os.path.join(self.useFixture(fixtures.TempDir()).path, "pw")
+        with open(password_file, "w") as f:
+            f.write("from-file\n")
+        self.opts.stomp_password_file = password_file
+        assert stomp.StompPublisher(self.opts)._password == "from-file"
+        os.unlink(password_file)
+        self.assertRaises(StompPublisherException, stomp.StompPublisher, self.opts)
+
+    def test_publish(self):
+        broker = self.broker()
+        publisher = stomp.StompPublisher(self.opts)
+        publisher.publish("foo")
+        assert broker.messages[0][1] == b"foo"
+        publisher.close()
+
+    def test_retry_from_last_receipt(self):
+        broker = self.broker(errors=1, drop_after=5)
+        self.opts.stomp_window = 1
+        publisher = stomp.StompPublisher(self.opts)
+        publisher.publish_glue(self.formatter, None, self.glue)
+        assert broker.connections == 3
+        # the message without receipt is sent again, no message is lost
+        assert len(broker.messages) == 12
+        assert broker.messages[4][1] == broker.messages[5][1]
+        del broker.messages[4]
+        assert self.received(broker) == self.formatter.document(None, self.glue)
+        # progress resets the backoff
+        assert self.m_sleep.call_args_list == [mock.call(1), mock.call(1)]
+        publisher.close()
+
+    def test_retries_exhausted(self):
+        self.broker(errors=10)
+        self.opts.stomp_backoff = 2
+        publisher = stomp.StompPublisher(self.opts)
+        self.assertRaises(
+            StompPublisherException,
+            publisher.publish_glue,
+            self.formatter,
+            None,
+            self.glue,
+        )
+        assert self.m_sleep.call_args_list == [mock.call(2), mock.call(4)]
+
+    def test_no_destination(self):
+        self.opts.stomp_destination = None
+        self.assertRaises(StompPublisherException, stomp.StompPublisher, self.opts)
@@ -0,0 +1,95 @@
+"""
+Tests for the tracing of the phases of a run
+"""
+
+import concurrent.futures
+import json
+import os
+
+import fixtures
+
+from cloud_info_provider import tracing
+from cloud_info_provider.tests import base
+
+
+class TracingTest(base.TestCase):
+    def test_no_trace(self):
+        with tracing.span("foo") as s:
+            assert s is None
+        tracing.count_objects({"Share": [1]})
+
+    def test_nested_spans(self):
+        @tracing.traced
+        def build():
+            with tracing.span("inner", vo="vo1") as s:
+                s.count("Share", 2)
+
+        with tracing.trace("run") as root:
+            build()
+            build()
+        assert root.duration is not None
+        assert [c.name for c in root.children] == ["build", "build"]
+        inner = root.children[0].children[0]
+        assert inner.name == "inner"
+        assert inner.labels == {"vo": "vo1"}
+        assert inner.counts == {"Share": 2}
+        assert tracing.current_span() is None
+
+    def test_error(self):
+        with tracing.trace("run") as root:
+            try:
+                with tracing.span("foo"):
+                    raise ValueError("boom")
+            except ValueError:
+                pass
+        assert root.children[0].error == "ValueError: boom"
+        assert root.children[0].duration is not None
+        assert root.error is None
+
+    def test_propagate(self):
+        def work(i):
+            with tracing.span("work", i=i):
+                with tracing.span("step"):
+                    pass
+            return i
+
+        with tracing.trace("run") as root:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                assert list(executor.map(tracing.propagate(work), range(8))) == list(
+                    range(8)
+                )
+                # without propagation, spans in other threads are not recorded
+                executor.submit(work, 8).result()
+        assert sorted(c.labels["i"] for c in root.children) == list(range(8))
+        assert all(len(c.children) == 1 for c in root.children)
+
+    def test_metrics(self):
+        with tracing.trace("run") as root:
+            with tracing.span("fetch", site='site "1"'):
+                for vo in ("vo1", "vo1", "vo2"):
+                    with tracing.span("share", vo=vo) as s:
+                        s.count("Share", 1)
+        metrics = tracing.format_metrics(root)
+        prefix = "cloud_info_provider"
+        assert (
+            f'{prefix}_span_calls{{span="run/fetch/share",site="site \\"1\\"",'
+            'vo="vo1"} 2'
+        ) in metrics.splitlines()
+        assert (
+            f'{prefix}_objects{{span="run/fetch/share",type="Share",'
+            'site="site \\"1\\"",vo="vo1"} 2'
+        ) in metrics.splitlines()
+        assert f"{prefix}_last_run_success 1" in metrics.splitlines()
+
+    def test_write(self):
+        path = self.useFixture(fixtures.TempDir()).path
+        with tracing.trace("run") as root:
+            with tracing.span("fetch"):
+                pass
+        tracing.write_trace(os.path.join(path, "trace.json"), root)
+        tracing.write_metrics(os.path.join(path, "metrics.prom"), root)
+        with open(os.path.join(path, "trace.json")) as f:
+            trace = json.load(f)
+        assert trace["name"] == "run"
+        assert trace["children"][0]["name"] == "fetch"
+        assert sorted(os.listdir(path)) == ["metrics.prom", "trace.json"]
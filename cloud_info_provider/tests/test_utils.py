@@ -0,0 +1,46 @@
+"""
+Tests for the common utilities
+"""
+
+import gzip
+import os
+
+import fixtures
+
+from cloud_info_provider import utils
+from cloud_info_provider.tests import base
+
+
+class WriteAtomicTest(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(self.dir, "out")
+
+    def test_write_atomic(self):
+        utils.write_atomic(self.path, b"foo")
+        utils.write_atomic(self.path, iter([b"bar", b"baz"]))
+        with open(self.path, "rb") as f:
+            assert f.read() == b"barbaz"
+        assert os.stat(self.path).st_mode & 0o777 == 0o644
+        assert os.listdir(self.dir) == ["out"]
+
+    def test_write_atomic_wrap(self):
+        utils.write_atomic(
+            self.path, b"foo", wrap=lambda f: gzip.GzipFile(fileobj=f, mode="wb")
+        )
+        with gzip.open(self.path) as f:
+            assert f.read() == b"foo"
+
+    def test_write_atomic_error(self):
+        utils.write_atomic(self.path, b"foo")
+
+        def chunks():
+            yield b"bar"
+            raise ValueError("broken")
+
+        self.assertRaises(ValueError, utils.write_atomic, self.path, chunks())
+        # the previous file is kept and the temporary one removed
+        with open(self.path, "rb") as f:
+            assert f.read() == b"foo"
+        assert os.listdir(self.dir) == ["out"]
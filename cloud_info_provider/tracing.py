@@ -0,0 +1,215 @@
+"""
+Timing of the phases of a run
+
+Phases are recorded as nested spans. The current span is kept in a context
+variable, so functions run in other threads need to be wrapped with
+`propagate` to record their spans under the span that submitted them.
+"""
+
+import contextlib
+import contextvars
+import functools
+import json
+import threading
+import time
+
+from cloud_info_provider.utils import write_atomic
+
+_current = contextvars.ContextVar("cloud_info_provider_span", default=None)
+_lock = threading.Lock()
+
+METRIC_PREFIX = "cloud_info_provider"
+
+
+class Span:
+    """A timed phase of the run
+
+    labels identify the span (e.g. the site or VO it belongs to) and are
+    inherited by its children in the metrics. counts keep the number of
+    objects produced by the phase.
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.counts = {}
+        self.children = []
+        self.error = None
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    def finish(self, error=None):
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.error = f"{error.__class__.__name__}: {error}"
+
+    def as_dict(self):
+        d = {
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+        }
+        if self.labels:
+            d["labels"] = self.labels
+        if self.counts:
+            d["counts"] = self.counts
+        if self.error:
+            d["error"] = self.error
+        if self.children:
+            d["children"] = [child.as_dict() for child in self.children]
+        return d
+
+
+@contextlib.contextmanager
+def _enter(s):
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.finish(e)
+        raise
+    else:
+        s.finish()
+    finally:
+        _current.reset(token)
+
+
+def trace(name, **labels):
+    """Starts a new trace, yields its root span"""
+    return _enter(Span(name, **labels))
+
+
+@contextlib.contextmanager
+def span(name, **labels):
+    """Records a span under the current one
+
+    Yields the span, or None if there is no trace in progress.
+    """
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    s = Span(name, **labels)
+    with _lock:
+        parent.children.append(s)
+    with _enter(s):
+        yield s
+
+
+def current_span():
+    return _current.get()
+
+
+def count_objects(glue):
+    """Records the number of Glue objects by type in the current span"""
+    s = _current.get()
+    if s is not None:
+        for obj_type, objs in glue.items():
+            s.count(obj_type, len(objs))
+
+
+def traced(func):
+    """Decorator recording every call of func as a span named after it"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def propagate(func):
+    """Returns func running in the context of the caller, for other threads"""
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # a context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def write_trace(path, root):
+    """Writes the spans of the trace as JSON"""
+    write_atomic(path, (json.dumps(root.as_dict(), indent=2) + "\n").encode())
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    return ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+
+
+def _aggregate(s, path, labels, durations, objects):
+    path = f"{path}/{s.name}" if path else s.name
+    labels = dict(labels, **s.labels)
+    key = _format_labels(dict(span=path, **labels))
+    total, calls = durations.get(key, (0, 0))
+    durations[key] = (total + (s.duration or 0), calls + 1)
+    for obj_type, value in s.counts.items():
+        obj_key = _format_labels(dict(span=path, type=obj_type, **labels))
+        objects[obj_key] = objects.get(obj_key, 0) + value
+    for child in s.children:
+        _aggregate(child, path, labels, durations, objects)
+
+
+def format_metrics(root):
+    """Returns the trace in the Prometheus text format
+
+    Spans with the same path and labels (e.g. the same phase for every
+    share of a site) are added up.
+    """
+    durations = {}
+    objects = {}
+    _aggregate(root, "", {}, durations, objects)
+    lines = [
+        f"# HELP {METRIC_PREFIX}_span_duration_seconds Time spent in each phase "
+        "of the last run.",
+        f"# TYPE {METRIC_PREFIX}_span_duration_seconds gauge",
+    ]
+    lines.extend(
+        f"{METRIC_PREFIX}_span_duration_seconds{{{k}}} {v[0]:.6f}"
+        for k, v in durations.items()
+    )
+    lines.extend(
+        [
+            f"# HELP {METRIC_PREFIX}_span_calls Times each phase ran in the last run.",
+            f"# TYPE {METRIC_PREFIX}_span_calls gauge",
+        ]
+    )
+    lines.extend(
+        f"{METRIC_PREFIX}_span_calls{{{k}}} {v[1]}" for k, v in durations.items()
+    )
+    lines.extend(
+        [
+            f"# HELP {METRIC_PREFIX}_objects Objects produced by each phase of "
+            "the last run.",
+            f"# TYPE {METRIC_PREFIX}_objects gauge",
+        ]
+    )
+    lines.extend(f"{METRIC_PREFIX}_objects{{{k}}} {v}" for k, v in objects.items())
+    lines.extend(
+        [
+            f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds Start of the last run.",
+            f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+            f"{METRIC_PREFIX}_last_run_timestamp_seconds {root.start:.3f}",
+            f"# HELP {METRIC_PREFIX}_last_run_success Whether the last run "
+            "succeeded.",
+            f"# TYPE {METRIC_PREFIX}_last_run_success gauge",
+            f"{METRIC_PREFIX}_last_run_success {0 if root.error else 1}",
+        ]
+    )
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path, root):
+    """Writes the trace as a Prometheus textfile collector file"""
+    write_atomic(path, format_metrics(root).encode())
@@ -1,5 +1,6 @@
 import json
 import os
+import tempfile
 
 
 def env(*args, **kwargs):
@@ -20,3 +21,31 @@ def pythonize_network_info(network_info):
         return json.loads(network_info.replace(':"', '"').replace("=>", ":"))
     except AttributeError:
         return network_info
+
+
+def write_atomic(path, data, wrap=None):
+    """Atomically writes data, bytes or an iterable of bytes, into path
+
+    The data is written to a temporary file in the same directory, synced
+    and renamed as path, so readers never see a partial file. wrap returns
+    the writer to use for the temporary file, e.g. a compressor, which is
+    closed before syncing it.
+    """
+    if isinstance(data, bytes):
+        data = [data]
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer = wrap(f) if wrap else f
+            for chunk in data:
+                writer.write(chunk)
+            if writer is not f:
+                writer.close()
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise